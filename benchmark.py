@@ -5,7 +5,7 @@ from shutil import rmtree
 
 from ftmq.io import smart_read_proxies
 from ftmq.query import Query
-from ftmq.store import get_store
+from ftmq.store import SQLStore, get_store
 
 DATASET = "ec_meetings"
 
@@ -41,9 +41,61 @@ def benchmark(uri: str):
     q = Query().where(dataset=DATASET, schema="Event", date__gte=2023)
     with measure(prefix, "query"):
         _ = [p for p in view.entities(q)]
+    with measure(prefix, "stats"):
+        view.stats(q)
+
+    if isinstance(store, SQLStore):
+        with store.engine.begin() as conn:
+            conn.execute(store.table.delete())
+        with measure(prefix, "load"):
+            store.load(get_proxies(), defer_indexes=True)
+        with measure(prefix, "iterate (loaded)"):
+            _ = [p for p in store.iterate()]
+        with measure(prefix, "optimize"):
+            store.optimize()
+        view = store.query()
+        with measure(prefix, "query (optimized)"):
+            _ = [p for p in view.entities(q)]
+        with measure(prefix, "stats (optimized)"):
+            view.stats(q)
+        sorted_q = q.order_by("date", ascending=False)[:100]
+        with measure(prefix, "sort"):
+            _ = [p for p in view.entities(sorted_q)]
+        with measure(prefix, "optimize (sort keys)"):
+            store.optimize(sort_keys=True)
+        view = store.query()
+        with measure(prefix, "sort (sort keys)"):
+            _ = [p for p in view.entities(sorted_q)]
+        store.optimize(drop=True, sort_keys=True)
+        with measure(prefix, "optimize (entities)"):
+            store.optimize(entities=True)
+        view = store.query()
+        with measure(prefix, "query (entities)"):
+            _ = [p for p in view.entities(q)]
+        store.optimize(drop=True, entities=True)
+
+
+def benchmark_filters(rounds: int = 10):
+    proxies = [p for p in get_proxies()] * rounds
+    prefix = "Query"
+    print(prefix, len(proxies), "proxies")
+    q = Query().where(
+        dataset=DATASET, schema="Event", date__gte=2023, name__ilike="meeting"
+    )
+
+    with measure(prefix, "apply"):
+        _ = [p for p in proxies if q.apply(p)]
+
+    with measure(prefix, "compile"):
+        test = q.compile()
+        _ = [p for p in proxies if test(p)]
+
+    with measure(prefix, "batches"):
+        _ = [p for p in q.apply_batches(proxies)]
 
 
 if __name__ == "__main__":
+    benchmark_filters()
     os.mkdir(".benchmark")
     benchmark("memory:///")
     benchmark("leveldb://.benchmark/leveldb")
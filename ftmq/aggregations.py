@@ -1,30 +1,212 @@
-import statistics
+import math
 from collections import defaultdict
 from typing import Any, Generator, Iterable, TypeAlias
 
 from anystore.util import clean_dict
 from banal import ensure_list
 from followthemoney.types import registry
-from pydantic import BaseModel
+from pydantic import BaseModel, PrivateAttr
 
 from ftmq.enums import Aggregations, Fields, Properties
+from ftmq.exceptions import ValidationError
+from ftmq.sketches import HyperLogLog, SpaceSaving, TDigest, quantiles
 from ftmq.types import CE, CEGenerator
 from ftmq.util import prop_is_numeric, to_numeric
 
 Value: TypeAlias = int | float | str
 Values: TypeAlias = list[Value]
+# sketch aggregations return the quantiles or the top values with their counts
+Result: TypeAlias = Value | dict[str, float | None] | list[tuple[Value, int]]
+Sketch: TypeAlias = HyperLogLog | TDigest | SpaceSaving
+
+SKETCHES = {
+    Aggregations.approx_count: HyperLogLog,
+    Aggregations.quantile: TDigest,
+    Aggregations.top: SpaceSaving,
+}
+
+
+def get_proxy_values(
+    proxy: CE, prop: Properties | Fields
+) -> Generator[str, None, None]:
+    if prop == Fields.id:
+        yield proxy.id
+    elif prop == Fields.dataset:
+        yield from proxy.datasets
+    elif prop == Fields.schema:
+        yield proxy.schema.name
+    elif prop == Fields.year:
+        for value in proxy.get_type_values(registry.date):
+            yield value[:4]
+    else:
+        yield from proxy.get(prop, quiet=True)
+
+
+def add_partial(partials: list[float], value: float) -> None:
+    """
+    Add a float to a list of non-overlapping partial sums (Shewchuk's
+    algorithm, as used by `math.fsum`). The partials represent the exact sum,
+    so the result doesn't depend on the order of the values.
+    """
+    i = 0
+    for partial in partials:
+        if abs(value) < abs(partial):
+            value, partial = partial, value
+        hi = value + partial
+        lo = partial - (hi - value)
+        if lo:
+            partials[i] = lo
+            i += 1
+        value = hi
+    partials[i:] = [value]
+
+
+class Accumulator:
+    """
+    Running state of an aggregation function. Only `count` (distinct) needs to
+    keep the (distinct) values, all other functions use constant memory.
+
+    States can be serialized (`to_dict`) and merged: Sums are kept exact (int
+    total and float partials), so merging partial states of shards gives the
+    same result as a single pass over all values. The approximate functions
+    (`approx_count`, `quantile`, `top`) use bounded memory sketches.
+    """
+
+    __slots__ = (
+        "func",
+        "count",
+        "total",
+        "partials",
+        "min",
+        "max",
+        "distinct",
+        "sketch",
+    )
+
+    def __init__(self, func: Aggregations) -> None:
+        self.func = func
+        self.count = 0
+        self.total = 0
+        self.partials: list[float] = []
+        self.min: Value | None = None
+        self.max: Value | None = None
+        self.distinct: set[Value] = set()
+        self.sketch: Sketch | None = None
+        if func in SKETCHES:
+            self.sketch = SKETCHES[func]()
+
+    def add(self, value: Value) -> None:
+        if self.func == Aggregations.quantile and not isinstance(value, (int, float)):
+            value = to_numeric(value)
+            if value is None:
+                return
+        self.count += 1
+        if self.sketch is not None:
+            self.sketch.add(value)
+        elif self.func == Aggregations.count:
+            self.distinct.add(value)
+        elif self.func in (Aggregations.sum, Aggregations.avg):
+            if isinstance(value, int):
+                self.total += value
+            else:
+                add_partial(self.partials, value)
+        elif self.func == Aggregations.min:
+            if self.min is None or value < self.min:
+                self.min = value
+        elif self.func == Aggregations.max:
+            if self.max is None or value > self.max:
+                self.max = value
+
+    def merge(self, other: "Accumulator") -> "Accumulator":
+        if other.func != self.func:
+            raise ValidationError(
+                f"Can not merge `{other.func}` state into `{self.func}` state"
+            )
+        self.count += other.count
+        self.total += other.total
+        for value in other.partials:
+            add_partial(self.partials, value)
+        if other.min is not None and (self.min is None or other.min < self.min):
+            self.min = other.min
+        if other.max is not None and (self.max is None or other.max > self.max):
+            self.max = other.max
+        self.distinct.update(other.distinct)
+        if self.sketch is not None and other.sketch is not None:
+            self.sketch.merge(other.sketch)
+        return self
+
+    @property
+    def sum(self) -> int | float:
+        if not self.partials:
+            return self.total
+        return math.fsum([*self.partials, self.total])
+
+    @property
+    def value(self) -> Result | None:
+        if self.func == Aggregations.count:
+            return len(self.distinct)
+        if self.func == Aggregations.approx_count:
+            return self.sketch.count
+        if self.func == Aggregations.quantile:
+            if self.count:
+                return quantiles(self.sketch)
+            return None
+        if self.func == Aggregations.top:
+            return self.sketch.top() or None
+        if self.func == Aggregations.sum:
+            return self.sum
+        if self.func == Aggregations.avg:
+            if self.count:
+                return self.sum / self.count
+            return None
+        if self.func == Aggregations.min:
+            return self.min
+        if self.func == Aggregations.max:
+            return self.max
+
+    def to_dict(self) -> dict[str, Any]:
+        """
+        Json serializable partial state
+        """
+        data: dict[str, Any] = {"func": str(self.func), "count": self.count}
+        if self.sketch is not None:
+            data["sketch"] = self.sketch.to_dict()
+        elif self.func == Aggregations.count:
+            data["distinct"] = sorted(self.distinct, key=str)
+        elif self.func in (Aggregations.sum, Aggregations.avg):
+            data["total"] = self.total
+            data["partials"] = self.partials
+        elif self.func == Aggregations.min:
+            data["min"] = self.min
+        elif self.func == Aggregations.max:
+            data["max"] = self.max
+        return data
+
+    @classmethod
+    def from_dict(cls, data: dict[str, Any]) -> "Accumulator":
+        state = cls(Aggregations[data["func"]])
+        state.count = data.get("count", 0)
+        state.total = data.get("total", 0)
+        state.partials = list(data.get("partials", []))
+        state.min = data.get("min")
+        state.max = data.get("max")
+        state.distinct = set(data.get("distinct", []))
+        if "sketch" in data:
+            state.sketch = SKETCHES[state.func].from_dict(data["sketch"])
+        return state
 
 
 class Aggregation(BaseModel):
     prop: Properties | Fields
     func: Aggregations
-    values: Values = []
-    value: Value | None = None
+    value: Result | None = None
     group_props: list[Properties | Fields] | None = []
-    grouper: dict[Properties, dict[str, Values]] = defaultdict(
-        lambda: defaultdict(list)
+    groups: dict[Properties, dict[str, Result]] = defaultdict(dict)
+
+    _state: Accumulator | None = PrivateAttr(default=None)
+    _grouper: dict[Properties | Fields, dict[str, Accumulator]] = PrivateAttr(
+        default_factory=lambda: defaultdict(dict)
     )
-    groups: dict[Properties, dict[str, Value]] = defaultdict(dict)
 
     def __hash__(self) -> int:
         return hash((self.prop, self.func, *sorted(ensure_list(self.group_props))))
@@ -32,46 +214,60 @@ class Aggregation(BaseModel):
     def __eq__(self, other: Any) -> bool:
         return hash(self) == hash(other)
 
-    def get_value(self, values: Values) -> Value | None:
-        if self.func == "min":
-            return min(values)
-        if self.func == "max":
-            return max(values)
-        if self.func == "sum":
-            return sum(values)
-        if self.func == "avg":
-            return statistics.mean(values)
-        if self.func == "count":
-            return len(set(values))
+    @property
+    def state(self) -> Accumulator:
+        if self._state is None:
+            self._state = Accumulator(self.func)
+        return self._state
+
+    def get_group_state(self, prop: Properties | Fields, group: str) -> Accumulator:
+        grouper = self._grouper[prop]
+        if group not in grouper:
+            grouper[group] = Accumulator(self.func)
+        return grouper[group]
+
+    def get_value(self, values: Values) -> Result | None:
+        state = Accumulator(self.func)
+        for value in values:
+            state.add(value)
+        return state.value
 
     def get_proxy_values(
         self, proxy: CE, prop: Properties | Fields | None = None
     ) -> Generator[str, None, None]:
-        prop = prop or self.prop
-        if prop == Fields.id:
-            yield proxy.id
-        elif prop == Fields.dataset:
-            yield from proxy.datasets
-        elif prop == Fields.schema:
-            yield proxy.schema.name
-        elif prop == Fields.year:
-            for value in proxy.get_type_values(registry.date):
-                yield value[:4]
-        else:
-            yield from proxy.get(prop, quiet=True)
+        yield from get_proxy_values(proxy, prop or self.prop)
 
     def collect(self, proxy: CE) -> CE:
-        is_numeric = prop_is_numeric(proxy.schema, self.prop)
-        for value in self.get_proxy_values(proxy):
-            if is_numeric:
-                value = to_numeric(value)
-            if value is not None:
-                self.values.append(value)
-                for prop in self.group_props:
-                    for g in self.get_proxy_values(proxy, prop):
-                        self.grouper[prop][g].append(value)
+        values = get_proxy_values(proxy, self.prop)
+        if prop_is_numeric(proxy.schema, self.prop):
+            values = map(to_numeric, values)
+        values = [v for v in values if v is not None]
+        groups = {p: list(get_proxy_values(proxy, p)) for p in self.group_props}
+        self.collect_values(values, groups)
         return proxy
 
+    def collect_values(
+        self, values: Values, groups: dict[Properties | Fields, list[str]]
+    ) -> None:
+        """
+        Feed already extracted (and parsed) values of a proxy into the
+        accumulators
+
+        Args:
+            values: The (parsed) values of `self.prop`
+            groups: The group values of the proxy for each of `self.group_props`
+        """
+        if not values:
+            return
+        state = self.state
+        for value in values:
+            state.add(value)
+        for prop in self.group_props:
+            for g in groups[prop]:
+                group_state = self.get_group_state(prop, g)
+                for value in values:
+                    group_state.add(value)
+
     def apply(self, proxies: CEGenerator) -> CEGenerator:
         for proxy in proxies:
             yield self.collect(proxy)
@@ -81,10 +277,61 @@ class Aggregation(BaseModel):
         return self
 
     def __exit__(self, *args, **kwargs) -> None:
-        self.value = self.get_value(self.values)
+        self.value = self.state.value
+        for prop in self.group_props:
+            for g, state in self._grouper[prop].items():
+                self.groups[prop][g] = state.value
+
+    def get_state(self) -> dict[str, Any]:
+        """
+        Get the json serializable partial state of this aggregation that can be
+        merged with the states of other workers via `Aggregation.merge`
+        """
+        return {
+            "prop": str(self.prop),
+            "func": str(self.func),
+            "group_props": [str(p) for p in self.group_props],
+            "state": self.state.to_dict(),
+            "groups": {
+                str(prop): {g: s.to_dict() for g, s in self._grouper[prop].items()}
+                for prop in self.group_props
+            },
+        }
+
+    @classmethod
+    def from_state(cls, data: dict[str, Any]) -> "Aggregation":
+        agg = cls(
+            prop=data["prop"], func=data["func"], group_props=data["group_props"]
+        )
+        agg._state = Accumulator.from_dict(data["state"])
+        for prop in agg.group_props:
+            for g, state in data["groups"].get(str(prop), {}).items():
+                agg._grouper[prop][g] = Accumulator.from_dict(state)
+        agg.__exit__()
+        return agg
+
+    def merge(self, other: "Aggregation") -> "Aggregation":
+        """
+        Merge the partial state of another aggregation (of the same prop,
+        func and groups) into this one
+
+        Args:
+            other: The other aggregation (e.g. from another shard)
+
+        Returns:
+            The updated aggregation
+        """
+        if hash(other) != hash(self):
+            raise ValidationError(
+                f"Can not merge aggregation `{other.func}({other.prop})` into "
+                f"`{self.func}({self.prop})`"
+            )
+        self.state.merge(other.state)
         for prop in self.group_props:
-            for g, values in self.grouper[prop].items():
-                self.groups[prop][g] = self.get_value(values)
+            for g, state in other._grouper[prop].items():
+                self.get_group_state(prop, g).merge(state)
+        self.__exit__()
+        return self
 
     def dict(self, *args, **kwargs) -> dict[str, Any]:
         self.__exit__()
@@ -92,7 +339,7 @@ class Aggregation(BaseModel):
 
 
 AggregatorResult: TypeAlias = dict[
-    Aggregations | dict[str, Aggregations], dict[Properties, Value]
+    Aggregations | dict[str, Aggregations], dict[Properties, Result]
 ]
 
 
@@ -100,12 +347,53 @@ class Aggregator(BaseModel):
     aggregations: list[Aggregation] = []
     result: AggregatorResult = defaultdict(dict)
 
+    # schema name -> property -> is numeric
+    _plans: dict[str, dict[Properties | Fields, bool]] = PrivateAttr(
+        default_factory=dict
+    )
+
+    def get_plan(self, proxy: CE) -> dict[Properties | Fields, bool]:
+        """
+        Get the properties to extract from proxies of the given schema and
+        whether their values need to be parsed as numbers
+        """
+        schema = proxy.schema.name
+        if schema not in self._plans:
+            self._plans[schema] = {
+                agg.prop: prop_is_numeric(proxy.schema, agg.prop)
+                for agg in self.aggregations
+            }
+        return self._plans[schema]
+
+    def collect(self, proxy: CE) -> CE:
+        """
+        Collect the values of a proxy for all aggregations in one pass: Each
+        property is extracted and parsed only once.
+        """
+        values: dict[Properties | Fields, Values] = {}
+        for prop, is_numeric in self.get_plan(proxy).items():
+            prop_values = get_proxy_values(proxy, prop)
+            if is_numeric:
+                prop_values = map(to_numeric, prop_values)
+            values[prop] = [v for v in prop_values if v is not None]
+        groups: dict[Properties | Fields, list[str]] = {}
+        for agg in self.aggregations:
+            if not values[agg.prop]:
+                continue
+            for prop in agg.group_props:
+                if prop not in groups:
+                    groups[prop] = list(get_proxy_values(proxy, prop))
+            agg.collect_values(values[agg.prop], groups)
+        return proxy
+
     def __enter__(self) -> "Aggregator":
         return self
 
     def __exit__(self, *args, **kwargs) -> None:
+        self.result = defaultdict(dict)
         self.result["groups"] = defaultdict(lambda: defaultdict(dict))
         for agg in self.aggregations:
+            agg.__exit__()
             self.result[str(agg.func)][str(agg.prop)] = agg.value
             for group in agg.group_props:
                 self.result["groups"][str(group)][str(agg.func)][str(agg.prop)] = (
@@ -114,10 +402,64 @@ class Aggregator(BaseModel):
         self.result = clean_dict(self.result)
 
     def apply(self, proxies: CEGenerator) -> CEGenerator:
-        for agg in self.aggregations:
-            proxies = agg.apply(proxies)
-        yield from proxies
+        for proxy in proxies:
+            yield self.collect(proxy)
+        self.__exit__()
+
+    def get_state(self) -> dict[str, Any]:
+        """
+        Get the json serializable partial state of all aggregations. Workers
+        that aggregate shards of the data can ship their states to a
+        coordinator that combines them via `Aggregator.merge`.
+
+        Example:
+            ```python
+            # worker
+            aggregator = q.get_aggregator()
+            proxies = [p for p in aggregator.apply(shard)]
+            state = aggregator.get_state()
+
+            # coordinator
+            aggregator = Aggregator.from_state(states[0])
+            for state in states[1:]:
+                aggregator.merge(state)
+            aggregator.result
+            ```
+        """
+        return {"aggregations": [agg.get_state() for agg in self.aggregations]}
+
+    @classmethod
+    def from_state(cls, data: dict[str, Any]) -> "Aggregator":
+        aggregator = cls(
+            aggregations=[Aggregation.from_state(a) for a in data["aggregations"]]
+        )
+        aggregator.__exit__()
+        return aggregator
+
+    def merge(self, other: "Aggregator | dict[str, Any]") -> "Aggregator":
+        """
+        Merge the partial states of another aggregator into this one. The
+        result is the same as aggregating all data in a single pass.
+
+        Args:
+            other: The other aggregator or its state (via `get_state`)
+
+        Returns:
+            The updated aggregator
+        """
+        if isinstance(other, dict):
+            other = self.from_state(other)
+        aggregations = {hash(agg): agg for agg in self.aggregations}
+        for agg in other.aggregations:
+            key = hash(agg)
+            if key in aggregations:
+                aggregations[key].merge(agg)
+            else:
+                self.aggregations.append(agg)
+                aggregations[key] = agg
+        self._plans = {}
         self.__exit__()
+        return self
 
     @classmethod
     def from_dict(
@@ -0,0 +1,151 @@
+"""
+Columnar evaluation of query filters over chunks of proxies.
+
+Instead of testing each proxy against each filter, a chunk of proxies is pulled
+from the stream and for each filter the tested values are extracted into a
+flat column (together with the position of the proxy they belong to). Numeric
+and date ranges are compared vectorized via `numpy` (if installed), `in` /
+`not_in` lookups via set operations and all other comparators are evaluated
+once per distinct value. The result is the same as `Query.apply`.
+"""
+
+import os
+from itertools import islice
+from typing import Any, Iterable, Sequence
+
+from nomenklatura.entity import CE
+
+from ftmq.enums import Comparators
+from ftmq.filters import F, Lookup, sort_filters
+from ftmq.types import CEGenerator
+from ftmq.util import to_numeric
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+BATCH_SIZE = int(os.environ.get("BATCH_SIZE", 10_000))
+
+OPERATORS = {
+    Comparators.gt: "__gt__",
+    Comparators.gte: "__ge__",
+    Comparators.lt: "__lt__",
+    Comparators.lte: "__le__",
+}
+
+
+def get_column(f: F, proxies: Sequence[CE]) -> tuple[list[Any], list[int]]:
+    """
+    Extract the values a filter tests from a chunk of proxies
+
+    Returns:
+        The flat list of values and the index of the proxy for each value
+    """
+    values: list[Any] = []
+    owners: list[int] = []
+    for ix, proxy in enumerate(proxies):
+        for value in f.get_values(proxy):
+            values.append(value)
+            owners.append(ix)
+    return values, owners
+
+
+def _test_vectorized(f: F, values: list[Any]) -> Sequence[bool] | None:
+    lookup = f.lookup
+    if np is None or lookup.comparator not in OPERATORS:
+        return None
+    operator = OPERATORS[lookup.comparator]
+    if lookup.is_numeric:
+        # unparsable values become `nan` which fails every comparison
+        column = np.array([to_numeric(v) for v in values], dtype=np.float64)
+        return getattr(column, operator)(float(lookup.value))
+    if lookup.value is None or not all(isinstance(v, str) for v in values):
+        return None
+    if lookup.is_date:
+        if not lookup.value:
+            return None
+        # casting to a fixed size unicode type truncates the iso dates
+        column = np.array(values, dtype=f"U{len(lookup.value)}")
+    else:
+        column = np.array(values, dtype=np.str_)
+    return getattr(column, operator)(lookup.value)
+
+
+def eval_column(f: F, values: list[Any]) -> Sequence[bool]:
+    """
+    Test a column of values against a filter
+    """
+    if not values:
+        return []
+    mask = _test_vectorized(f, values)
+    if mask is not None:
+        return mask
+    distinct = set(values)
+    # schema filters test against their expanded schemata
+    if f.comparator == Lookup.IN and f.key != "schema":
+        passed = distinct & f.lookup.value
+    elif f.comparator == Lookup.NOT_IN and f.key != "schema":
+        passed = distinct - f.lookup.value
+    else:
+        test = f.compile_values()
+        passed = {v for v in distinct if test(v)}
+    return [v in passed for v in values]
+
+
+def reduce_any(mask: Sequence[bool], owners: list[int], size: int) -> Sequence[bool]:
+    """
+    Reduce the value mask to a proxy mask: A proxy passes if any of its values
+    passes
+    """
+    if np is not None:
+        result = np.zeros(size, dtype=bool)
+        owners = np.asarray(owners, dtype=np.intp)
+        result[owners[np.asarray(mask, dtype=bool)]] = True
+        return result
+    result = [False] * size
+    for passed, ix in zip(mask, owners):
+        if passed:
+            result[ix] = True
+    return result
+
+
+def apply_batch(filters: Iterable[F], proxies: list[CE]) -> list[CE]:
+    """
+    Filter a chunk of proxies, the cheapest filters first. Each filter is only
+    evaluated for the proxies that passed the previous ones.
+
+    Args:
+        filters: The filters to apply (AND)
+        proxies: The chunk of proxies
+
+    Returns:
+        The proxies that passed all filters (in their original order)
+    """
+    for f in filters:
+        if not proxies:
+            break
+        values, owners = get_column(f, proxies)
+        mask = reduce_any(eval_column(f, values), owners, len(proxies))
+        proxies = [p for p, passed in zip(proxies, mask) if passed]
+    return proxies
+
+
+def apply_batches(
+    filters: Iterable[F], proxies: Iterable[CE], batch_size: int | None = BATCH_SIZE
+) -> CEGenerator:
+    """
+    Filter a stream of proxies in chunks of `batch_size`
+
+    Args:
+        filters: The filters to apply (AND)
+        proxies: The proxies to filter
+        batch_size: Number of proxies per chunk
+
+    Yields:
+        The proxies that passed all filters (in their original order)
+    """
+    filters = sort_filters(filters)
+    proxies = iter(proxies)
+    while batch := list(islice(proxies, batch_size or BATCH_SIZE)):
+        yield from apply_batch(filters, batch)
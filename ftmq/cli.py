@@ -5,12 +5,19 @@ from anystore.util import clean_dict
 from click_default_group import DefaultGroup
 
 from ftmq.aggregate import aggregate
-from ftmq.io import apply_datasets, smart_read_proxies, smart_write_proxies
+from ftmq.io import (
+    apply_datasets,
+    smart_get_store,
+    smart_partition_proxies,
+    smart_read_proxies,
+    smart_write_proxies,
+)
 from ftmq.logging import configure_logging, get_logger
 from ftmq.model.coverage import Collector
 from ftmq.model.dataset import Catalog, Dataset
+from ftmq.profile import Profiler
 from ftmq.query import Query
-from ftmq.store import get_store
+from ftmq.store import SQLStore, get_store
 from ftmq.util import parse_unknown_filters
 
 log = get_logger(__name__)
@@ -48,6 +55,13 @@ def cli() -> None:
     default=True,
     show_default=True,
 )
+@click.option(
+    "--sort-buffer-size",
+    type=int,
+    default=None,
+    show_default=True,
+    help="Maximum number of entities to sort in memory, sort larger inputs on disk",
+)
 @click.option(
     "--stats-uri",
     default=None,
@@ -67,6 +81,21 @@ def cli() -> None:
 @click.option(
     "--count", multiple=True, help="Properties for count (distinct) aggregation"
 )
+@click.option(
+    "--approx-count",
+    multiple=True,
+    help="Properties for approximate count (distinct) aggregation",
+)
+@click.option(
+    "--quantile",
+    multiple=True,
+    help="Properties for approximate quantiles aggregation (see env `QUANTILES`)",
+)
+@click.option(
+    "--top",
+    multiple=True,
+    help="Properties for approximate most frequent values (see env `TOP_K`)",
+)
 @click.option("--groups", multiple=True, help="Properties for grouping aggregation")
 @click.option(
     "--aggregation-uri",
@@ -74,6 +103,25 @@ def cli() -> None:
     show_default=True,
     help="If specified, print aggregation information to this uri",
 )
+@click.option(
+    "--explain-uri",
+    default=None,
+    show_default=True,
+    help="If specified, print the query plan and stage timings to this uri",
+)
+@click.option(
+    "--fetch-size",
+    type=int,
+    default=None,
+    help="Number of rows to fetch at once from sql stores (env `SQL_FETCH_SIZE`)",
+)
+@click.option(
+    "--bulk-load/--no-bulk-load",
+    default=None,
+    help="Bulk load into sql stores (postgresql: `COPY`, sqlite: batched inserts "
+    "in WAL mode with `synchronous=OFF`, a crash during the load can corrupt the "
+    "database), default: if store is empty",
+)
 @click.argument("properties", nargs=-1)
 def q(
     input_uri: str | None = "-",
@@ -84,6 +132,7 @@ def q(
     schema_include_matchable: bool | None = False,
     sort: tuple[str] | None = None,
     sort_ascending: bool | None = True,
+    sort_buffer_size: int | None = None,
     properties: tuple[str] | None = (),
     stats_uri: str | None = None,
     store_dataset: str | None = None,
@@ -92,8 +141,14 @@ def q(
     max: tuple[str] | None = (),
     avg: tuple[str] | None = (),
     count: tuple[str] | None = (),
+    approx_count: tuple[str] | None = (),
+    quantile: tuple[str] | None = (),
+    top: tuple[str] | None = (),
     groups: tuple[str] | None = (),
     aggregation_uri: str | None = None,
+    explain_uri: str | None = None,
+    fetch_size: int | None = None,
+    bulk_load: bool | None = None,
 ):
     """
     Apply ftmq filter to a json stream of ftm entities.
@@ -110,7 +165,7 @@ def q(
     for prop, value, op in parse_unknown_filters(properties):
         q = q.where(**{f"{prop}__{op}": value})
     if len(sort):
-        q = q.order_by(*sort, ascending=sort_ascending)
+        q = q.order_by(*sort, ascending=sort_ascending, buffer_size=sort_buffer_size)
 
     if len(dataset) == 1:
         store_dataset = store_dataset or dataset[0]
@@ -122,17 +177,35 @@ def q(
             "max": max,
             "avg": avg,
             "count": count,
+            "approx_count": approx_count,
+            "quantile": quantile,
+            "top": top,
         }.items()
         if v
     }
     if aggregation_uri and aggs:
         for func, props in aggs.items():
             q = q.aggregate(func, *props, groups=groups)
-    proxies = smart_read_proxies(input_uri, dataset=store_dataset, query=q)
+    profiler = Profiler() if explain_uri else None
+    proxies = smart_read_proxies(
+        input_uri,
+        dataset=store_dataset,
+        query=q,
+        profiler=profiler,
+        fetch_size=fetch_size,
+    )
     if stats_uri:
         stats = Collector()
         proxies = stats.apply(proxies)
-    smart_write_proxies(output_uri, proxies, dataset=store_dataset)
+    smart_write_proxies(output_uri, proxies, dataset=store_dataset, bulk=bulk_load)
+    if profiler is not None:
+        store = smart_get_store(input_uri, dataset=store_dataset, fetch_size=fetch_size)
+        if store is not None:  # the plan of the store backend (e.g. sql)
+            explain = {**store.query().explain(q), "timings": profiler.timings}
+        else:
+            explain = {"plan": q.explain(), "timings": profiler.timings}
+        explain = orjson.dumps(explain, option=orjson.OPT_APPEND_NEWLINE)
+        smart_write(explain_uri, explain)
     if stats_uri:
         stats = stats.export()
         stats = orjson.dumps(stats.model_dump(), option=orjson.OPT_APPEND_NEWLINE)
@@ -144,6 +217,56 @@ def q(
         smart_write(aggregation_uri, result)
 
 
+@cli.command(
+    "partition",
+    context_settings=dict(
+        ignore_unknown_options=True,
+    ),
+)
+@click.option(
+    "-i", "--input-uri", default="-", show_default=True, help="input file or uri"
+)
+@click.option(
+    "-o",
+    "--output-uri",
+    required=True,
+    help="output uri template, e.g. `./data/{dataset}.ftm.json`",
+)
+@click.option(
+    "--by",
+    type=click.Choice(["dataset", "schema"]),
+    default="dataset",
+    show_default=True,
+    help="Partition by dataset or schema",
+)
+@click.option("-d", "--dataset", multiple=True, help="Dataset(s) to filter for")
+@click.option("-s", "--schema", multiple=True, help="Schema(s) to filter for")
+@click.argument("properties", nargs=-1)
+def partition(
+    input_uri: str | None = "-",
+    output_uri: str | None = None,
+    by: str | None = "dataset",
+    dataset: tuple[str] | None = (),
+    schema: tuple[str] | None = (),
+    properties: tuple[str] | None = (),
+):
+    """
+    Write a json stream of ftm entities partitioned by dataset or schema to
+    multiple outputs in one pass.
+    """
+    q = Query()
+    if dataset:
+        q = q.where(dataset__in=dataset)
+    if schema:
+        q = q.where(schema__in=schema)
+    for prop, value, op in parse_unknown_filters(properties):
+        q = q.where(**{f"{prop}__{op}": value})
+    proxies = smart_read_proxies(input_uri, query=q)
+    counts = smart_partition_proxies(output_uri, proxies, by)
+    for uri, count in counts.items():
+        log.info(f"Wrote {count} entities to `{uri}`")
+
+
 @cli.command("apply")
 @click.option(
     "-i", "--input-uri", default="-", show_default=True, help="input file or uri"
@@ -326,17 +449,82 @@ def store_resolve(
 @click.option(
     "-o", "--output-uri", default=None, show_default=True, help="output file or uri"
 )
+@click.option(
+    "--fetch-size",
+    type=int,
+    default=None,
+    help="Number of rows to fetch at once from sql stores (env `SQL_FETCH_SIZE`)",
+)
 def store_iterate(
     input_uri: str | None = "-",
     output_uri: str | None = "-",
+    fetch_size: int | None = None,
 ):
     """
     Iterate all entities from in to out
     """
-    store = get_store(input_uri)
+    store = get_store(input_uri, fetch_size=fetch_size)
     smart_write_proxies(output_uri, store.iterate())
 
 
+@store.command("optimize")
+@click.option(
+    "-i", "--input-uri", default="-", show_default=True, help="store input uri"
+)
+@click.option(
+    "--drop", is_flag=True, default=False, show_default=True, help="Drop the indexes"
+)
+@click.option(
+    "--analyze/--no-analyze",
+    default=True,
+    show_default=True,
+    help="Update the query planner statistics",
+)
+@click.option(
+    "--sort-keys",
+    is_flag=True,
+    default=False,
+    show_default=True,
+    help="Create (or drop) the sort key table for date and number properties",
+)
+@click.option(
+    "--typed-values",
+    is_flag=True,
+    default=False,
+    show_default=True,
+    help="Add (or drop) the typed columns for number and date values",
+)
+@click.option(
+    "--entities",
+    is_flag=True,
+    default=False,
+    show_default=True,
+    help="Create (or drop) the table of pre-assembled entities",
+)
+def store_optimize(
+    input_uri: str | None = "-",
+    drop: bool | None = False,
+    analyze: bool | None = True,
+    sort_keys: bool | None = False,
+    typed_values: bool | None = False,
+    entities: bool | None = False,
+):
+    """
+    Create (or drop) the query indexes of a sql store
+    """
+    store = get_store(input_uri)
+    if not isinstance(store, SQLStore):
+        raise click.BadParameter("Only sql stores can be optimized", param_hint="-i")
+    for name in store.optimize(
+        drop=drop,
+        analyze=analyze,
+        sort_keys=sort_keys,
+        typed_values=typed_values,
+        entities=entities,
+    ):
+        log.info(f"{'Dropped' if drop else 'Created'} index `{name}`")
+
+
 @cli.command("aggregate")
 @click.option(
     "-i", "--input-uri", default="-", show_default=True, help="input file or uri"
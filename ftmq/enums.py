@@ -71,7 +71,10 @@ Comparators = StrEnum(
     ],
 )
 Frequencies = StrEnum("Frequencies", DataCoverage.FREQUENCIES)
-Aggregations = StrEnum("Aggregations", ("min", "max", "sum", "avg", "count"))
+Aggregations = StrEnum(
+    "Aggregations",
+    ("min", "max", "sum", "avg", "count", "approx_count", "quantile", "top"),
+)
 Fields = StrEnum("Fields", ["id", "dataset", "schema", "year"])
 
 # aleph
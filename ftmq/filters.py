@@ -1,25 +1,54 @@
-from typing import Any, Iterable, TypeVar, Union
+from typing import Any, Callable, Iterable, TypeAlias, TypeVar, Union
 
 from banal import as_bool, ensure_list, is_listish
 from followthemoney import model
 from followthemoney.property import Property
 from followthemoney.schema import Schema
-from followthemoney.types import registry
+from followthemoney.types import PropertyType, registry
 from nomenklatura.entity import CE
 
-from ftmq.enums import Comparators
+from ftmq.enums import Comparators, PropertyTypesMap
 from ftmq.exceptions import ValidationError
+from ftmq.logging import get_logger
 from ftmq.types import Value
+from ftmq.util import to_numeric
+
+log = get_logger(__name__)
+
+ValueTest: TypeAlias = Callable[[str | None], bool]
+ProxyTest: TypeAlias = Callable[[CE], bool]
+
+
+def _never(value: Any) -> bool:
+    return False
 
 
 class Lookup:
     IN = Comparators["in"]
+    NOT_IN = Comparators["not_in"]
     EQUALS = Comparators["eq"]
     NULL = Comparators["null"]
+    RANGE = (Comparators.gt, Comparators.gte, Comparators.lt, Comparators.lte)
 
-    def __init__(self, comparator: Comparators, value: Value | None = None):
+    def __init__(
+        self,
+        comparator: Comparators,
+        value: Value | None = None,
+        prop_type: PropertyType | None = None,
+    ):
         self.comparator = self.get_comparator(comparator)
         self.value = value
+        self.prop_type = prop_type
+        self.is_numeric = prop_type == registry.number and self.comparator in self.RANGE
+        # iso dates are compared by prefix: "2023-05-01" is not greater than "2023"
+        self.is_date = prop_type == registry.date and self.comparator in (
+            Comparators.gt,
+            Comparators.lte,
+        )
+        if self.is_numeric:
+            self.value = to_numeric(value)
+            if self.value is None:
+                raise ValidationError(f"Invalid numeric value: `{value}`")
 
     def __str__(self) -> str:
         return str(self.comparator)
@@ -34,6 +63,12 @@ class Lookup:
             raise ValidationError(f"Invalid oparator: `{comparator}`")
 
     def apply(self, value: str | None) -> bool:
+        if self.is_numeric:
+            value = to_numeric(value)
+            if value is None:
+                return False
+        elif self.is_date:
+            value = value[: len(self.value)]
         if self.comparator == "eq":
             return value == self.value
         if self.comparator == "not":
@@ -62,8 +97,86 @@ class Lookup:
             return self.value.lower() in value.lower()
         return False
 
+    def compile(self) -> ValueTest:
+        """
+        Resolve the comparator once and return a specialized test function for
+        single values that behaves exactly like `Lookup.apply`
+        """
+        value = self.value
+        if self.comparator == "eq":
+            return lambda v: v == value
+        if self.comparator == "not":
+            return lambda v: v != value
+        if self.comparator == "in":
+            value = frozenset(value)
+            return lambda v: v in value
+        if self.comparator == "not_in":
+            value = frozenset(value)
+            return lambda v: v not in value
+        if self.comparator == "startswith":
+            return lambda v: v.startswith(value)
+        if self.comparator == "endswith":
+            return lambda v: v.endswith(value)
+        if self.comparator == "null":
+            return lambda v: not v == value
+        if self.comparator == "gt":
+            return lambda v: v > value
+        if self.comparator == "gte":
+            return lambda v: v >= value
+        if self.comparator == "lt":
+            return lambda v: v < value
+        if self.comparator == "lte":
+            return lambda v: v <= value
+        if self.comparator == "like":
+            return lambda v: value in v
+        if self.comparator == "ilike":
+            value = value.lower()
+            return lambda v: value in v.lower()
+        return _never
+
+    def compile_typed(self) -> ValueTest:
+        """
+        Like `Lookup.compile` but parse numeric values or truncate dates before
+        testing them
+        """
+        test = self.compile()
+        if self.is_numeric:
+
+            def _test(value: str | None) -> bool:
+                value = to_numeric(value)
+                if value is None:
+                    return False
+                return test(value)
+
+            return _test
+        if self.is_date:
+            size = len(self.value)
+            return lambda value: test(value[:size])
+        return test
+
+
+# additional (relative) evaluation cost per comparator
+COMPARATOR_COSTS = {
+    Comparators["eq"]: 0,
+    Comparators["not"]: 0,
+    Comparators["in"]: 0,
+    Comparators["not_in"]: 0,
+    Comparators["null"]: 0,
+    Comparators["startswith"]: 1,
+    Comparators["endswith"]: 1,
+    Comparators["gt"]: 1,
+    Comparators["gte"]: 1,
+    Comparators["lt"]: 1,
+    Comparators["lte"]: 1,
+    Comparators["like"]: 2,
+    Comparators["ilike"]: 3,
+}
+
 
 class BaseFilter:
+    # estimated (relative) cost to evaluate this filter against a proxy
+    base_cost: int = 1
+
     def __init__(
         self,
         value: Value,
@@ -90,6 +203,10 @@ class BaseFilter:
         # allow ordering (helpful for testing)
         return hash(self) > hash(other)
 
+    @property
+    def cost(self) -> int:
+        return self.base_cost + COMPARATOR_COSTS.get(self.comparator, 0)
+
     def to_dict(self) -> dict[str, Any]:
         if self.comparator == Lookup.EQUALS:
             key = self.key
@@ -97,11 +214,40 @@ class BaseFilter:
             key = f"{self.key}__{self.lookup}"
         return {key: self.value}
 
+    def serialize(self) -> list[Any]:
+        """
+        Canonical (json serializable, order independent) representation
+        """
+        value = self.value
+        if isinstance(value, (set, frozenset, list, tuple)):
+            value = sorted(value)
+        return [self.key, str(self.comparator), value]
+
     def apply(self, proxy: CE) -> bool:
         return self.lookup.apply(self.value)
 
+    def compile(self) -> ProxyTest:
+        """
+        Return a precomputed test function for proxies that behaves exactly like
+        `apply`
+        """
+        return self.apply
+
+    def get_values(self, proxy: CE) -> Iterable[Any]:
+        """
+        The values of a proxy this filter tests (used for columnar evaluation,
+        see `ftmq.batch`). A proxy matches if any of its values passes.
+        """
+        return ()
+
+    def compile_values(self) -> ValueTest:
+        """
+        Return the test function for single values returned by `get_values`
+        """
+        return self.lookup.compile()
+
     def get_casted_value(self, value: Any) -> Value:
-        if self.comparator == Lookup.IN:
+        if self.comparator in (Lookup.IN, Lookup.NOT_IN):
             return set([self.stringify(v) for v in ensure_list(value)])
         if self.comparator == Lookup.NULL:
             return as_bool(value)
@@ -117,6 +263,7 @@ class BaseFilter:
 
 class DatasetFilter(BaseFilter):
     key = "dataset"
+    base_cost = 2
 
     def apply(self, proxy: CE) -> bool:
         if self.comparator == Lookup.EQUALS:
@@ -126,6 +273,16 @@ class DatasetFilter(BaseFilter):
                 return True
         return False
 
+    def compile(self) -> ProxyTest:
+        if self.comparator == Lookup.EQUALS:
+            value = self.value
+            return lambda proxy: value in proxy.datasets
+        test = self.lookup.compile()
+        return lambda proxy: any(map(test, proxy.datasets))
+
+    def get_values(self, proxy: CE) -> Iterable[str]:
+        return proxy.datasets
+
 
 class SchemaFilter(BaseFilter):
     key = "schema"
@@ -158,11 +315,37 @@ class SchemaFilter(BaseFilter):
             return proxy.schema in self.schemata
         return self.lookup.apply(proxy.schema.name)
 
+    def serialize(self) -> list[Any]:
+        if len(self.schemata) > 1:
+            # include expanded descendants / matchable schemata
+            return [self.key, str(Lookup.IN), sorted(s.name for s in self.schemata)]
+        return super().serialize()
+
+    def compile(self) -> ProxyTest:
+        if len(self.schemata) > 1:
+            schemata = frozenset(self.schemata)
+            return lambda proxy: proxy.schema in schemata
+        test = self.lookup.compile()
+        return lambda proxy: test(proxy.schema.name)
+
+    def get_values(self, proxy: CE) -> Iterable[str]:
+        return (proxy.schema.name,)
+
+    def compile_values(self) -> ValueTest:
+        if len(self.schemata) > 1:
+            names = frozenset(s.name for s in self.schemata)
+            return lambda name: name in names
+        return self.lookup.compile()
+
 
 class PropertyFilter(BaseFilter):
+    base_cost = 4
+
     def __init__(self, prop: Property, value: Value, comparator: str | None = None):
         super().__init__(value, comparator)
         self.key = self.validate(prop)
+        self.prop_type = self.get_prop_type(self.key)
+        self.lookup = Lookup(self.comparator, self.value, self.prop_type)
 
     def apply(self, proxy: CE) -> bool:
         for value in proxy.get(self.key, quiet=True):
@@ -170,6 +353,24 @@ class PropertyFilter(BaseFilter):
                 return True
         return False
 
+    def compile(self) -> ProxyTest:
+        key = self.key
+        test = self.lookup.compile_typed()
+        return lambda proxy: any(map(test, proxy.get(key, quiet=True)))
+
+    def get_values(self, proxy: CE) -> Iterable[str]:
+        return proxy.get(self.key, quiet=True)
+
+    def compile_values(self) -> ValueTest:
+        return self.lookup.compile_typed()
+
+    def get_prop_type(self, prop: str) -> PropertyType | None:
+        name = prop.split(":")[-1]
+        try:
+            return PropertyTypesMap[name].value
+        except KeyError:
+            return None
+
     def validate(self, prop: str | Property) -> str:
         if isinstance(prop, Property):
             return prop.name
@@ -186,6 +387,7 @@ class ReverseFilter(BaseFilter):
     """
 
     key = "reverse"
+    base_cost = 10
 
     def apply(self, proxy: CE) -> bool:
         for prop, value in proxy.itervalues():
@@ -194,6 +396,23 @@ class ReverseFilter(BaseFilter):
                     return True
         return False
 
+    def compile(self) -> ProxyTest:
+        test = self.lookup.compile()
+        entity = registry.entity
+
+        def _test(proxy: CE) -> bool:
+            for prop, value in proxy.itervalues():
+                if prop.type == entity and test(value):
+                    return True
+            return False
+
+        return _test
+
+    def get_values(self, proxy: CE) -> Iterable[str]:
+        for prop, value in proxy.itervalues():
+            if prop.type == registry.entity:
+                yield value
+
 
 class IdFilter(BaseFilter):
     key = "id"
@@ -201,6 +420,13 @@ class IdFilter(BaseFilter):
     def apply(self, proxy: CE) -> bool:
         return self.lookup.apply(proxy.id)
 
+    def compile(self) -> ProxyTest:
+        test = self.lookup.compile()
+        return lambda proxy: test(proxy.id)
+
+    def get_values(self, proxy: CE) -> Iterable[str]:
+        return (proxy.id,)
+
 
 class EntityIdFilter(IdFilter):
     key = "entity_id"
@@ -220,6 +446,101 @@ Filter = Union[
 ]
 F = TypeVar("F", bound=Filter)
 
+
+def sort_filters(filters: Iterable[F]) -> list[F]:
+    """
+    Order filters by their estimated cost (cheapest first) in a deterministic way
+    """
+    return sorted(
+        filters, key=lambda f: (f.cost, f.key, str(f.lookup), str(f.value))
+    )
+
+
+class FilterChain:
+    """
+    A short-circuiting chain of compiled filters. Filters are evaluated in order
+    of their estimated cost. The first `sample_size` proxies are tested against
+    all filters to observe their selectivity, after that the chain is re-ordered
+    so that cheap filters that reject many proxies are evaluated first.
+    """
+
+    def __init__(self, filters: Iterable[F], sample_size: int | None = 1_000):
+        self.filters = sort_filters(filters)
+        self.tests = [f.compile() for f in self.filters]
+        self.sample_size = sample_size or 0
+        self.tested = 0
+        self.passed = [0 for _ in self.filters]
+        if self.sample_size and len(self.filters) > 1:
+            self._test = self._sample
+        else:
+            self._test = self._make_test()
+
+    def __call__(self, proxy: CE) -> bool:
+        return self._test(proxy)
+
+    def __len__(self) -> int:
+        return len(self.filters)
+
+    def _make_test(self) -> ProxyTest:
+        tests = tuple(self.tests)
+        if not tests:
+            return lambda proxy: True
+        if len(tests) == 1:
+            return tests[0]
+
+        def _test(proxy: CE) -> bool:
+            for test in tests:
+                if not test(proxy):
+                    return False
+            return True
+
+        return _test
+
+    def _sample(self, proxy: CE) -> bool:
+        result = True
+        for ix, test in enumerate(self.tests):
+            if test(proxy):
+                self.passed[ix] += 1
+            else:
+                result = False
+        self.tested += 1
+        if self.tested >= self.sample_size:
+            self.reorder()
+        return result
+
+    def get_rank(self, ix: int) -> float:
+        # expected cost per rejected proxy, lower is better
+        rejected = 1 - (self.passed[ix] / self.tested) if self.tested else 0.5
+        return self.filters[ix].cost / max(rejected, 0.001)
+
+    def reorder(self) -> None:
+        """
+        Order the filters by their observed selectivity and switch to the
+        short-circuiting evaluation
+        """
+        order = sorted(range(len(self.filters)), key=self.get_rank)
+        self.filters = [self.filters[ix] for ix in order]
+        self.tests = [self.tests[ix] for ix in order]
+        self.passed = [self.passed[ix] for ix in order]
+        self._test = self._make_test()
+        log.debug("Filter order", filters=[f.to_dict() for f in self.filters])
+
+    def explain(self) -> list[dict[str, Any]]:
+        """
+        Get the current evaluation order of the filters with their estimated
+        cost and observed selectivity (if any proxies were sampled yet)
+        """
+        return [
+            {
+                "filter": f.to_dict(),
+                "cost": f.cost,
+                "tested": self.tested,
+                "passed": self.passed[ix],
+            }
+            for ix, f in enumerate(self.filters)
+        ]
+
+
 FILTERS = {
     "dataset": DatasetFilter,
     "schema": SchemaFilter,
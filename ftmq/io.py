@@ -1,4 +1,5 @@
-from typing import Any, Iterable
+from contextlib import ExitStack
+from typing import Any, Callable, Iterable
 
 import orjson
 from anystore.io import Uri, smart_open, smart_stream
@@ -7,9 +8,12 @@ from followthemoney import model
 from nomenklatura.entity import CE, CompositeEntity
 from nomenklatura.stream import StreamEntity
 
+from ftmq.exceptions import ValidationError
 from ftmq.logging import get_logger
+from ftmq.profile import Profiler
 from ftmq.query import Query
-from ftmq.store import Store, get_store
+from ftmq.router import Router
+from ftmq.store import SQLStore, Store, get_store
 from ftmq.types import CEGenerator, Proxy, SEGenerator
 from ftmq.util import ensure_proxy, get_statements, make_dataset, make_proxy
 
@@ -29,6 +33,7 @@ def smart_read_proxies(
     uri: Uri | Iterable[Uri],
     mode: str | None = DEFAULT_MODE,
     query: Query | None = None,
+    profiler: Profiler | None = None,
     **store_kwargs: Any,
 ) -> CEGenerator:
     """
@@ -61,6 +66,7 @@ def smart_read_proxies(
         uri: File-like uri or store uri or multiple uris
         mode: Open mode for file-like sources (default: `rb`)
         query: Filter `Query` object
+        profiler: Optional `ftmq.profile.Profiler` to collect stage timings
         **store_kwargs: Pass through configuration to statement store
 
     Yields:
@@ -68,20 +74,27 @@ def smart_read_proxies(
     """
     if is_listish(uri):
         for u in uri:
-            yield from smart_read_proxies(u, mode, query)
+            yield from smart_read_proxies(u, mode, query, profiler)
         return
 
     store = smart_get_store(uri, **store_kwargs)
     if store is not None:
         view = store.query()
-        yield from view.entities(query)
+        proxies = view.entities(query)
+        if profiler is not None:
+            proxies = profiler.wrap("store", proxies)
+        yield from proxies
         return
 
     q = query or Query()
     lines = smart_stream(uri)
+    if profiler is not None:
+        lines = profiler.wrap("read", lines)
     lines = (orjson.loads(line) for line in lines)
     proxies = (make_proxy(line) for line in lines)
-    yield from q.apply_iter(proxies)
+    if profiler is not None:
+        proxies = profiler.wrap("parse", proxies)
+    yield from q.apply_iter(proxies, profiler)
 
 
 def smart_stream_proxies(
@@ -111,6 +124,7 @@ def smart_write_proxies(
     uri: Uri,
     proxies: Iterable[Proxy],
     mode: str | None = "wb",
+    bulk: bool | None = None,
     **store_kwargs: Any,
 ) -> int:
     """
@@ -133,6 +147,8 @@ def smart_write_proxies(
         uri: File-like uri or store uri
         proxies: Iterable of proxy data
         mode: Open mode for file-like targets (default: `wb`)
+        bulk: Use the bulk loader of sql stores (postgresql `COPY`). By
+            default, it is used if the target store is empty.
         **store_kwargs: Pass through configuration to statement store
 
     Returns:
@@ -148,10 +164,15 @@ def smart_write_proxies(
         dataset = store_kwargs.get("dataset")
         if dataset is not None:
             proxies = apply_datasets(proxies, dataset, replace=True)
-        with store.writer() as bulk:
+        if isinstance(store, SQLStore) and bulk is not False:
+            # re-building the indexes only pays off for an initial load
+            empty = store.is_empty()
+            if bulk or empty:
+                return store.load(proxies, defer_indexes=empty)
+        with store.writer() as writer:
             for proxy in proxies:
                 ix += 1
-                bulk.add_entity(proxy)
+                writer.add_entity(proxy)
                 if ix % 1_000 == 0:
                     log.info("Writing proxy %d ..." % ix)
         return ix
@@ -164,6 +185,138 @@ def smart_write_proxies(
     return ix
 
 
+class ProxyWriters:
+    """
+    Lazily opened writers for multiple targets (file-like uris or stores) that
+    are written to at the same time
+    """
+
+    def __init__(self, mode: str | None = "wb", **store_kwargs: Any) -> None:
+        self.mode = mode
+        self.store_kwargs = store_kwargs
+        self.writers: dict[Uri, Callable[[Proxy], None]] = {}
+        self.counts: dict[Uri, int] = {}
+        self.stack = ExitStack()
+
+    def __enter__(self) -> "ProxyWriters":
+        return self
+
+    def __exit__(self, *args, **kwargs) -> None:
+        self.stack.close()
+
+    def get_writer(self, uri: Uri) -> Callable[[Proxy], None]:
+        store = smart_get_store(uri, **self.store_kwargs)
+        if store is not None:
+            bulk = self.stack.enter_context(store.writer())
+            dataset = self.store_kwargs.get("dataset")
+
+            def write_entity(proxy: Proxy) -> None:
+                proxy = ensure_proxy(proxy)
+                if dataset is not None:
+                    proxy = next(apply_datasets([proxy], dataset, replace=True))
+                bulk.add_entity(proxy)
+
+            return write_entity
+
+        fh = self.stack.enter_context(smart_open(uri, mode=self.mode))
+
+        def write_line(proxy: Proxy) -> None:
+            fh.write(orjson.dumps(proxy.to_dict(), option=orjson.OPT_APPEND_NEWLINE))
+
+        return write_line
+
+    def write(self, uri: Uri, proxy: Proxy) -> None:
+        if uri not in self.writers:
+            self.writers[uri] = self.get_writer(uri)
+            self.counts[uri] = 0
+        self.writers[uri](proxy)
+        self.counts[uri] += 1
+
+
+def smart_route_proxies(
+    uri: Uri | Iterable[Uri],
+    routes: dict[Uri, Query],
+    query: Query | None = None,
+    mode: str | None = "wb",
+    **store_kwargs: Any,
+) -> dict[Uri, int]:
+    """
+    Read proxies from an arbitrary source once and write them to multiple
+    targets based on a `Query` per target. Filters that are shared between the
+    queries are evaluated only once per proxy.
+
+    Example:
+        ```python
+        from ftmq import Query
+        from ftmq.io import smart_route_proxies
+
+        smart_route_proxies("entities.ftm.json", {
+            "persons.ftm.json": Query().where(schema="Person"),
+            "companies_de.ftm.json": Query().where(schema="Company", country="de"),
+            "sqlite:///ftm.db": Query().where(dataset="my_dataset"),
+        })
+        ```
+
+    Args:
+        uri: File-like uri or store uri or multiple uris to read from
+        routes: Mapping of target uris to `Query` objects
+        query: Filter `Query` object applied to the source before routing
+        mode: Open mode for file-like targets (default: `wb`)
+        **store_kwargs: Pass through configuration to target statement stores
+
+    Returns:
+        Number of written proxies per target
+    """
+    router = Router(routes)
+    with ProxyWriters(mode, **store_kwargs) as writers:
+        for target, proxy in router.apply(smart_read_proxies(uri, query=query)):
+            writers.write(target, proxy)
+    return writers.counts
+
+
+def smart_partition_proxies(
+    uri: Uri,
+    proxies: Iterable[CE],
+    by: str,
+    mode: str | None = "wb",
+    **store_kwargs: Any,
+) -> dict[Uri, int]:
+    """
+    Write a stream of proxies partitioned by dataset or schema to multiple
+    targets. The target uri is a template that is formatted with the partition
+    value.
+
+    Example:
+        ```python
+        from ftmq.io import smart_partition_proxies
+
+        smart_partition_proxies("./data/{dataset}.ftm.json", proxies, "dataset")
+        smart_partition_proxies("./data/{schema}.ftm.json", proxies, "schema")
+        ```
+
+    Args:
+        uri: Target uri template, e.g. `./data/{dataset}.ftm.json`
+        proxies: Iterable of `nomenklatura.entity.CompositeEntity`
+        by: Partition by `dataset` or `schema`
+        mode: Open mode for file-like targets (default: `wb`)
+        **store_kwargs: Pass through configuration to target statement stores
+
+    Returns:
+        Number of written proxies per target
+    """
+    if by not in ("dataset", "schema"):
+        raise ValidationError(f"Invalid partition: `{by}`")
+    with ProxyWriters(mode, **store_kwargs) as writers:
+        for proxy in proxies:
+            if by == "dataset":
+                values = sorted(proxy.datasets)
+            else:
+                values = [proxy.schema.name]
+            for value in values:
+                writers.write(uri.format(**{by: value}), proxy)
+    return writers.counts
+
+
 def apply_datasets(
     proxies: Iterable[CE], *datasets: Iterable[str], replace: bool | None = False
 ) -> CEGenerator:
@@ -0,0 +1,63 @@
+"""
+Lightweight per-stage timings for lazy proxy pipelines
+"""
+
+import time
+from typing import Any, Generator, Iterable, Iterator, TypeVar
+
+T = TypeVar("T")
+
+
+class Profiler:
+    """
+    Measure the time spent in each stage of a pipeline of generators (e.g. read,
+    parse, filter, sort, aggregate). Each stage is wrapped in pipeline order and
+    the time of the upstream stages is subtracted from the time of a stage.
+
+    Example:
+        ```python
+        profiler = Profiler()
+        lines = profiler.wrap("read", smart_stream(uri))
+        proxies = profiler.wrap("parse", (make_proxy(...) for line in lines))
+        ...
+        profiler.timings
+        ```
+    """
+
+    def __init__(self) -> None:
+        self.stages: dict[str, float] = {}
+        self.counts: dict[str, int] = {}
+
+    def wrap(self, stage: str, items: Iterable[T]) -> Generator[T, None, None]:
+        # register the stage now to keep the pipeline order
+        self.stages.setdefault(stage, 0)
+        self.counts.setdefault(stage, 0)
+        return self._wrap(stage, iter(items))
+
+    def _wrap(self, stage: str, items: Iterator[T]) -> Generator[T, None, None]:
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(items)
+            except StopIteration:
+                self.stages[stage] += time.perf_counter() - start
+                return
+            self.stages[stage] += time.perf_counter() - start
+            self.counts[stage] += 1
+            yield item
+
+    @property
+    def timings(self) -> dict[str, dict[str, Any]]:
+        """
+        The time (in seconds) spent exclusively in each stage and the number of
+        items each stage yielded
+        """
+        timings: dict[str, dict[str, Any]] = {}
+        upstream = 0
+        for stage, total in self.stages.items():
+            timings[stage] = {
+                "seconds": round(max(total - upstream, 0), 6),
+                "items": self.counts[stage],
+            }
+            upstream = total
+        return timings
@@ -1,25 +1,36 @@
+import hashlib
+import heapq
 from collections.abc import Iterable
 from itertools import islice
-from typing import Any, TypeVar
+from operator import itemgetter
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from typing import Any, Generator, TypeVar
 
+import orjson
 from banal import ensure_list, is_listish, is_mapping
 from nomenklatura.entity import CE
 
 from ftmq.aggregations import Aggregation, Aggregator
+from ftmq.batch import BATCH_SIZE, apply_batches
 from ftmq.enums import Aggregations, Properties
 from ftmq.exceptions import ValidationError
 from ftmq.filters import (
     FILTERS,
     DatasetFilter,
     F,
+    FilterChain,
     IdFilter,
     PropertyFilter,
     ReverseFilter,
     SchemaFilter,
+    sort_filters,
 )
+from ftmq.profile import Profiler
 from ftmq.sql import Sql
 from ftmq.types import CEGenerator
 from ftmq.util import (
+    make_proxy,
     parse_comparator,
     parse_unknown_filters,
     prop_is_numeric,
@@ -30,10 +41,37 @@ Q = TypeVar("Q", bound="Query")
 Slice = TypeVar("Slice", bound=slice)
 
 
+def _sorted_values(data: Any) -> Any:
+    # make nested sets json serializable in a stable order
+    if isinstance(data, dict):
+        return {k: _sorted_values(v) for k, v in data.items()}
+    if isinstance(data, (set, frozenset)):
+        return sorted(data)
+    return data
+
+
+SortKey = tuple[str | int | float, ...]
+
+
+def _dump_sort_key(key: SortKey) -> list[Any]:
+    # json numbers are limited to 64-bit integers, parsed amounts are not
+    return [["int", str(v)] if isinstance(v, int) else v for v in key]
+
+
+def _load_sort_key(key: list[Any]) -> list[Any]:
+    return [int(v[1]) if isinstance(v, list) else v for v in key]
+
+
 class Sort:
-    def __init__(self, values: Iterable[str], ascending: bool | None = True) -> None:
+    def __init__(
+        self,
+        values: Iterable[str],
+        ascending: bool | None = True,
+        buffer_size: int | None = None,
+    ) -> None:
         self.values = tuple(values)
         self.ascending = ascending
+        self.buffer_size = buffer_size
 
     def apply(self, proxy: CE) -> tuple[str]:
         values = tuple()
@@ -45,10 +83,73 @@ class Sort:
         return values
 
     def apply_iter(self, proxies: CEGenerator) -> CEGenerator:
+        if self.buffer_size:
+            yield from self.apply_external(proxies)
+            return
         yield from sorted(
             proxies, key=lambda x: self.apply(x), reverse=not self.ascending
         )
 
+    def apply_external(self, proxies: CEGenerator) -> CEGenerator:
+        """
+        Sort a stream of proxies that doesn't fit into memory. Sorted runs of
+        `buffer_size` proxies are written to temporary files together with their
+        sort keys and then merged. The result (including the order of ties) is
+        the same as sorting in memory.
+        """
+        proxies = iter(proxies)
+        chunk = self._sort_chunk(proxies)
+        if len(chunk) < self.buffer_size:  # everything fits into the buffer
+            for _, proxy in chunk:
+                yield proxy
+            return
+
+        with TemporaryDirectory(prefix="ftmq-sort-") as tmp:
+            runs: list[Path] = []
+            while chunk:
+                path = Path(tmp) / f"{len(runs)}.json"
+                with open(path, "wb") as fh:
+                    for key, proxy in chunk:
+                        fh.write(
+                            orjson.dumps(
+                                [_dump_sort_key(key), proxy.to_dict()],
+                                option=orjson.OPT_APPEND_NEWLINE,
+                            )
+                        )
+                runs.append(path)
+                chunk = self._sort_chunk(proxies)
+
+            merged = heapq.merge(
+                *(self._read_run(path) for path in runs),
+                key=itemgetter(0),
+                reverse=not self.ascending,
+            )
+            for _, data in merged:
+                yield make_proxy(data)
+
+    def _sort_chunk(self, proxies: Iterable[CE]) -> list[tuple[SortKey, CE]]:
+        chunk = [(self.apply(p), p) for p in islice(proxies, self.buffer_size)]
+        return sorted(chunk, key=itemgetter(0), reverse=not self.ascending)
+
+    def _read_run(
+        self, path: Path
+    ) -> Generator[tuple[list[Any], dict[str, Any]], None, None]:
+        with open(path, "rb") as fh:
+            for line in fh:
+                key, data = orjson.loads(line)
+                yield _load_sort_key(key), data
+
+    def apply_topk(self, proxies: CEGenerator, k: int) -> CEGenerator:
+        """
+        Get only the first `k` sorted proxies while holding at most `k` proxies
+        in memory. The result (including the order of ties) is the same as the
+        first `k` items of `Sort.apply_iter`
+        """
+        if self.ascending:
+            yield from heapq.nsmallest(k, proxies, key=self.apply)
+        else:
+            yield from heapq.nlargest(k, proxies, key=self.apply)
+
     def serialize(self) -> list[str]:
         if self.ascending:
             return list(self.values)
@@ -109,9 +210,20 @@ class Query:
 
     def __hash__(self) -> int:
         """
-        Generate a unique key of the current state, useful for caching
+        Generate a unique key of the current state, useful for caching. This is
+        stable across processes (see `Query.cache_key`)
+        """
+        return int(self.cache_key[:16], 16)
+
+    @property
+    def cache_key(self) -> str:
+        """
+        A stable digest of the canonical representation of the current state.
+        It doesn't depend on the order of filters or on the python process, so
+        it can be used as a key for shared caches (e.g. redis).
         """
-        return hash(repr(self.to_dict()))
+        data = orjson.dumps(self.serialize(), option=orjson.OPT_SORT_KEYS)
+        return hashlib.sha1(data).hexdigest()
 
     def _chain(self, **kwargs):
         # merge current state
@@ -276,6 +388,82 @@ class Query:
             data["aggregations"] = self.get_aggregator().to_dict()
         return data
 
+    def serialize(self) -> dict[str, Any]:
+        """
+        Canonical, json serializable representation of the current object that
+        can be loaded again via `Query.from_dict`. Other than `Query.to_dict`
+        this keeps every filter and is independent of the order of filters.
+
+        Example:
+            ```python
+            q = Query().where(dataset="d1", date__gte=2023)
+            q = q.order_by("date", ascending=False)[:10]
+            assert q.serialize() == {
+                "filters": [["dataset", "eq", "d1"], ["date", "gte", "2023"]],
+                "order_by": ["-date"],
+                "limit": 10,
+                "offset": None,
+            }
+            ```
+        """
+        data: dict[str, Any] = {}
+        filters = sorted(f.serialize() for f in self.filters)
+        if filters:
+            data["filters"] = filters
+        if self.sort:
+            data["order_by"] = self.sort.serialize()
+        if self.slice:
+            data["limit"] = self.limit
+            data["offset"] = self.offset
+        if self.aggregations:
+            data["aggregations"] = _sorted_values(self.get_aggregator().to_dict())
+        return data
+
+    @classmethod
+    def from_dict(cls, data: dict[str, Any]) -> "Query":
+        """
+        Load a `Query` from its serialized representation (the result of
+        `Query.serialize` or `Query.to_dict`)
+
+        Example:
+            ```python
+            q = Query().where(schema="Payment").aggregate("sum", "amountEur")
+            assert Query.from_dict(q.serialize()).cache_key == q.cache_key
+            ```
+        """
+        data = dict(data)
+        q = cls()
+        for key, comparator, value in data.pop("filters", []):
+            if key in FILTERS:
+                q = q.where(**{f"{key}__{comparator}": value})
+            else:
+                q = q.where(prop=key, value=value, comparator=comparator)
+        order_by = ensure_list(data.pop("order_by", None))
+        if order_by:
+            ascending = not order_by[0].startswith("-")
+            q = q.order_by(*[v.lstrip("-") for v in order_by], ascending=ascending)
+        limit, offset = data.pop("limit", None), data.pop("offset", None)
+        if limit is not None:
+            q = q[offset : (offset or 0) + limit]
+        elif offset is not None:
+            q = q[offset:]
+        aggregations = dict(data.pop("aggregations", None) or {})
+        groups = aggregations.pop("groups", None) or {}
+        for func, props in aggregations.items():
+            for prop in ensure_list(props):
+                q = q.aggregate(
+                    func,
+                    prop,
+                    groups=[
+                        group
+                        for group, funcs in groups.items()
+                        if prop in ensure_list(funcs.get(func))
+                    ],
+                )
+        if data:
+            q = q.where(**data)
+        return q
+
     def where(self, **lookup: Any) -> Q:
         """
         Add another lookup to the current `Query` instance.
@@ -345,18 +533,25 @@ class Query:
 
         return self._chain()
 
-    def order_by(self, *values: Iterable[str], ascending: bool | None = True) -> Q:
+    def order_by(
+        self,
+        *values: Iterable[str],
+        ascending: bool | None = True,
+        buffer_size: int | None = None,
+    ) -> Q:
         """
         Add or update the current sorting.
 
         Args:
             *values: Fields to order by
             ascending: Ascending or descending
+            buffer_size: Maximum number of proxies to sort in memory. Larger
+                streams are sorted via temporary files on disk.
 
         Returns:
             The updated `Query` instance.
         """
-        self.sort = Sort(values=values, ascending=ascending)
+        self.sort = Sort(values=values, ascending=ascending, buffer_size=buffer_size)
         return self._chain()
 
     def aggregate(
@@ -372,7 +567,13 @@ class Query:
         return self._chain()
 
     def get_aggregator(self) -> Aggregator:
-        return Aggregator(aggregations=self.aggregations)
+        # fresh accumulators for each run
+        return Aggregator(
+            aggregations=[
+                Aggregation(func=a.func, prop=a.prop, group_props=a.group_props)
+                for a in self.aggregations
+            ]
+        )
 
     def apply(self, proxy: CE) -> bool:
         """
@@ -380,9 +581,112 @@ class Query:
         """
         if not self.filters:
             return True
-        return all(f.apply(proxy) for f in self.filters)
+        return all(f.apply(proxy) for f in sort_filters(self.filters))
 
-    def apply_iter(self, proxies: CEGenerator) -> CEGenerator:
+    def compile(self, sample_size: int | None = 1_000) -> FilterChain:
+        """
+        Compile the current filters into a single test function for proxies.
+        Comparators are resolved and lookup values are prepared once, so this is
+        much faster than `Query.apply` when testing a lot of proxies.
+
+        Filters are evaluated cheapest first and re-ordered by their observed
+        selectivity after `sample_size` proxies. The chosen order can be
+        inspected via `FilterChain.explain()`.
+
+        Example:
+            ```python
+            q = Query().where(schema="Payment", amountEur__gt=1000)
+            test = q.compile()
+            proxies = [p for p in proxies if test(p)]
+            test.explain()
+            ```
+
+        Args:
+            sample_size: Number of proxies to observe selectivity for before
+                re-ordering the filters (`0` to disable)
+
+        Returns:
+            A callable that tests a proxy against the current filters
+        """
+        return FilterChain(self.filters, sample_size=sample_size)
+
+    def apply_batches(
+        self, proxies: Iterable[CE], batch_size: int | None = BATCH_SIZE
+    ) -> CEGenerator:
+        """
+        Filter a stream of proxies in chunks: For each chunk, the values tested
+        by a filter are extracted into a column and compared at once (vectorized
+        via `numpy` for numeric and date ranges, if installed). The result is
+        the same as filtering with `Query.apply`.
+
+        Example:
+            ```python
+            q = Query().where(schema="Payment", amountEur__gt=1000)
+            proxies = [p for p in q.apply_batches(proxies, batch_size=10_000)]
+            ```
+
+        Args:
+            proxies: The proxies to filter
+            batch_size: Number of proxies per chunk
+
+        Yields:
+            The proxies matching the current filters
+        """
+        if not self.filters:
+            yield from proxies
+            return
+        yield from apply_batches(self.filters, proxies, batch_size)
+
+    @property
+    def use_topk(self) -> bool:
+        """
+        Indicate if sorting can be done via a bounded heap (sort with limit)
+        """
+        return bool(self.sort and self.slice and self.slice.stop is not None)
+
+    def explain(self) -> dict[str, Any]:
+        """
+        Describe how the current `Query` is applied to a stream of proxies: The
+        evaluation order of the filters (by estimated cost), the sort strategy,
+        the slice and the aggregations.
+
+        Example:
+            ```python
+            q = Query().where(schema="Payment").order_by("amountEur")[:10]
+            q.explain()
+            {
+                "filters": [{"filter": {"schema": "Payment"}, "cost": 1, ...}],
+                "sort": {"values": ["amountEur"], "strategy": "top-k", "k": 10},
+                "slice": {"offset": None, "limit": 10},
+            }
+            ```
+        """
+        data: dict[str, Any] = {}
+        if self.filters:
+            data["filters"] = self.compile(sample_size=0).explain()
+        if self.sort:
+            sort = {"values": self.sort.serialize()}
+            if self.use_topk:
+                sort["strategy"] = "top-k"
+                sort["k"] = self.slice.stop
+            elif self.sort.buffer_size:
+                sort["strategy"] = "external"
+                sort["buffer_size"] = self.sort.buffer_size
+            else:
+                sort["strategy"] = "memory"
+            data["sort"] = sort
+        if self.slice:
+            data["slice"] = {"offset": self.offset, "limit": self.limit}
+        if self.aggregations:
+            data["aggregations"] = _sorted_values(self.get_aggregator().to_dict())
+        return data
+
+    def apply_iter(
+        self,
+        proxies: CEGenerator,
+        profiler: Profiler | None = None,
+        batch_size: int | None = None,
+    ) -> CEGenerator:
         """
         Apply the current `Query` instance to a generator of proxies and return
         a generator of filtered proxies
@@ -395,6 +699,12 @@ class Query:
                 assert proxy.schema.name == "Company"
             ```
 
+        Args:
+            proxies: The proxies to filter
+            profiler: Optional `ftmq.profile.Profiler` to collect stage timings
+            batch_size: Filter the proxies in chunks of this size (see
+                `Query.apply_batches`)
+
         Yields:
             A generator of `nomenklatura.entity.CompositeEntity`
         """
@@ -402,9 +712,21 @@ class Query:
             yield from proxies
             return
 
-        proxies = (p for p in proxies if self.apply(p))
+        if self.filters:
+            if batch_size:
+                proxies = self.apply_batches(proxies, batch_size)
+            else:
+                proxies = filter(self.compile(), proxies)
+            if profiler is not None:
+                proxies = profiler.wrap("filter", proxies)
         if self.sort:
-            proxies = self.sort.apply_iter(proxies)
+            if self.use_topk:
+                # only keep the top `stop` proxies in memory
+                proxies = self.sort.apply_topk(proxies, self.slice.stop)
+            else:
+                proxies = self.sort.apply_iter(proxies)
+            if profiler is not None:
+                proxies = profiler.wrap("sort", proxies)
         if self.slice:
             proxies = islice(
                 proxies, self.slice.start, self.slice.stop, self.slice.step
@@ -412,4 +734,6 @@ class Query:
         if self.aggregations:
             self.aggregator = self.get_aggregator()
             proxies = self.aggregator.apply(proxies)
+            if profiler is not None:
+                proxies = profiler.wrap("aggregate", proxies)
         yield from proxies
@@ -0,0 +1,121 @@
+"""
+Evaluate many queries against a single pass of proxies and route the matching
+proxies to their targets.
+"""
+
+from typing import Generator, Generic, Hashable, Iterable, TypeVar
+
+import orjson
+
+from ftmq.exceptions import ValidationError
+from ftmq.filters import Filter, ProxyTest, sort_filters
+from ftmq.query import Query
+from ftmq.types import CE
+
+K = TypeVar("K", bound=Hashable)
+
+
+def get_filter_key(f: Filter) -> bytes:
+    return orjson.dumps(f.serialize())
+
+
+class Route:
+    def __init__(self, query: Query, filters: list[int]) -> None:
+        self.query = query
+        self.filters = filters
+        self.seen = 0
+        self.start = 0
+        self.stop = None
+        if query.slice is not None:
+            self.start = query.slice.start or 0
+            self.stop = query.slice.stop
+        self.done = self.stop is not None and self.stop <= self.start
+        self.aggregator = query.get_aggregator() if query.aggregations else None
+
+    def accept(self, proxy: CE) -> bool:
+        self.seen += 1
+        if self.stop is not None and self.seen >= self.stop:
+            self.done = True
+        if self.seen <= self.start:
+            return False
+        if self.aggregator is not None:
+            self.aggregator.collect(proxy)
+        return True
+
+    def close(self) -> None:
+        if self.aggregator is not None:
+            self.aggregator.__exit__()
+            self.query.aggregator = self.aggregator
+
+
+class Router(Generic[K]):
+    """
+    Route proxies to multiple `Query` objects in one pass. Filters that are
+    shared between the queries are evaluated only once per proxy.
+
+    Example:
+        ```python
+        router = Router({
+            "persons.json": Query().where(schema="Person"),
+            "de.json": Query().where(country="de"),
+        })
+        for key, proxy in router.apply(proxies):
+            ...
+        ```
+    """
+
+    def __init__(self, routes: dict[K, Query]) -> None:
+        # filters are shared by their serialized form, as the filter equality
+        # ignores e.g. the expanded schemata of schema filters
+        shared: dict[bytes, Filter] = {}
+        for query in routes.values():
+            for f in query.filters:
+                shared.setdefault(get_filter_key(f), f)
+        filters = sort_filters(shared.values())
+        index = {get_filter_key(f): ix for ix, f in enumerate(filters)}
+        self.tests: list[ProxyTest] = [f.compile() for f in filters]
+        self.routes: dict[K, Route] = {}
+        for key, query in routes.items():
+            if query.sort:
+                raise ValidationError(f"Sorting is not supported for routing: `{key}`")
+            self.routes[key] = Route(
+                query, sorted({index[get_filter_key(f)] for f in query.filters})
+            )
+        self.bounded = all(r.stop is not None for r in self.routes.values())
+
+    def route(self, proxy: CE) -> list[K]:
+        """
+        Get the keys of all routes the proxy matches
+        """
+        results: list[bool | None] = [None] * len(self.tests)
+        keys: list[K] = []
+        for key, route in self.routes.items():
+            if route.done:
+                continue
+            for ix in route.filters:
+                result = results[ix]
+                if result is None:
+                    result = results[ix] = self.tests[ix](proxy)
+                if not result:
+                    break
+            else:
+                if route.accept(proxy):
+                    keys.append(key)
+        return keys
+
+    def apply(self, proxies: Iterable[CE]) -> Generator[tuple[K, CE], None, None]:
+        """
+        Route a stream of proxies
+
+        Yields:
+            Tuples of the route key and the matching proxy
+        """
+        try:
+            for proxy in proxies:
+                for key in self.route(proxy):
+                    yield key, proxy
+                if self.bounded and all(r.done for r in self.routes.values()):
+                    break
+        finally:
+            for route in self.routes.values():
+                route.close()
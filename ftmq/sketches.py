@@ -0,0 +1,294 @@
+"""
+Bounded memory, mergeable sketches for approximate aggregations:
+
+- `HyperLogLog`: approximate distinct count
+- `TDigest`: approximate quantiles
+- `SpaceSaving`: approximate top-k frequent values (heavy hitters)
+
+All sketches can be serialized (`to_dict` / `from_dict`) and merged with the
+sketches of other workers.
+"""
+
+import base64
+import hashlib
+import heapq
+import itertools
+import math
+import os
+from typing import Any, Hashable, Iterable
+
+HLL_PRECISION = int(os.environ.get("HLL_PRECISION", 12))
+TDIGEST_COMPRESSION = int(os.environ.get("TDIGEST_COMPRESSION", 100))
+TOP_K = int(os.environ.get("TOP_K", 10))
+TOP_CAPACITY = int(os.environ.get("TOP_CAPACITY", 100))
+QUANTILES = tuple(
+    float(q) for q in os.environ.get("QUANTILES", "0.25,0.5,0.75,0.9,0.99").split(",")
+)
+
+
+class HyperLogLog:
+    """
+    Approximate distinct count with a fixed memory of `2 ** precision` bytes.
+    The standard error is about `1.04 / sqrt(2 ** precision)` (1.6% for the
+    default precision of 12).
+    """
+
+    def __init__(self, precision: int | None = HLL_PRECISION) -> None:
+        if not 4 <= precision <= 18:
+            raise ValueError(f"Invalid precision: `{precision}`")
+        self.precision = precision
+        self.size = 1 << precision
+        self.registers = bytearray(self.size)
+
+    def add(self, value: Hashable) -> None:
+        digest = hashlib.blake2b(str(value).encode(), digest_size=8).digest()
+        x = int.from_bytes(digest, "big")
+        ix = x >> (64 - self.precision)
+        rest = x & ((1 << (64 - self.precision)) - 1)
+        rank = (64 - self.precision) - rest.bit_length() + 1
+        if rank > self.registers[ix]:
+            self.registers[ix] = rank
+
+    def merge(self, other: "HyperLogLog") -> "HyperLogLog":
+        if other.precision != self.precision:
+            raise ValueError("Can not merge sketches with different precision")
+        self.registers = bytearray(map(max, self.registers, other.registers))
+        return self
+
+    @property
+    def count(self) -> int:
+        m = self.size
+        if m >= 128:
+            alpha = 0.7213 / (1 + 1.079 / m)
+        else:
+            alpha = {16: 0.673, 32: 0.697, 64: 0.709}[m]
+        estimate = alpha * m * m / sum(2.0**-r for r in self.registers)
+        zeros = self.registers.count(0)
+        if zeros and estimate <= 2.5 * m:
+            # linear counting for small cardinalities
+            estimate = m * math.log(m / zeros)
+        return int(round(estimate))
+
+    def to_dict(self) -> dict[str, Any]:
+        return {
+            "precision": self.precision,
+            "registers": base64.b64encode(self.registers).decode(),
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict[str, Any]) -> "HyperLogLog":
+        sketch = cls(data["precision"])
+        sketch.registers = bytearray(base64.b64decode(data["registers"]))
+        return sketch
+
+
+class TDigest:
+    """
+    Approximate quantiles (merging t-digest). The number of centroids is
+    bounded by the `compression`, the accuracy is highest at the tails.
+    """
+
+    def __init__(self, compression: int | None = TDIGEST_COMPRESSION) -> None:
+        self.compression = compression
+        self.centroids: list[tuple[float, float]] = []
+        self.buffer: list[tuple[float, float]] = []
+        self.count = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def add(self, value: float, weight: float | None = 1) -> None:
+        self.buffer.append((value, weight))
+        self.count += weight
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+        if len(self.buffer) >= 5 * self.compression:
+            self.compress()
+
+    def merge(self, other: "TDigest") -> "TDigest":
+        for mean, weight in [*other.centroids, *other.buffer]:
+            self.buffer.append((mean, weight))
+        self.count += other.count
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        self.compress()
+        return self
+
+    def _scale(self, q: float) -> float:
+        # k1 scale function: small centroids at the tails
+        return self.compression / (2 * math.pi) * math.asin(2 * min(q, 1) - 1)
+
+    def compress(self) -> None:
+        items = sorted([*self.centroids, *self.buffer])
+        self.buffer = []
+        if not items:
+            return
+        total = sum(w for _, w in items)
+        centroids: list[tuple[float, float]] = []
+        mean, weight = items[0]
+        seen = 0.0
+        for m, w in items[1:]:
+            start = self._scale(seen / total)
+            if self._scale((seen + weight + w) / total) - start <= 1:
+                weight += w
+                mean += (m - mean) * w / weight
+            else:
+                centroids.append((mean, weight))
+                seen += weight
+                mean, weight = m, w
+        centroids.append((mean, weight))
+        self.centroids = centroids
+
+    def quantile(self, q: float) -> float | None:
+        self.compress()
+        if not self.centroids:
+            return None
+        if q <= 0:
+            return self.min
+        if q >= 1:
+            return self.max
+        if len(self.centroids) == 1:
+            return self.centroids[0][0]
+        target = q * self.count
+        seen = 0.0
+        prev_mean, prev_center = self.min, 0.0
+        for mean, weight in self.centroids:
+            center = seen + weight / 2
+            if target < center:
+                if center == prev_center:
+                    return mean
+                delta = (target - prev_center) / (center - prev_center)
+                return prev_mean + (mean - prev_mean) * delta
+            prev_mean, prev_center = mean, center
+            seen += weight
+        if self.count == prev_center:
+            return self.max
+        delta = (target - prev_center) / (self.count - prev_center)
+        return prev_mean + (self.max - prev_mean) * delta
+
+    def to_dict(self) -> dict[str, Any]:
+        self.compress()
+        return {
+            "compression": self.compression,
+            "centroids": [list(c) for c in self.centroids],
+            "count": self.count,
+            "min": self.min if self.centroids else None,
+            "max": self.max if self.centroids else None,
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict[str, Any]) -> "TDigest":
+        sketch = cls(data["compression"])
+        sketch.centroids = [(m, w) for m, w in data["centroids"]]
+        sketch.count = data["count"]
+        if sketch.centroids:
+            sketch.min = data["min"]
+            sketch.max = data["max"]
+        return sketch
+
+
+class SpaceSaving:
+    """
+    Approximate top-k frequent values with at most `capacity` counters. Counts
+    are exact as long as there are no more distinct values than counters,
+    otherwise they are overestimated by at most the count of the evicted
+    counter (`errors`). The counter with the minimum count is found via a
+    (lazy) min heap.
+    """
+
+    def __init__(self, capacity: int | None = TOP_CAPACITY) -> None:
+        self.capacity = capacity
+        self.counts: dict[Hashable, int] = {}
+        self.errors: dict[Hashable, int] = {}
+        # (count, sequence, value), outdated entries are skipped on pop
+        self._heap: list[tuple[int, int, Hashable]] = []
+        self._seq = itertools.count()
+
+    def _push(self, value: Hashable) -> None:
+        heapq.heappush(self._heap, (self.counts[value], next(self._seq), value))
+        if len(self._heap) > 4 * self.capacity:
+            self._rebuild()
+
+    def _rebuild(self) -> None:
+        self._heap = [(c, next(self._seq), v) for v, c in self.counts.items()]
+        heapq.heapify(self._heap)
+
+    def _pop_min(self) -> tuple[Hashable, int]:
+        while True:
+            count, _, value = heapq.heappop(self._heap)
+            if self.counts.get(value) == count:
+                return value, count
+
+    @property
+    def floor(self) -> int:
+        """
+        The upper bound of the count of any value without a counter
+        """
+        if len(self.counts) < self.capacity:
+            return 0
+        while self._heap:
+            count, _, value = self._heap[0]
+            if self.counts.get(value) == count:
+                return count
+            heapq.heappop(self._heap)
+        return 0
+
+    def add(self, value: Hashable, count: int | None = 1) -> None:
+        if value in self.counts:
+            self.counts[value] += count
+        elif len(self.counts) < self.capacity:
+            self.counts[value] = count
+            self.errors[value] = 0
+        else:
+            evict, floor = self._pop_min()
+            del self.counts[evict]
+            del self.errors[evict]
+            self.counts[value] = floor + count
+            self.errors[value] = floor
+        self._push(value)
+
+    def merge(self, other: "SpaceSaving") -> "SpaceSaving":
+        """
+        Merge another summary (mergeable summaries, Agarwal et al.): Values
+        missing in one of the (full) summaries may have a count up to its
+        `floor` there, which is added to their count and error.
+        """
+        floor, other_floor = self.floor, other.floor
+        counts: dict[Hashable, int] = {}
+        errors: dict[Hashable, int] = {}
+        for value in {*self.counts, *other.counts}:
+            counts[value] = self.counts.get(value, floor) + other.counts.get(
+                value, other_floor
+            )
+            errors[value] = self.errors.get(value, floor) + other.errors.get(
+                value, other_floor
+            )
+        keep = sorted(counts, key=lambda v: (-counts[v], str(v)))[: self.capacity]
+        self.counts = {v: counts[v] for v in keep}
+        self.errors = {v: errors[v] for v in keep}
+        self._rebuild()
+        return self
+
+    def top(self, k: int | None = TOP_K) -> list[tuple[Hashable, int]]:
+        values = sorted(self.counts, key=lambda v: (-self.counts[v], str(v)))
+        return [(v, self.counts[v]) for v in values[:k]]
+
+    def to_dict(self) -> dict[str, Any]:
+        return {
+            "capacity": self.capacity,
+            "counts": [[v, c, self.errors[v]] for v, c in self.top(None)],
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict[str, Any]) -> "SpaceSaving":
+        sketch = cls(data["capacity"])
+        for value, count, error in data["counts"]:
+            sketch.counts[value] = count
+            sketch.errors[value] = error
+        sketch._rebuild()
+        return sketch
+
+
+def quantiles(
+    digest: TDigest, qs: Iterable[float] | None = QUANTILES
+) -> dict[str, float | None]:
+    return {str(q): digest.quantile(q) for q in qs}
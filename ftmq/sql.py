@@ -1,24 +1,41 @@
 from functools import cached_property
-from typing import TYPE_CHECKING, TypeAlias
+from typing import TYPE_CHECKING, Any, TypeAlias
 
 from followthemoney.types import PropertyType, registry
 from nomenklatura.statement import make_statement_table
+from nomenklatura.statement.db import KEY_LEN, VALUE_LEN
 from sqlalchemy import (
+    CTE,
     NUMERIC,
     BooleanClauseList,
     Column,
+    Date,
+    Index,
     MetaData,
     Select,
+    Table,
+    Text,
+    Unicode,
     and_,
+    asc,
+    case,
     desc,
     distinct,
+    exists,
     func,
+    literal_column,
+    null,
     or_,
     select,
     text,
+    tuple_,
     union_all,
 )
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.functions import FunctionElement
+from sqlalchemy.types import NullType
 
+from ftmq.aggregations import Aggregation
 from ftmq.enums import (
     Aggregations,
     Comparators,
@@ -29,8 +46,9 @@ from ftmq.enums import (
     PropertyTypesMap,
     Things,
 )
-from ftmq.exceptions import ValidationError
 from ftmq.filters import F
+from ftmq.sketches import QUANTILES, TOP_K
+from ftmq.util import get_date_after
 
 if TYPE_CHECKING:
     from ftmq.query import Q
@@ -38,6 +56,121 @@ if TYPE_CHECKING:
 
 Field: TypeAlias = Properties | PropertyTypes | Fields
 
+# property types that have materialized sort keys and typed value columns
+SORT_KEY_TYPES = (registry.date.name, registry.number.name)
+TYPED_VALUE_TYPES = SORT_KEY_TYPES
+
+
+# the number formats of `ftmq.util.to_numeric`, as (pattern, replacements)
+SQL_NUMERIC_FORMATS = (
+    (r"^[+-]?([0-9]+\.?[0-9]*|\.[0-9]+)([eE][+-]?[0-9]+)?$", ()),
+    (r"^-?[0-9]+(,[0-9]{3})*(\.[0-9]+)?$", ((",", ""),)),
+    (r"^-?[0-9]+(\.[0-9]{3})*(,[0-9]+)?$", ((".", ""), (",", "."))),
+)
+
+
+def make_numeric(value: Any) -> Any:
+    """
+    Parse string values into numbers in sql the same way as
+    [`to_numeric`][ftmq.util.to_numeric] (including US and DE formatting).
+    Values that are not numbers become `NULL` instead of failing the cast.
+    """
+    value = func.trim(value)
+    whens = []
+    for pattern, replacements in SQL_NUMERIC_FORMATS:
+        number = value
+        for old, new in replacements:
+            number = func.replace(number, old, new)
+        whens.append((value.regexp_match(pattern), func.cast(number, NUMERIC)))
+    return case(*whens, else_=null())
+
+
+def make_typed_columns() -> list[Column]:
+    """
+    The (optional) typed shadow columns of the statement table: The parsed
+    number (see [`to_numeric`][ftmq.util.to_numeric]) and date (see
+    [`to_date`][ftmq.util.to_date]) of the number and date statement values.
+    """
+    return [
+        Column("value_num", NUMERIC, nullable=True),
+        Column("value_date", Date, nullable=True),
+    ]
+
+
+def make_entity_table(metadata: MetaData, name: str) -> Table:
+    """
+    A table of the pre-assembled entities: One row per canonical id with its
+    schema and the json serialized statements.
+
+    Args:
+        metadata: The metadata to register the table in
+        name: Table name
+
+    Returns:
+        The table
+    """
+    return Table(
+        name,
+        metadata,
+        Column("canonical_id", Unicode(KEY_LEN), primary_key=True),
+        Column("schema", Unicode(KEY_LEN), nullable=False),
+        Column("data", Text, nullable=False),
+    )
+
+
+def make_sort_key_table(metadata: MetaData, name: str) -> Table:
+    """
+    A table of the sort keys of the date and number properties per entity: The
+    lowest and highest (text and numeric) value of each property, indexed in
+    the same order as the sorted queries read them.
+
+    Args:
+        metadata: The metadata to register the table in
+        name: Table name
+
+    Returns:
+        The table
+    """
+    return Table(
+        name,
+        metadata,
+        Column("canonical_id", Unicode(KEY_LEN), primary_key=True),
+        Column("prop", Unicode(KEY_LEN), primary_key=True),
+        Column("value_min", Unicode(VALUE_LEN), nullable=False),
+        Column("value_max", Unicode(VALUE_LEN), nullable=False),
+        Column("number_min", NUMERIC, nullable=True),
+        Column("number_max", NUMERIC, nullable=True),
+        *[
+            Index(f"ix_{name}_{column}", "prop", column, "canonical_id")
+            for column in ("value_min", "value_max", "number_min", "number_max")
+        ],
+    )
+
+
+class AggregationValue(FunctionElement):
+    """
+    The result of an aggregate function as text: The results of different
+    aggregations are combined via `UNION ALL`, which needs the same type for all
+    of them. The values are not converted by sqlalchemy (numbers are converted
+    via `clean_agg_value`), sqlite keeps its native values.
+    """
+
+    name = "aggregation_value"
+    inherit_cache = True
+    type = NullType()
+
+
+@compiles(AggregationValue)
+def _compile_aggregation_value(element: AggregationValue, compiler, **kwargs) -> str:
+    return f"CAST({compiler.process(element.clauses, **kwargs)} AS VARCHAR)"
+
+
+@compiles(AggregationValue, "sqlite")
+def _compile_aggregation_value_sqlite(
+    element: AggregationValue, compiler, **kwargs
+) -> str:
+    return compiler.process(element.clauses, **kwargs)
+
 
 class Sql:
     COMPARATORS = {
@@ -51,10 +184,38 @@ class Sql:
         Comparators.lte: "__le__",
     }
 
-    def __init__(self, q: "Q") -> None:
+    # levels of the stats rows (bitmask of `GROUPING(schema, category, country)`)
+    STATS_SCHEMATA = 1
+    STATS_COUNTRIES = 4
+    STATS_TOTAL = 7
+
+    def __init__(
+        self,
+        q: "Q",
+        ids: Table | None = None,
+        sort_keys: Table | None = None,
+        typed: bool | None = False,
+    ) -> None:
+        """
+        Args:
+            q: The query
+            ids: Optional (temporary) table of the already evaluated canonical
+                ids of the query filters, see `SQLQueryView.materialize`
+            sort_keys: Optional table of the sort keys per entity and property,
+                see `make_sort_key_table`
+            typed: The statement table has the typed value columns (see
+                `make_typed_columns`) to use for numeric and date lookups
+                instead of casting the values
+        """
         self.q = q
+        self.ids = ids
+        self.sort_keys = sort_keys
+        self.typed = typed
         self.metadata = MetaData()
         self.table = make_statement_table(self.metadata)
+        if typed:
+            for column in make_typed_columns():
+                self.table.append_column(column)
         self.META_COLUMNS = {
             "id": self.table.c.canonical_id,
             "dataset": self.table.c.dataset,
@@ -65,12 +226,29 @@ class Sql:
         value = f.value
         if f.comparator in (Comparators.ilike, Comparators.like):
             value = f"%{value}%"
+        elif f.lookup.is_numeric:
+            if self.typed:
+                column = self.table.c.value_num
+            else:
+                column = make_numeric(column)
+            value = f.lookup.value
+        elif f.lookup.is_date:
+            after = get_date_after(value) if self.typed and len(value) <= 10 else None
+            if after is not None:
+                # prefix comparison: `> "2023"` means from `2024-01-01` on
+                if f.comparator == Comparators.gt:
+                    return self.table.c.value_date >= after
+                return self.table.c.value_date < after
+            column = func.substring(column, 1, len(value))
         op = self.COMPARATORS.get(str(f.comparator), str(f.comparator))
         op = getattr(column, op)
         return op(value)
 
     @cached_property
-    def clause(self) -> BooleanClauseList:
+    def scope_clauses(self) -> list[BooleanClauseList]:
+        """
+        The row level clauses of the id, dataset and schema filters
+        """
         clauses = []
         if self.q.ids:
             clauses.append(
@@ -93,6 +271,11 @@ class Sql:
                     for f in sorted(self.q.schemata)
                 )
             )
+        return clauses
+
+    @cached_property
+    def clause(self) -> BooleanClauseList:
+        clauses = list(self.scope_clauses)
         if self.q.reversed:
             rclause = or_(
                 and_(
@@ -117,9 +300,26 @@ class Sql:
             )
         return and_(*clauses)
 
+    @cached_property
+    def id_clause(self) -> BooleanClauseList:
+        """
+        The filter clause for statement rows, using the materialized ids if any
+        """
+        if self.ids is None:
+            return self.clause
+        return and_(
+            *self.scope_clauses,
+            self.table.c.canonical_id.in_(self.all_canonical_ids),
+        )
+
     @cached_property
     def canonical_ids(self) -> Select:
-        q = select(self.table.c.canonical_id.distinct()).where(self.clause)
+        if self.ids is not None:
+            q = select(self.ids.c.canonical_id)
+            if self.q.sort is None and self.q.slice:
+                q = q.order_by(self.ids.c.canonical_id)
+        else:
+            q = select(self.table.c.canonical_id.distinct()).where(self.clause)
         if self.q.sort is None:
             q = q.limit(self.q.limit).offset(self.q.offset)
         return q
@@ -128,53 +328,254 @@ class Sql:
     def all_canonical_ids(self) -> Select:
         return self.canonical_ids.limit(None).offset(None)
 
+    @cached_property
+    def scoped_statements(self) -> bool:
+        """
+        The statements of the matching entities are limited to the scope
+        (datasets and schemata) of the query, otherwise all statements of the
+        matching entities are returned
+        """
+        if self.q.sort:
+            return False
+        return not (self.q.properties or self.q.reversed or self.q.limit)
+
     @cached_property
     def _unsorted_statements(self) -> Select:
-        where = self.clause
-        if self.q.properties or self.q.reversed or self.q.limit:
+        where = self.id_clause
+        if not self.scoped_statements:
             where = self.table.c.canonical_id.in_(self.canonical_ids)
         return select(self.table).where(where).order_by(self.table.c.canonical_id)
 
     @cached_property
-    def _sorted_statements(self) -> Select:
-        if self.q.sort:
-            if len(self.q.sort.values) > 1:
-                raise ValidationError(
-                    f"Multi-valued sort not supported for `{self.__class__.__name__}`"
-                )
-            prop = self.q.sort.values[0]
+    def use_sort_keys(self) -> bool:
+        """
+        Sort via the materialized sort key table (if available and all sort
+        properties are of a type that has sort keys)
+        """
+        if self.sort_keys is None:
+            return False
+        types = {PropertyTypesMap[p].value.name for p in self.q.sort.values}
+        return not types - set(SORT_KEY_TYPES)
+
+    def _is_numeric_sort(self, prop: str) -> bool:
+        return PropertyTypesMap[prop].value == registry.number
+
+    @cached_property
+    def sort_columns(self) -> list[Any]:
+        """
+        The (aggregated) value of each sort property per entity
+        """
+        if self.use_sort_keys:
+            return [
+                self._sort_key_column(alias, prop)
+                for alias, prop in zip(self._sort_key_aliases, self.q.sort.values)
+            ]
+        group_func = func.min if self.q.sort.ascending else func.max
+        multi = len(self.q.sort.values) > 1
+        columns = []
+        for prop in self.q.sort.values:
             value = self.table.c.value
-            if PropertyTypesMap[prop].value == registry.number:
-                value = func.cast(self.table.c.value, NUMERIC)
-            group_func = func.min if self.q.sort.ascending else func.max
-            inner = (
-                select(
-                    self.table.c.canonical_id,
-                    group_func(value).label("sortable_value"),
+            if self._is_numeric_sort(prop):
+                value = self._get_numeric(self.table)
+            if multi:
+                value = case((self.table.c.prop == prop, value))
+            columns.append(group_func(value))
+        return columns
+
+    @cached_property
+    def sort_labels(self) -> list[str]:
+        labels = ["sortable_value"]
+        for ix in range(1, len(self.q.sort.values)):
+            labels.append(f"sortable_value_{ix}")
+        return labels
+
+    @cached_property
+    def _sort_key_aliases(self) -> list[Any]:
+        return [
+            self.sort_keys.alias(f"sort_keys_{ix}")
+            for ix in range(len(self.q.sort.values))
+        ]
+
+    def _sort_key_column(self, alias: Any, prop: str) -> Column:
+        suffix = "min" if self.q.sort.ascending else "max"
+        if self._is_numeric_sort(prop):
+            return alias.c[f"number_{suffix}"]
+        return alias.c[f"value_{suffix}"]
+
+    @cached_property
+    def sort_values(self) -> Select:
+        """
+        The `(canonical_id, sortable_value, sortable_value_1, ...)` of the
+        entities matching the query, one value per sort property (unordered and
+        unsliced). Only entities that have the first sort property are included.
+        """
+        columns = [
+            column.label(label)
+            for column, label in zip(self.sort_columns, self.sort_labels)
+        ]
+        if self.use_sort_keys:
+            first, *others = self._sort_key_aliases
+            if self.ids is not None:
+                matching = first.c.canonical_id.in_(self.canonical_ids)
+            else:
+                # a semi join that allows to walk the sort key index in order
+                # until enough matching entities are found
+                matching = exists().where(
+                    self.table.c.canonical_id == first.c.canonical_id, self.clause
                 )
-                .where(
+            joins = first
+            for alias, prop in zip(others, self.q.sort.values[1:]):
+                joins = joins.outerjoin(
+                    alias,
                     and_(
-                        self.table.c.prop == prop,
-                        self.table.c.canonical_id.in_(self.canonical_ids),
-                    )
+                        alias.c.canonical_id == first.c.canonical_id,
+                        alias.c.prop == prop,
+                    ),
+                )
+            return (
+                select(first.c.canonical_id, *columns)
+                .select_from(joins)
+                .where(first.c.prop == self.q.sort.values[0], matching)
+            )
+        if len(self.q.sort.values) > 1:
+            q = select(self.table.c.canonical_id, *columns).where(
+                and_(
+                    self.table.c.prop.in_(self.q.sort.values),
+                    self.table.c.canonical_id.in_(self.canonical_ids),
                 )
-                .group_by(self.table.c.canonical_id)
-                .limit(self.q.limit)
-                .offset(self.q.offset)
             )
+            q = q.group_by(self.table.c.canonical_id)
+            return q.having(self.sort_columns[0].is_not(None))
+        return (
+            select(self.table.c.canonical_id, *columns)
+            .where(
+                and_(
+                    self.table.c.prop == self.q.sort.values[0],
+                    self.table.c.canonical_id.in_(self.canonical_ids),
+                )
+            )
+            .group_by(self.table.c.canonical_id)
+        )
 
-            order_by = "sortable_value"
-            if not self.q.sort.ascending:
-                order_by = desc(order_by)
-            order_by = [order_by, self.table.c.canonical_id]
+    def _get_sort_order(self, id_column: Column) -> list[Any]:
+        # missing values of further sort properties come first (like in
+        # `Sort.apply` where they result in a shorter sort key)
+        first, *others = self.sort_labels
+        if self.q.sort.ascending:
+            order_by = [first, *[asc(label).nulls_first() for label in others]]
+        else:
+            order_by = [desc(first), *[desc(label).nulls_last() for label in others]]
+        return [*order_by, id_column]
 
-            inner = inner.order_by(*order_by)
+    @cached_property
+    def sort_order(self) -> list[Any]:
+        if self.use_sort_keys:
+            return self._get_sort_order(self._sort_key_aliases[0].c.canonical_id)
+        return self._get_sort_order(self.table.c.canonical_id)
 
+    @cached_property
+    def _sorted_statements(self) -> Select:
+        if self.q.sort:
+            inner = (
+                self.sort_values.limit(self.q.limit)
+                .offset(self.q.offset)
+                .order_by(*self.sort_order)
+            )
             return select(
                 self.table.join(
                     inner, self.table.c.canonical_id == inner.c.canonical_id
                 )
-            ).order_by(*order_by)
+            ).order_by(*self._get_sort_order(self.table.c.canonical_id))
+
+    def _get_beyond(self, column: Any, value: Any, first: bool) -> Any | None:
+        # values after `value` in sort order (the first sort value is never null)
+        if self.q.sort.ascending:
+            if value is None:
+                return column.is_not(None)
+            return column > value
+        if value is None:
+            return None
+        if first:
+            return column < value
+        return or_(column < value, column.is_(None))
+
+    def get_page(self, limit: int, after: dict[str, Any] | None = None) -> Select:
+        """
+        Keyset pagination: The canonical ids (and sort values) of the next
+        `limit` entities after the cursor position `after` in the order of the
+        query. Instead of skipping an offset, the position is looked up via
+        `canonical_id > :id` (or `(sortable_value, ..., canonical_id) >
+        (:value, ..., :id)` for sorted queries), so that each page has the same
+        cost.
+
+        Args:
+            limit: Page size
+            after: The `id` (and sort `values`) of the last entity of the
+                previous page
+
+        Returns:
+            Rows of `(canonical_id,)` or `(canonical_id, sortable_value, ...)`
+            for sorted queries
+        """
+        if self.q.sort:
+            q = self.sort_values
+            if after is not None:
+                clauses, equal = [], []
+                for ix, (column, value) in enumerate(
+                    zip(self.sort_columns, after["values"])
+                ):
+                    beyond = self._get_beyond(column, value, not ix)
+                    if beyond is not None:
+                        clauses.append(and_(*equal, beyond))
+                    equal.append(column.is_(None) if value is None else column == value)
+                id_ = self.sort_order[-1]
+                clauses.append(and_(*equal, id_ > after["id"]))
+                if self.use_sort_keys:
+                    q = q.where(or_(*clauses))
+                else:
+                    q = q.having(or_(*clauses))
+            return q.order_by(*self.sort_order).limit(limit)
+        if self.ids is None:
+            column = self.table.c.canonical_id
+        else:
+            column = self.ids.c.canonical_id
+        q = self.all_canonical_ids
+        if after is not None:
+            q = q.where(column > after["id"])
+        return q.order_by(None).order_by(column).limit(limit)
+
+    def get_entities(self, entities: Table) -> Select:
+        """
+        The pre-assembled entities (see `make_entity_table`) matching the query,
+        in the same order as `statements`
+
+        Args:
+            entities: The entity table
+
+        Returns:
+            Rows of `(data, ...)`
+        """
+        if self.q.sort:
+            inner = (
+                self.sort_values.limit(self.q.limit)
+                .offset(self.q.offset)
+                .order_by(*self.sort_order)
+                .subquery()
+            )
+            return (
+                select(entities.c.data, *inner.c)
+                .select_from(
+                    entities.join(
+                        inner, entities.c.canonical_id == inner.c.canonical_id
+                    )
+                )
+                .order_by(*self._get_sort_order(entities.c.canonical_id))
+            )
+        return (
+            select(entities.c.data)
+            .where(entities.c.canonical_id.in_(self.canonical_ids))
+            .order_by(entities.c.canonical_id)
+        )
 
     @cached_property
     def statements(self) -> Select:
@@ -184,6 +585,8 @@ class Sql:
 
     @cached_property
     def count(self) -> Select:
+        if self.ids is not None:
+            return select(func.count()).select_from(self.ids)
         return (
             select(func.count(self.table.c.canonical_id.distinct()))
             .select_from(self.table)
@@ -212,7 +615,7 @@ class Sql:
         group = str(group)
         if group in self.META_COLUMNS:
             grouper = column
-            where = self.clause
+            where = self.id_clause
         else:
             grouper = self.table.c.value
             where = and_(
@@ -288,16 +691,145 @@ class Sql:
         )
 
     @cached_property
-    def aggregations(self) -> Select:
+    def stats_values(self) -> CTE:
+        """
+        The statement rows of the entities matching the query, reduced to the
+        columns needed for the dataset stats
+        """
+        category = case(
+            (self.table.c.schema.in_(Things), "things"),
+            (self.table.c.schema.in_(Intervals), "intervals"),
+        )
+        country = case(
+            (self.table.c.prop_type == str(registry.country), self.table.c.value)
+        )
+        date = case((self.table.c.prop_type == str(registry.date), self.table.c.value))
+        return (
+            select(
+                self.table.c.canonical_id,
+                self.table.c.schema,
+                category.label("category"),
+                country.label("country"),
+                date.label("date"),
+            )
+            .where(self.table.c.canonical_id.in_(self.all_canonical_ids))
+            .cte("stats_values")
+        )
+
+    def get_stats(self, grouping_sets: bool | None = False) -> Select:
+        """
+        All the dataset stats (schemata, countries, date range and entity count)
+        in one statement. Each result row is `(level, schema, category, country,
+        count, start, end)`, with `level` being one of `STATS_SCHEMATA`,
+        `STATS_COUNTRIES` or `STATS_TOTAL`.
+
+        Args:
+            grouping_sets: Use `GROUPING SETS` to compute all levels within a
+                single scan (e.g. postgresql), otherwise the levels are a
+                `UNION ALL` over the same cte (e.g. sqlite)
+        """
+        rows = self.stats_values
+        count = func.count(rows.c.canonical_id.distinct()).label("count")
+        if grouping_sets:
+            level = func.grouping(rows.c.schema, rows.c.category, rows.c.country)
+            return select(
+                level.label("level"),
+                rows.c.schema,
+                rows.c.category,
+                rows.c.country,
+                count,
+                func.min(rows.c.date),
+                func.max(rows.c.date),
+            ).group_by(
+                func.grouping_sets(
+                    tuple_(rows.c.schema, rows.c.category),
+                    tuple_(rows.c.category, rows.c.country),
+                    text("()"),
+                )
+            )
+        return union_all(
+            select(
+                literal_column(str(self.STATS_SCHEMATA)),
+                rows.c.schema,
+                rows.c.category,
+                null(),
+                count,
+                null(),
+                null(),
+            ).group_by(rows.c.schema, rows.c.category),
+            select(
+                literal_column(str(self.STATS_COUNTRIES)),
+                null(),
+                rows.c.category,
+                rows.c.country,
+                count,
+                null(),
+                null(),
+            ).group_by(rows.c.category, rows.c.country),
+            select(
+                literal_column(str(self.STATS_TOTAL)),
+                null(),
+                null(),
+                null(),
+                count,
+                func.min(rows.c.date),
+                func.max(rows.c.date),
+            ),
+        )
+
+    def _get_numeric(self, table: Table) -> Any:
+        if self.typed:
+            return table.c.value_num
+        return make_numeric(table.c.value)
+
+    def is_numeric_aggregation(self, agg: Aggregation) -> bool:
+        """
+        The sql result of the aggregation is a number (and not a property value)
+        """
+        if agg.func in (
+            Aggregations.count,
+            Aggregations.approx_count,
+            Aggregations.sum,
+            Aggregations.avg,
+        ):
+            return True
+        return (
+            self.typed
+            and agg.prop in PropertyTypesMap.__members__
+            and PropertyTypesMap[agg.prop].value == registry.number
+        )
+
+    def _get_aggregator(
+        self, agg: Aggregation, value: Column, table: Table | None = None
+    ) -> AggregationValue:
+        if agg.func in (Aggregations.count, Aggregations.approx_count):
+            # distinct counts are exact in sql
+            return AggregationValue(func.count(distinct(value)))
+        table = self.table if table is None else table
+        if agg.func in (Aggregations.sum, Aggregations.avg):
+            value = self._get_numeric(table)
+        elif self.is_numeric_aggregation(agg):
+            # min / max of the parsed numbers instead of the strings
+            value = table.c.value_num
+        return AggregationValue(getattr(func, agg.func)(value))
+
+    @cached_property
+    def scalar_aggregations(self) -> list[Aggregation]:
+        """
+        The aggregations that can be computed via a single sql aggregate
+        function (the `quantile` and `top` sketches need their own statements)
+        """
+        return [
+            agg
+            for agg in self.q.aggregations
+            if agg.func not in (Aggregations.quantile, Aggregations.top)
+        ]
+
+    @cached_property
+    def aggregations(self) -> Select | None:
         qs = []
-        for agg in self.q.aggregations:
-            sql_agg = getattr(func, agg.func)
-            sql_agg_value = self.table.c.value
-            if agg.func == Aggregations.count:
-                sql_agg_value = distinct(sql_agg_value)
-            elif agg.func in (Aggregations.sum, Aggregations.avg):
-                sql_agg_value = func.cast(sql_agg_value, NUMERIC)
-            aggregator = sql_agg(sql_agg_value)
+        for agg in self.scalar_aggregations:
+            aggregator = self._get_aggregator(agg, self.table.c.value)
             qs.append(
                 select(
                     text(f"'{agg.prop}'"),
@@ -308,55 +840,102 @@ class Sql:
                     self.table.c.canonical_id.in_(self.all_canonical_ids),
                 )
             )
-        return union_all(*qs)
+        if qs:
+            return union_all(*qs)
+
+    def get_quantiles(self, prop: Field) -> Select:
+        """
+        Quantiles of the numeric values of a property via `percentile_cont`
+        (only supported by some backends, e.g. postgresql)
+        """
+        value = self._get_numeric(self.table)
+        return select(
+            *[func.percentile_cont(q).within_group(value) for q in QUANTILES]
+        ).where(
+            self.table.c.prop == prop,
+            self.table.c.canonical_id.in_(self.all_canonical_ids),
+        )
 
-    def _get_grouping_where(self, grouper: Field, value: str) -> BooleanClauseList:
-        column = self._get_lookup_column(grouper)
-        clauses = [self.table.c.canonical_id.in_(self.all_canonical_ids)]
-        if grouper in Properties:
-            clauses.extend([column == str(grouper), self.table.c.value == value])
-            return clauses
-        if grouper == Fields.year:
-            clauses.extend(
-                [
-                    column == str(registry.date),
-                    func.substring(self.table.c.value, 1, 4) == str(value),
-                ]
+    def get_top(self, prop: Field, limit: int | None = TOP_K) -> Select:
+        """
+        The most frequent values of a property with their number of entities
+        """
+        count = func.count(self.table.c.canonical_id.distinct())
+        return (
+            select(self.table.c.value, count)
+            .where(
+                self.table.c.prop == prop,
+                self.table.c.canonical_id.in_(self.all_canonical_ids),
             )
-            return clauses
-        clauses.append(column == value)
-        return clauses
+            .group_by(self.table.c.value)
+            .order_by(count.desc(), self.table.c.value)
+            .limit(limit)
+        )
+
+    def get_group_values(self, grouper: Field, limit: int | None = None) -> CTE:
+        """
+        The distinct (canonical_id, group) pairs for the entities matching the
+        query. If a `limit` is given, only the most frequent groups are used
+        (except for `year`).
+        """
+        column = self._get_lookup_column(grouper)
+        where = [self.table.c.canonical_id.in_(self.all_canonical_ids)]
+        if grouper in self.META_COLUMNS:
+            group = column
+        elif grouper == Fields.year:
+            group = func.substring(self.table.c.value, 1, 4)
+            where.append(column == str(registry.date))
+        else:
+            group = self.table.c.value
+            where.append(column == str(grouper))
+        # all years are used (like the coverage year range before), the limit
+        # only applies to groupers with arbitrary values
+        if limit and grouper != Fields.year:
+            top = self.get_group_counts(grouper, limit=limit).subquery()
+            where.append(group.in_(select(list(top.c)[0])))
+        return (
+            select(self.table.c.canonical_id, group.label("grouper"))
+            .where(*where)
+            .distinct()
+            .cte(f"groups_{grouper}")
+        )
 
-    def get_group_aggregations(self, grouper: Field, group: str) -> Select:
+    def get_group_aggregations(
+        self, grouper: Field, limit: int | None = None
+    ) -> Select | None:
+        """
+        All aggregations grouped by `grouper` in one statement: The group
+        values are joined with the statements of the aggregated properties.
+
+        Returns:
+            Select for rows of (prop, func, group, value)
+        """
+        groups = self.get_group_values(grouper, limit)
+        values = self.table.alias("agg_values")
         qs = []
-        for agg in self.q.aggregations:
+        for agg in self.scalar_aggregations:
             if grouper in agg.group_props:
                 if agg.prop in self.META_COLUMNS:
-                    sql_agg_value = self._get_lookup_column(agg.prop)
+                    value = values.c[self.META_COLUMNS[agg.prop].name]
                 else:
-                    sql_agg_value = self.table.c.value
-                sql_agg = getattr(func, agg.func)
-                if agg.func == Aggregations.count:
-                    sql_agg_value = distinct(sql_agg_value)
-                elif agg.func in (Aggregations.sum, Aggregations.avg):
-                    sql_agg_value = func.cast(sql_agg_value, NUMERIC)
-                aggregator = sql_agg(sql_agg_value)
-
-                inner = select(self.table.c.canonical_id.distinct()).where(
-                    *self._get_grouping_where(grouper, group)
-                )
-
+                    value = values.c.value
                 qs.append(
                     select(
                         text(f"'{agg.prop}'"),
                         text(f"'{agg.func}'"),
-                        aggregator,
-                    ).where(
-                        self.table.c.prop == agg.prop,
-                        self.table.c.canonical_id.in_(inner),
+                        groups.c.grouper,
+                        self._get_aggregator(agg, value, values),
+                    )
+                    .select_from(
+                        groups.join(
+                            values, values.c.canonical_id == groups.c.canonical_id
+                        )
                     )
+                    .where(values.c.prop == agg.prop)
+                    .group_by(groups.c.grouper)
                 )
-        return union_all(*qs)
+        if qs:
+            return union_all(*qs)
 
     @cached_property
     def group_props(self) -> set[Field]:
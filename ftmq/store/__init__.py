@@ -4,7 +4,6 @@ from typing import TypeVar
 from urllib.parse import urlparse
 
 from nomenklatura import Resolver
-from nomenklatura.db import get_metadata
 
 from ftmq.dedupe import get_resolver
 from ftmq.model.dataset import Catalog, Dataset
@@ -23,6 +22,7 @@ def get_store(
     catalog: Catalog | None = None,
     dataset: Dataset | str | None = None,
     linker: Resolver | str | None = None,
+    fetch_size: int | None = None,
 ) -> Store:
     """
     Get an initialized [Store][ftmq.store.base.Store]. The backend is inferred
@@ -50,6 +50,8 @@ def get_store(
         catalog: A `ftmq.model.Catalog` instance to limit the scope to
         dataset: A `ftmq.model.Dataset` instance to limit the scope to
         linker: A `nomenklatura.Resolver` instance with linked / deduped data
+        fetch_size: Number of rows a sql store fetches at once when streaming
+            (default: env `SQL_FETCH_SIZE`)
 
     Returns:
         The initialized store. This is a cached object.
@@ -86,8 +88,9 @@ def get_store(
         except ImportError:
             raise ImportError("Can not load ClickhouseStore. Install `ftm-columnstore`")
     if "sql" in parsed.scheme:
-        get_metadata.cache_clear()
-        return SQLStore(catalog, dataset, uri=uri, linker=linker)
+        return SQLStore(
+            catalog, dataset, uri=uri, linker=linker, fetch_size=fetch_size
+        )
     if "aleph" in parsed.scheme:
         return AlephStore.from_uri(uri, catalog=catalog, dataset=dataset, linker=linker)
     raise NotImplementedError(uri)
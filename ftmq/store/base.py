@@ -1,18 +1,32 @@
-from typing import Iterable
+import heapq
+import os
+from itertools import islice
+from typing import Any, Iterable
 
+from followthemoney.types import registry
 from nomenklatura import store as nk
 from nomenklatura.resolver import Resolver
 
 from ftmq.aggregations import AggregatorResult
+from ftmq.exceptions import ValidationError
 from ftmq.logging import get_logger
 from ftmq.model.coverage import Collector, DatasetStats
 from ftmq.model.dataset import C, Dataset
-from ftmq.query import Q
+from ftmq.profile import Profiler
+from ftmq.query import Q, Query
 from ftmq.types import CE, CEGenerator
-from ftmq.util import DefaultDataset, ensure_dataset, make_dataset
+from ftmq.util import (
+    DefaultDataset,
+    decode_cursor,
+    encode_cursor,
+    ensure_dataset,
+    make_dataset,
+)
 
 log = get_logger(__name__)
 
+PAGE_SIZE = int(os.environ.get("PAGE_SIZE", 100))
+
 
 class Store(nk.Store):
     """
@@ -100,6 +114,20 @@ class View(nk.base.View):
         super().__init__(*args, **kwargs)
         self._cache = {}
 
+    def get_candidates(self, query: Q | None = None) -> CEGenerator:
+        """
+        Get the entities that need to be tested against a query. Stores can
+        narrow them down via their indexes.
+
+        Args:
+            query: The Query filter object
+
+        Yields:
+            Generator of `nomenklatura.entity.CompositeEntity`
+        """
+        view = self.store.view(self.scope)
+        yield from view.entities()
+
     def entities(self, query: Q | None = None) -> CEGenerator:
         """
         Get the entities of a store, optionally filtered by a
@@ -111,24 +139,117 @@ class View(nk.base.View):
         Yields:
             Generator of `nomenklatura.entity.CompositeEntity`
         """
-        view = self.store.view(self.scope)
         if query:
-            yield from query.apply_iter(view.entities())
+            yield from query.apply_iter(self.get_candidates(query))
+        else:
+            yield from self.get_candidates()
+
+    def page(
+        self, query: Q, cursor: str | None = None, limit: int | None = PAGE_SIZE
+    ) -> tuple[list[CE], str | None]:
+        """
+        Get a page of the entities for a [`Query`][ftmq.Query] (cursor
+        pagination). Instead of slicing the query with an offset, pass the cursor
+        of the previous page to get the next one. Unsorted queries are paginated
+        in the order of the entity ids.
+
+        Example:
+            ```python
+            entities, cursor = view.page(q, limit=100)
+            while cursor is not None:
+                entities, cursor = view.page(q, cursor, limit=100)
+            ```
+
+        Args:
+            query: The Query filter object (without a slice)
+            cursor: The cursor returned for the previous page
+            limit: Page size
+
+        Returns:
+            The entities of the page and the cursor for the next page (`None` if
+            this is the last page)
+
+        Raises:
+            ValidationError: If the query is sliced or the cursor entity of a
+                sorted query is not part of the results (anymore)
+        """
+        if query.slice:
+            raise ValidationError("Paginated queries can not be sliced")
+        after = decode_cursor(cursor) if cursor else None
+        if not query.sort:
+            # keyset pagination: the entities ordered by id after the cursor id
+            entities = self.entities(query)
+            if after is not None:
+                entities = (e for e in entities if e.id > after["id"])
+            entities = heapq.nsmallest(limit + 1, entities, key=lambda e: e.id)
         else:
-            yield from view.entities()
+            entities = self.entities(query)
+            if after is not None:
+                for proxy in entities:
+                    if proxy.id == after["id"]:
+                        break
+                else:
+                    raise ValidationError(f"Cursor entity not found: `{after['id']}`")
+            entities = list(islice(entities, limit + 1))
+        if len(entities) > limit:
+            return entities[:limit], encode_cursor({"id": entities[limit - 1].id})
+        return entities, None
+
+    def explain(self, query: Q, analyze: bool | None = False) -> dict[str, Any]:
+        """
+        Describe how a [`Query`][ftmq.Query] is executed by this view.
+
+        Args:
+            query: The Query filter object
+            analyze: Execute the query and report the number of results and the
+                time spent in each stage (read, filter, sort, aggregate)
+
+        Returns:
+            The query plan (and timings)
+        """
+        data: dict[str, Any] = {"query": query.serialize(), "plan": query.explain()}
+        if analyze:
+            profiler = Profiler()
+            proxies = profiler.wrap("read", self.get_candidates(query))
+            data["count"] = sum(1 for _ in query.apply_iter(proxies, profiler))
+            data["timings"] = profiler.timings
+        return data
 
     def get_adjacents(
         self, proxies: Iterable[CE], inverted: bool | None = False
     ) -> set[CE]:
+        """
+        Get the adjacent entities of the given proxies. Every adjacent entity is
+        looked up only once, even if it is referenced by multiple proxies.
+
+        Args:
+            proxies: The proxies to get the adjacents for
+            inverted: Include entities that are pointing to the proxies
+
+        Returns:
+            The set of adjacent `nomenklatura.entity.CompositeEntity`
+        """
         seen: set[CE] = set()
+        ids: set[str] = set()
+        targets: set[str] = set()
         for proxy in proxies:
-            for _, adjacent in self.get_adjacent(proxy, inverted=inverted):
-                if adjacent.id not in seen:
+            ids.add(proxy.id)
+            for prop, value in proxy.itervalues():
+                if prop.type == registry.entity:
+                    targets.add(value)
+        for target in sorted(targets):
+            adjacent = self.get_entity(target)
+            if adjacent is not None:
+                seen.add(adjacent)
+        if inverted:
+            for id_ in sorted(ids):
+                for _, adjacent in self.get_inverted(id_):
                     seen.add(adjacent)
         return seen
 
     def stats(self, query: Q | None = None) -> DatasetStats:
-        key = f"stats-{hash(query)}"
+        query = query or Query()
+        key = f"stats-{query.cache_key}"
         if key in self._cache:
             return self._cache[key]
         c = Collector()
@@ -139,7 +260,7 @@ class View(nk.base.View):
     def aggregations(self, query: Q) -> AggregatorResult | None:
         if not query.aggregations:
             return
-        key = f"agg-{hash(query)}"
+        key = f"agg-{query.cache_key}"
         if key in self._cache:
             return self._cache[key]
         _ = [x for x in self.entities(query)]
@@ -1,12 +1,94 @@
+from typing import Any, Iterable
+
+from followthemoney.types import registry
 from nomenklatura import store as nk
 from nomenklatura.dataset import DS
 
+from ftmq.filters import Lookup
 from ftmq.model.dataset import Catalog
+from ftmq.query import Q
 from ftmq.store.base import Store, View
+from ftmq.types import CE, CEGenerator
 
 
 class MemoryQueryView(View, nk.memory.MemoryView):
-    pass
+    def get_referrer_ids(self, query: Q) -> set[str] | None:
+        """
+        Look up the ids of entities referencing the `reverse` filter values via
+        the inverted index of the store. Returns `None` if none of the filters
+        can be answered by the index.
+        """
+        ids: set[str] | None = None
+        for f in query.reversed:
+            if f.comparator == Lookup.EQUALS:
+                targets = {f.value}
+            elif f.comparator == Lookup.IN:
+                targets = f.value
+            else:
+                continue
+            referrers: set[str] = set()
+            for target in targets:
+                target = self.store.linker.get_canonical(target)
+                referrers.update(self.store.inverted.get(target, ()))
+            ids = referrers if ids is None else ids & referrers
+        return ids
+
+    def filter_scope(self, ids: Iterable[str]) -> set[str]:
+        """
+        Limit the given entity ids (e.g. from the inverted index, which is not
+        scoped) to the datasets of this view. Only the given ids are tested.
+        """
+        if self.store.entities.keys() <= self.dataset_names:
+            return set(ids)
+        scopes = [
+            self.store.entities[name]
+            for name in self.dataset_names
+            if name in self.store.entities
+        ]
+        return {i for i in ids if any(i in scope for scope in scopes)}
+
+    def get_candidates(self, query: Q | None = None) -> CEGenerator:
+        if query and query.reversed:
+            ids = self.get_referrer_ids(query)
+            if ids is not None:
+                # only test the candidates from the inverted index (the index
+                # is not scoped to the datasets of the view)
+                for id_ in sorted(self.filter_scope(ids)):
+                    entity = self.get_entity(id_)
+                    if entity is not None:
+                        yield entity
+                return
+        yield from super().get_candidates(query)
+
+    def explain(self, query: Q, analyze: bool | None = False) -> dict[str, Any]:
+        data = super().explain(query, analyze)
+        if query.reversed and self.get_referrer_ids(query) is not None:
+            data["plan"]["index"] = "inverted"
+        return data
+
+    def get_adjacents(
+        self, proxies: Iterable[CE], inverted: bool | None = False
+    ) -> set[CE]:
+        proxies = list(proxies)
+        adjacents = super().get_adjacents(proxies)
+        if inverted:
+            ids = {p.id for p in proxies}
+            referrers: set[str] = set()
+            for id_ in ids:
+                referrers.update(self.store.inverted.get(id_, ()))
+            for referrer in self.filter_scope(referrers):
+                entity = self.get_entity(referrer)
+                if entity is None:
+                    continue
+                for prop, value in entity.itervalues():
+                    if (
+                        prop.type == registry.entity
+                        and prop.reverse is not None
+                        and value in ids
+                    ):
+                        adjacents.add(entity)
+                        break
+        return adjacents
 
 
 class MemoryStore(Store, nk.SimpleMemoryStore):
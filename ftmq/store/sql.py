@@ -1,32 +1,200 @@
+import hashlib
+import io
 import os
 from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
 from decimal import Decimal
+from itertools import groupby
+from typing import Any, Callable, Generator, Iterable, TypeAlias
+from uuid import uuid4
+
+import orjson
 
 from anystore.util import clean_dict
+from followthemoney.types import registry
+from nomenklatura import settings as nk_settings
 from nomenklatura import store as nk
 from nomenklatura.dataset import DS
-from sqlalchemy import select
+from nomenklatura.entity import CompositeEntity
+from nomenklatura.resolver import Linker
+from nomenklatura.statement import Statement
+from nomenklatura.statement.db import make_statement_table
+from sqlalchemy import (
+    Column,
+    Connection,
+    Index,
+    MetaData,
+    Select,
+    String,
+    Table,
+    bindparam,
+    create_engine,
+    event,
+    insert,
+    inspect,
+    select,
+    text,
+    update,
+)
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import CompileError
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.expression import ClauseElement, Executable
 
-from ftmq.aggregations import AggregatorResult
-from ftmq.enums import Fields
+from ftmq.aggregations import Aggregation, Aggregator, AggregatorResult
+from ftmq.enums import Aggregations
 from ftmq.exceptions import ValidationError
+from ftmq.logging import get_logger
 from ftmq.model.coverage import Collector, DatasetStats
 from ftmq.model.dataset import Catalog
+from ftmq.profile import Profiler
 from ftmq.query import Q, Query
-from ftmq.store.base import Store, View
-from ftmq.types import CEGenerator
-from ftmq.util import to_numeric
+from ftmq.sketches import QUANTILES
+from ftmq.sql import (
+    SORT_KEY_TYPES,
+    TYPED_VALUE_TYPES,
+    Sql,
+    make_entity_table,
+    make_sort_key_table,
+    make_typed_columns,
+)
+from ftmq.store.base import PAGE_SIZE, Store, View
+from ftmq.types import CE, CEGenerator
+from ftmq.util import decode_cursor, encode_cursor, to_date, to_numeric
+
+log = get_logger(__name__)
+
+StatementTest: TypeAlias = Callable[[Statement], bool]
 
 MAX_SQL_AGG_GROUPS = int(os.environ.get("MAX_SQL_AGG_GROUPS", 10))
+SQL_FETCH_SIZE = int(os.environ.get("SQL_FETCH_SIZE", 10_000))
+SQL_COPY_BATCH_SIZE = int(os.environ.get("SQL_COPY_BATCH_SIZE", 100_000))
+# sqlite page cache (KiB) for reading and bulk loading and memory mapped reads
+SQLITE_CACHE_SIZE = int(os.environ.get("SQLITE_CACHE_SIZE", 64_000))
+SQLITE_LOAD_CACHE_SIZE = int(os.environ.get("SQLITE_LOAD_CACHE_SIZE", 1_000_000))
+SQLITE_MMAP_SIZE = int(os.environ.get("SQLITE_MMAP_SIZE", 1 << 30))
+# number of entities to update the sort keys and pre-assembled entities for at once
+SQL_UPDATE_BATCH_SIZE = int(os.environ.get("SQL_UPDATE_BATCH_SIZE", 10_000))
+# statement columns that are updated for existing rows (same as nomenklatura)
+UPSERT_COLUMNS = (
+    "canonical_id",
+    "schema",
+    "prop_type",
+    "target",
+    "lang",
+    "original_value",
+    "last_seen",
+)
+EXPLAIN_PREFIXES = {
+    "sqlite": ("EXPLAIN QUERY PLAN", "EXPLAIN QUERY PLAN"),
+    "postgresql": ("EXPLAIN", "EXPLAIN ANALYZE"),
+}
+# per thread (or task): the pinned connection by `id(store)` and the temporary
+# id tables (filter key -> table) by `id(view)`, as the tables are bound to the
+# pinned connection. The entries only exist within the context managers.
+SQL_CONNECTIONS: ContextVar[dict[int, Connection]] = ContextVar(
+    "ftmq_sql_connections", default={}
+)
+SQL_MATERIALIZED: ContextVar[dict[int, dict[str, Table]]] = ContextVar(
+    "ftmq_sql_materialized", default={}
+)
 
 
-def clean_agg_value(value: str | Decimal) -> str | float | int | None:
-    if isinstance(value, Decimal):
+def clean_agg_value(
+    value: str | Decimal | None, numeric: bool | None = False
+) -> str | float | int | None:
+    if isinstance(value, Decimal) or (numeric and value is not None):
         return to_numeric(value)
     return value
 
 
+def dump_cursor_value(value: Any) -> Any:
+    """
+    Keep numeric sort values (`Decimal`) exact in page cursors
+    """
+    if isinstance(value, Decimal):
+        return {"decimal": str(value)}
+    return value
+
+
+def load_cursor_value(value: Any) -> Any:
+    """
+    Restore a sort value of a page cursor created via `dump_cursor_value`
+    """
+    if isinstance(value, dict):
+        try:
+            return Decimal(value["decimal"])
+        except (KeyError, TypeError, ArithmeticError):
+            raise ValidationError(f"Invalid cursor value: `{value}`")
+    return value
+
+
+def to_copy_value(value: Any) -> str:
+    """
+    Serialize a value for the postgresql `COPY` text format
+    """
+    if value is None:
+        return "\\N"
+    if isinstance(value, bool):
+        return "t" if value else "f"
+    return (
+        str(value)
+        .replace("\\", "\\\\")
+        .replace("\t", "\\t")
+        .replace("\n", "\\n")
+        .replace("\r", "\\r")
+    )
+
+
+def set_sqlite_pragmas(dbapi_connection: Any, *args) -> None:
+    """
+    Read optimized sqlite settings, applied to each new connection. Only per
+    connection settings, the database file itself is not changed (e.g. its
+    journal mode)
+    """
+    cursor = dbapi_connection.cursor()
+    for pragma in (
+        f"cache_size = -{SQLITE_CACHE_SIZE}",
+        f"mmap_size = {SQLITE_MMAP_SIZE}",
+        "temp_store = MEMORY",
+    ):
+        cursor.execute(f"PRAGMA {pragma}")
+    cursor.close()
+
+
+class Explain(Executable, ClauseElement):
+    """Prefix a select statement with the backends `EXPLAIN` keyword"""
+
+    inherit_cache = False
+
+    def __init__(self, statement: Select, prefix: str) -> None:
+        self.statement = statement
+        self.prefix = prefix
+
+
+@compiles(Explain)
+def _compile_explain(element: Explain, compiler, **kwargs) -> str:
+    return f"{element.prefix} {compiler.process(element.statement, **kwargs)}"
+
+
+def get_filter_key(query: Q) -> str:
+    """
+    A key for the filters of a query (independent of sort, slice and
+    aggregations)
+    """
+    filters = orjson.dumps(query.serialize()["filters"])
+    return hashlib.sha1(filters).hexdigest()
+
+
 class SQLQueryView(View, nk.sql.SQLView):
+    def get_materialized(self) -> dict[str, Table]:
+        """
+        The temporary id tables of this view in the current thread (or task)
+        """
+        return SQL_MATERIALIZED.get().get(id(self), {})
+
     def ensure_scoped_query(self, query: Q) -> Q:
         if not query.datasets:
             return query.where(dataset__in=self.dataset_names)
@@ -34,48 +202,235 @@ class SQLQueryView(View, nk.sql.SQLView):
             raise ValidationError("Query datasets outside view scope")
         return query
 
+    def get_sql(self, query: Q) -> Sql:
+        """
+        Get the sql interface for a (scoped) query, using the materialized ids
+        of its filters if available
+        """
+        ids = self.get_materialized().get(get_filter_key(query))
+        return Sql(
+            query,
+            ids=ids,
+            sort_keys=self.store.sort_keys,
+            typed=self.store.typed_table is not None,
+        )
+
+    @contextmanager
+    def materialize(self, query: Q) -> Generator[Q, None, None]:
+        """
+        Evaluate the filters of a query once into a temporary table of
+        canonical ids (with a primary key index). Within this context, all
+        queries with the same filters (e.g. stats, aggregations or different
+        pages of the entities) use this id set instead of evaluating the
+        filters again. All reads of the store (within the current thread or
+        task) are pinned to one database connection meanwhile, as temporary
+        tables are bound to it.
+
+        Example:
+            ```python
+            view = store.query()
+            with view.materialize(q) as q:
+                stats = view.stats(q)
+                aggs = view.aggregations(q.aggregate("sum", "amountEur"))
+                page = [e for e in view.entities(q[100:200])]
+            ```
+
+        Yields:
+            The scoped query
+        """
+        query = self.ensure_scoped_query(query)
+        key = get_filter_key(query)
+        materialized = self.get_materialized()
+        if key in materialized:
+            yield query
+            return
+        with self.store.connection() as conn:
+            table = Table(
+                f"ftmq_ids_{uuid4().hex}",
+                MetaData(),
+                Column("canonical_id", String(255), primary_key=True),
+                prefixes=["TEMPORARY"],
+            )
+            table.create(conn)
+            conn.execute(
+                insert(table).from_select(
+                    ["canonical_id"], self.get_sql(query).all_canonical_ids
+                )
+            )
+            if conn.dialect.name == "postgresql":
+                # temporary tables are not analyzed automatically
+                conn.execute(text(f"ANALYZE {table.name}"))
+            conn.commit()
+            views = SQL_MATERIALIZED.get()
+            token = SQL_MATERIALIZED.set(
+                {**views, id(self): {**materialized, key: table}}
+            )
+            try:
+                yield query
+            finally:
+                SQL_MATERIALIZED.reset(token)
+                table.drop(conn)
+                conn.commit()
+
+    def get_entity(self, id: str) -> CE | None:
+        table = self.store.entity_table
+        if table is None:
+            return super().get_entity(id)
+        q = select(table.c.data).where(table.c.canonical_id == id)
+        datasets = self.dataset_names
+
+        def _test(stmt: Statement) -> bool:
+            return stmt.dataset in datasets
+
+        for entity in self.store._iterate_entities(q, _test):
+            return entity
+        return None
+
     def entities(self, query: Q | None = None) -> CEGenerator:
         if query:
             query = self.ensure_scoped_query(query)
-            yield from self.store._iterate(query.sql.statements)
+            sql = self.get_sql(query)
+            if self.store.entity_table is not None:
+                scope = get_statement_scope(query) if sql.scoped_statements else None
+                q = sql.get_entities(self.store.entity_table)
+                yield from self.store._iterate_entities(q, scope)
+            else:
+                yield from self.store._iterate(sql.statements)
         else:
             view = self.store.view(self.scope)
             yield from view.entities()
 
+    def page(
+        self, query: Q, cursor: str | None = None, limit: int | None = PAGE_SIZE
+    ) -> tuple[list[CE], str | None]:
+        if query.slice:
+            raise ValidationError("Paginated queries can not be sliced")
+        query = self.ensure_scoped_query(query)
+        after = decode_cursor(cursor) if cursor else None
+        if after is not None and "values" in after:
+            after["values"] = [load_cursor_value(v) for v in after["values"]]
+        sql = self.get_sql(query)
+        rows = [
+            (row[0], [dump_cursor_value(value) for value in row[1:]])
+            for row in self.store._execute(sql.get_page(limit + 1, after), stream=False)
+        ]
+        ids = [canonical_id for canonical_id, _ in rows[:limit]]
+        # the same statement scope as `entities()`
+        table = self.store.entity_table
+        if table is not None:
+            scope = get_statement_scope(query) if sql.scoped_statements else None
+            q = select(table.c.data).where(table.c.canonical_id.in_(ids))
+            entities = {e.id: e for e in self.store._iterate_entities(q, scope)}
+        else:
+            q = select(sql.table).where(sql.table.c.canonical_id.in_(ids))
+            if sql.scoped_statements:
+                q = q.where(*sql.scope_clauses)
+            q = q.order_by(sql.table.c.canonical_id)
+            entities = {e.id: e for e in self.store._iterate(q)}
+        page = [entities[i] for i in ids if i in entities]
+        if len(rows) > limit:
+            canonical_id, values = rows[limit - 1]
+            return page, encode_cursor({"id": canonical_id, "values": values})
+        return page, None
+
+    def compile_sql(self, statement: Select) -> str:
+        dialect = self.store.engine.dialect
+        try:
+            compiled = statement.compile(
+                dialect=dialect, compile_kwargs={"literal_binds": True}
+            )
+        except (CompileError, NotImplementedError):
+            compiled = statement.compile(dialect=dialect)
+        return str(compiled)
+
+    def get_plan(self, statement: Select, analyze: bool | None = False) -> list[str]:
+        prefixes = EXPLAIN_PREFIXES.get(self.store.engine.dialect.name)
+        if prefixes is None:
+            return []
+        explain = Explain(statement, prefixes[int(bool(analyze))])
+        return [str(row[-1]) for row in self.store._execute(explain, stream=False)]
+
+    def explain(self, query: Q, analyze: bool | None = False) -> dict[str, Any]:
+        """
+        Describe how a [`Query`][ftmq.Query] is executed by the sql backend: The
+        generated sql for the entities, count, stats and aggregation statements
+        and the query plans of the database (`EXPLAIN`).
+
+        Args:
+            query: The Query filter object
+            analyze: Execute the entities and count statements and report the
+                number of results and the time spent for them. For postgresql,
+                `EXPLAIN ANALYZE` is used.
+
+        Returns:
+            The query plan (and timings)
+        """
+        query = self.ensure_scoped_query(query)
+        sql = self.get_sql(query)
+        statements = {
+            "statements": sql.statements,
+            "count": sql.count,
+            "stats": sql.get_stats(self.store.engine.dialect.name == "postgresql"),
+        }
+        if sql.aggregations is not None:
+            statements["aggregations"] = sql.aggregations
+        data: dict[str, Any] = {
+            "query": query.serialize(),
+            "dialect": self.store.engine.dialect.name,
+            "sql": {k: self.compile_sql(v) for k, v in statements.items()},
+            "plan": {
+                "statements": self.get_plan(sql.statements, analyze),
+                "count": self.get_plan(sql.count, analyze),
+            },
+        }
+        if analyze:
+            # the statements are independent, so time each of them on its own
+            data["timings"] = {}
+            for stage, rows in (
+                ("statements", self.entities(query)),
+                ("count", self.store._execute(sql.count, stream=False)),
+            ):
+                profiler = Profiler()
+                for _ in profiler.wrap(stage, rows):
+                    pass
+                data["timings"].update(profiler.timings)
+            data["count"] = data["timings"]["statements"]["items"]
+        return data
+
     def stats(self, query: Q | None = None) -> DatasetStats:
         query = self.ensure_scoped_query(query or Query())
-        key = f"stats-{hash(query)}"
+        key = f"stats-{query.cache_key}"
         if key in self._cache:
             return self._cache[key]
 
+        sql = self.get_sql(query)
+        grouping_sets = self.store.engine.dialect.name == "postgresql"
+        rows = self.store._execute(sql.get_stats(grouping_sets), stream=False)
         c = Collector()
-        for schema, count in self.store._execute(query.sql.things, stream=False):
-            c.things[schema] = count
-        for schema, count in self.store._execute(query.sql.intervals, stream=False):
-            c.intervals[schema] = count
-        for country, count in self.store._execute(
-            query.sql.things_countries, stream=False
+        entity_count, start, end = 0, None, None
+        # most frequent schemata and countries first
+        for level, schema, category, country, count, min_date, max_date in sorted(
+            rows, key=lambda r: -r[4]
         ):
-            if country is not None:
-                c.things_countries[country] = count
-        for country, count in self.store._execute(
-            query.sql.intervals_countries, stream=False
-        ):
-            if country is not None:
-                c.intervals_countries[country] = count
+            if level == Sql.STATS_TOTAL:
+                entity_count, start, end = count, min_date, max_date
+            elif level == Sql.STATS_SCHEMATA:
+                if category == "things":
+                    c.things[schema] = count
+                elif category == "intervals":
+                    c.intervals[schema] = count
+            elif level == Sql.STATS_COUNTRIES and country is not None:
+                if category == "things":
+                    c.things_countries[country] = count
+                elif category == "intervals":
+                    c.intervals_countries[country] = count
 
         stats = c.export()
-        for start, end in self.store._execute(query.sql.date_range, stream=False):
-            if start:
-                stats.coverage.start = start
-            if end:
-                stats.coverage.end = end
-            break
-
-        for res in self.store._execute(query.sql.count, stream=False):
-            for count in res:
-                stats.entity_count = count
-                break
+        if start:
+            stats.coverage.start = start
+        if end:
+            stats.coverage.end = end
+        stats.entity_count = entity_count
         self._cache[key] = stats
         return stats
 
@@ -83,46 +438,805 @@ class SQLQueryView(View, nk.sql.SQLView):
         if not query.aggregations:
             return
         query = self.ensure_scoped_query(query)
-        key = f"agg-{hash(query)}"
+        key = f"agg-{query.cache_key}"
         if key in self._cache:
             return self._cache[key]
+        sql = self.get_sql(query)
         res: AggregatorResult = defaultdict(dict)
 
-        for prop, func, value in self.store._execute(
-            query.sql.aggregations, stream=False
-        ):
-            res[func][prop] = clean_agg_value(value)
+        # (prop, func) of the aggregations with numeric results
+        numeric = {
+            (f"{agg.prop}", f"{agg.func}")
+            for agg in sql.scalar_aggregations
+            if sql.is_numeric_aggregation(agg)
+        }
+        if sql.aggregations is not None:
+            rows = self.store._execute(sql.aggregations, stream=False)
+            for prop, func, value in rows:
+                res[func][prop] = clean_agg_value(value, (prop, func) in numeric)
 
-        if query.sql.group_props:
+        # sketch aggregations: computed in sql where possible, otherwise (and
+        # for groups) the entities are aggregated in python
+        fallback: list[Aggregation] = []
+        for agg in query.aggregations:
+            if agg.func not in (Aggregations.quantile, Aggregations.top):
+                continue
+            if agg.group_props:
+                fallback.append(agg)
+            elif agg.func == Aggregations.top:
+                top = self.store._execute(sql.get_top(agg.prop), stream=False)
+                res[agg.func][agg.prop] = [(value, count) for value, count in top]
+            elif self.store.engine.dialect.name == "postgresql":
+                q = sql.get_quantiles(agg.prop)
+                for row in self.store._execute(q, stream=False):
+                    res[agg.func][agg.prop] = {
+                        str(q): clean_agg_value(v) for q, v in zip(QUANTILES, row)
+                    }
+            else:
+                fallback.append(agg)
+
+        if sql.group_props:
             res["groups"] = defaultdict(lambda: defaultdict(lambda: defaultdict(dict)))
-            for prop in query.sql.group_props:
-                if prop == Fields.year:
-                    start, end = self.stats(query).coverage.years
-                    if start or end:
-                        groups = range(start or end, (end or start) + 1)
-                    else:
-                        groups = []
-                else:
-                    groups = [
-                        r[0]
-                        for r in self.store._execute(
-                            query.sql.get_group_counts(prop, limit=MAX_SQL_AGG_GROUPS),
-                            stream=False,
-                        )
-                    ]
-                for group in groups:
-                    for agg_prop, func, value in self.store._execute(
-                        query.sql.get_group_aggregations(prop, group), stream=False
-                    ):
+            for prop in sql.group_props:
+                q = sql.get_group_aggregations(prop, limit=MAX_SQL_AGG_GROUPS)
+                if q is None:
+                    continue
+                for agg_prop, func, group, value in self.store._execute(
+                    q, stream=False
+                ):
+                    if group is not None:
                         res["groups"][prop][func][agg_prop][group] = clean_agg_value(
-                            value
+                            value, (agg_prop, func) in numeric
                         )
+
+        if fallback:
+            aggregator = Aggregator(
+                aggregations=[
+                    Aggregation(prop=a.prop, func=a.func, group_props=a.group_props)
+                    for a in fallback
+                ]
+            )
+            for _ in aggregator.apply(self.entities(query)):
+                pass
+            for func, values in aggregator.result.items():
+                if func == "groups":
+                    for prop, funcs in values.items():
+                        for group_func, props in funcs.items():
+                            res["groups"][prop][group_func].update(props)
+                else:
+                    res[func].update(values)
         res = clean_dict(res)
         self._cache[key] = res
         return res
 
 
-class SQLStore(Store, nk.SQLStore):
+def get_sort_keys(rows: Iterable[tuple[str, str, str, str]]) -> list[dict[str, Any]]:
+    """
+    Aggregate statement rows of `(canonical_id, prop, prop_type, value)` into
+    the rows of the sort key table (see
+    [`make_sort_key_table`][ftmq.sql.make_sort_key_table]). Numbers are parsed
+    the same way as for sorting in memory.
+    """
+    values: dict[tuple[str, str], list[str]] = defaultdict(list)
+    types: dict[tuple[str, str], str] = {}
+    for canonical_id, prop, prop_type, value in rows:
+        values[(canonical_id, prop)].append(value)
+        types[(canonical_id, prop)] = prop_type
+    keys = []
+    for (canonical_id, prop), prop_values in values.items():
+        numbers = []
+        if types[(canonical_id, prop)] == registry.number.name:
+            numbers = [n for n in map(to_numeric, prop_values) if n is not None]
+        keys.append(
+            {
+                "canonical_id": canonical_id,
+                "prop": prop,
+                "value_min": min(prop_values),
+                "value_max": max(prop_values),
+                "number_min": min(numbers) if numbers else None,
+                "number_max": max(numbers) if numbers else None,
+            }
+        )
+    return keys
+
+
+def get_typed_values(prop_type: str, value: str) -> dict[str, Any]:
+    """
+    The values of the [typed value columns][ftmq.sql.make_typed_columns] for a
+    statement value
+    """
+    # unparsable and non-finite numbers ("nan", "inf") are stored as NULL
+    number = to_numeric(value) if prop_type == registry.number.name else None
+    day = to_date(value) if prop_type == registry.date.name else None
+    return {"value_num": number, "value_date": day}
+
+
+def dump_entity(entity: CE, statements: Iterable[Statement]) -> str:
+    """
+    Serialize an assembled entity with its statements for the entity table
+    """
+    data = {
+        "id": entity.id,
+        "schema": entity.schema.name,
+        "referents": sorted(entity.extra_referents),
+        "statements": [
+            [
+                stmt.id,
+                stmt.entity_id,
+                stmt.prop,
+                stmt.schema,
+                stmt.value,
+                stmt.dataset,
+                stmt.lang,
+                stmt.original_value,
+                stmt.first_seen,
+                stmt.last_seen,
+                stmt.target,
+                stmt.external,
+            ]
+            for stmt in statements
+        ],
+    }
+    return orjson.dumps(data).decode()
+
+
+def load_entity(
+    dataset: DS, data: str | bytes, scope: StatementTest | None = None
+) -> CE | None:
+    """
+    Load an entity serialized via `dump_entity`, optionally only with the
+    statements that pass the `scope` test
+    """
+    data = orjson.loads(data)
+    canonical_id = data["id"]
+    statements = []
+    for (
+        id_,
+        entity_id,
+        prop,
+        schema,
+        value,
+        dataset_name,
+        lang,
+        original_value,
+        first_seen,
+        last_seen,
+        target,
+        external,
+    ) in data["statements"]:
+        stmt = Statement(
+            id=id_,
+            canonical_id=canonical_id,
+            entity_id=entity_id,
+            prop=prop,
+            schema=schema,
+            value=value,
+            dataset=dataset_name,
+            lang=lang,
+            original_value=original_value,
+            first_seen=first_seen,
+            last_seen=last_seen,
+            target=target,
+            external=external,
+        )
+        if scope is None or scope(stmt):
+            statements.append(stmt)
+    if not statements:
+        return
+    entity = CompositeEntity.from_statements(dataset, statements)
+    entity.extra_referents.update(data["referents"])
+    return entity
+
+
+def get_statement_scope(query: Q) -> StatementTest | None:
+    """
+    A test for the statements within the dataset and schema scope of a query
+    (the same as the scope clauses of [`Sql`][ftmq.sql.Sql])
+    """
+    datasets = [f.compile_values() for f in query.datasets]
+    schemata = [f.compile_values() for f in query.schemata]
+    if not datasets and not schemata:
+        return
+
+    def _test(stmt: Statement) -> bool:
+        if datasets and not any(test(stmt.dataset) for test in datasets):
+            return False
+        if schemata and not any(test(stmt.schema) for test in schemata):
+            return False
+        return True
+
+    return _test
+
+
+class SQLWriter(nk.sql.SQLWriter):
+    """
+    Keeps the typed values, sort keys and pre-assembled entities of the store
+    (if any) up to date for the written entities
+    """
+
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.changed: set[str] = set()
+        self.track_all = self.store.entity_table is not None
+
+    def _upsert_batch(self) -> None:
+        batch = self.batch
+        super()._upsert_batch()
+        if self.store.typed_table is not None and batch:
+            self.store._update_typed_values(self.conn, batch)
+
+    def add_statement(self, stmt: Statement) -> None:
+        super().add_statement(stmt)
+        if stmt.entity_id is not None:
+            if self.track_all or stmt.prop_type in SORT_KEY_TYPES:
+                self.changed.add(stmt.canonical_id)
+
+    def pop(self, entity_id: str) -> list[Statement]:
+        self.changed.add(entity_id)
+        return super().pop(entity_id)
+
+    def flush(self) -> None:
+        store = self.store
+        if self.changed and (
+            store.sort_keys is not None or store.entity_table is not None
+        ):
+            self._upsert_batch()
+            if self.tx is None:
+                self.tx = self.conn.begin()
+            if store.sort_keys is not None:
+                store._update_sort_keys(self.conn, self.changed)
+            if store.entity_table is not None:
+                store._update_entities(self.conn, self.changed)
+        self.changed = set()
+        super().flush()
+
+
+class _StatementStore(nk.SQLStore):
+    """
+    `nomenklatura.store.SQLStore` with the statement table in a private
+    `MetaData` instead of the shared one of `nomenklatura.db.get_metadata`, so
+    that multiple stores can be used within one process
+    """
+
+    def __init__(
+        self,
+        dataset: DS,
+        linker: Linker,
+        uri: str = nk_settings.DB_URL,
+        **engine_kwargs: Any,
+    ) -> None:
+        nk.Store.__init__(self, dataset, linker)
+        if "pool_size" not in engine_kwargs:
+            engine_kwargs["pool_size"] = nk_settings.DB_POOL_SIZE
+        self.metadata = MetaData()
+        self.engine: Engine = create_engine(uri, **engine_kwargs)
+        self.table = make_statement_table(self.metadata)
+        self.metadata.create_all(self.engine, tables=[self.table], checkfirst=True)
+
+
+class SQLStore(Store, _StatementStore):
+    def __init__(self, *args, fetch_size: int | None = None, **kwargs) -> None:
+        """
+        Args:
+            fetch_size: Number of rows to fetch at once when streaming results
+                (default: env `SQL_FETCH_SIZE`)
+        """
+        self.fetch_size = fetch_size or SQL_FETCH_SIZE
+        self.sort_keys: Table | None = None
+        self.typed_table: Table | None = None
+        self.entity_table: Table | None = None
+        super().__init__(*args, **kwargs)
+        inspector = inspect(self.engine)
+        sort_keys = self.get_sort_key_table()
+        if inspector.has_table(sort_keys.name):
+            self.sort_keys = sort_keys
+        entity_table = self.get_entity_table()
+        if inspector.has_table(entity_table.name):
+            self.entity_table = entity_table
+        columns = {c["name"] for c in inspector.get_columns(self.table.name)}
+        if {c.name for c in make_typed_columns()} <= columns:
+            self.typed_table = self._make_typed_table()
+        if self.engine.dialect.name == "sqlite":
+            event.listen(self.engine, "connect", set_sqlite_pragmas)
+            # the connection(s) already opened during initialization
+            with self.engine.connect() as conn:
+                set_sqlite_pragmas(conn.connection.dbapi_connection)
+
+    def writer(self) -> SQLWriter:
+        return SQLWriter(self)
+
+    def get_statement_table(self) -> Table:
+        """
+        The statement table including the typed value columns (if enabled via
+        `optimize(typed_values=True)`), not registered in the shared metadata
+        """
+        if self.typed_table is not None:
+            return self.typed_table
+        return self.table.to_metadata(MetaData())
+
+    def _make_typed_table(self) -> Table:
+        table = self.table.to_metadata(MetaData())
+        for column in make_typed_columns():
+            table.append_column(column)
+        return table
+
+    def _update_typed_values(
+        self, conn: Connection, statements: Iterable[Statement]
+    ) -> None:
+        table = self.typed_table
+        rows = [
+            {"_id": stmt.id, **get_typed_values(stmt.prop_type, stmt.value)}
+            for stmt in statements
+            if stmt.prop_type in TYPED_VALUE_TYPES
+        ]
+        if rows:
+            q = (
+                update(table)
+                .where(table.c.id == bindparam("_id"))
+                .values(
+                    value_num=bindparam("value_num"),
+                    value_date=bindparam("value_date"),
+                )
+            )
+            conn.execute(q, rows)
+
+    def _add_typed_values(self, conn: Connection) -> None:
+        existing = {c["name"] for c in inspect(conn).get_columns(self.table.name)}
+        for column in make_typed_columns():
+            if column.name not in existing:
+                log.info("Adding column `%s` ..." % column.name)
+                type_ = column.type.compile(dialect=conn.dialect)
+                conn.execute(
+                    text(
+                        f"ALTER TABLE {self.table.name} "
+                        f"ADD COLUMN {column.name} {type_}"
+                    )
+                )
+        self.typed_table = self._make_typed_table()
+        # fill the columns for the existing statements in batches
+        log.info("Filling typed values `%s` ..." % self.table.name)
+        table, last_id = self.table, ""
+        while True:
+            q = (
+                select(table.c.id, table.c.prop_type, table.c.value)
+                .where(table.c.prop_type.in_(TYPED_VALUE_TYPES), table.c.id > last_id)
+                .order_by(table.c.id)
+                .limit(SQL_COPY_BATCH_SIZE)
+            )
+            rows = conn.execute(q).fetchall()
+            if not rows:
+                break
+            self._update_typed_values(conn, rows)
+            last_id = rows[-1].id
+
+    def _drop_typed_values(self, conn: Connection) -> None:
+        existing = {c["name"] for c in inspect(conn).get_columns(self.table.name)}
+        for column in make_typed_columns():
+            if column.name in existing:
+                log.info("Dropping column `%s` ..." % column.name)
+                conn.execute(
+                    text(f"ALTER TABLE {self.table.name} DROP COLUMN {column.name}")
+                )
+        self.typed_table = None
+
+    def get_sort_key_table(self) -> Table:
+        """
+        The (optional) table of the sort keys of the date and number properties
+        per entity. It is created via `optimize(sort_keys=True)` and then kept
+        up to date on write, sorted queries by these properties use its
+        indexes instead of aggregating the statements.
+        """
+        return make_sort_key_table(MetaData(), f"{self.table.name}_sort_keys")
+
+    def _update_sort_keys(self, conn: Connection, ids: Iterable[str]) -> None:
+        table = self.table
+        ids = list(ids)
+        for ix in range(0, len(ids), SQL_UPDATE_BATCH_SIZE):
+            chunk = ids[ix : ix + SQL_UPDATE_BATCH_SIZE]
+            q = select(
+                table.c.canonical_id, table.c.prop, table.c.prop_type, table.c.value
+            ).where(
+                table.c.canonical_id.in_(chunk), table.c.prop_type.in_(SORT_KEY_TYPES)
+            )
+            keys = get_sort_keys(conn.execute(q))
+            conn.execute(
+                self.sort_keys.delete().where(self.sort_keys.c.canonical_id.in_(chunk))
+            )
+            if keys:
+                conn.execute(insert(self.sort_keys), keys)
+
+    def _refresh_sort_keys(self, conn: Connection) -> None:
+        log.info("Refreshing sort keys `%s` ..." % self.sort_keys.name)
+        conn.execute(self.sort_keys.delete())
+        q = (
+            select(self.table.c.canonical_id)
+            .where(self.table.c.prop_type.in_(SORT_KEY_TYPES))
+            .distinct()
+        )
+        ids = [row[0] for row in conn.execute(q)]
+        self._update_sort_keys(conn, ids)
+
+    def get_entity_table(self) -> Table:
+        """
+        The (optional) table of the pre-assembled entities, one row per
+        canonical id. It is created via `optimize(entities=True)` and then kept
+        up to date on write, queries then read one row per entity instead of
+        all its statements.
+
+        Note:
+            Changes of the linker (e.g. new merges) after writing are only
+            reflected after re-writing the entities or `optimize(entities=True)`
+        """
+        return make_entity_table(MetaData(), f"{self.table.name}_entities")
+
+    def _update_entities(self, conn: Connection, ids: Iterable[str]) -> None:
+        table = self.table
+        ids = list(ids)
+        for ix in range(0, len(ids), SQL_UPDATE_BATCH_SIZE):
+            chunk = ids[ix : ix + SQL_UPDATE_BATCH_SIZE]
+            q = (
+                select(table)
+                .where(table.c.canonical_id.in_(chunk))
+                .order_by(table.c.canonical_id)
+            )
+            rows = []
+            result = conn.execute(q)
+            for _, group in groupby(result, key=lambda r: r.canonical_id):
+                statements = [Statement.from_db_row(row) for row in group]
+                entity = self.assemble(statements)
+                if entity is not None:
+                    rows.append(
+                        {
+                            "canonical_id": entity.id,
+                            "schema": entity.schema.name,
+                            "data": dump_entity(entity, statements),
+                        }
+                    )
+            entities = self.entity_table
+            conn.execute(entities.delete().where(entities.c.canonical_id.in_(chunk)))
+            if rows:
+                conn.execute(insert(entities), rows)
+
+    def _refresh_entities(self, conn: Connection) -> None:
+        log.info("Refreshing entities `%s` ..." % self.entity_table.name)
+        conn.execute(self.entity_table.delete())
+        q = select(self.table.c.canonical_id).distinct()
+        ids = [row[0] for row in conn.execute(q)]
+        self._update_entities(conn, ids)
+
+    def _iterate_entities(
+        self, q: Select, scope: StatementTest | None = None
+    ) -> CEGenerator:
+        for row in self._execute(q):
+            entity = load_entity(self.dataset, row[0], scope)
+            if entity is not None:
+                yield entity
+
+    def is_empty(self) -> bool:
+        q = select(self.table.c.id).limit(1)
+        for _ in self._execute(q, stream=False):
+            return False
+        return True
+
+    def load(
+        self,
+        proxies: Iterable[CE],
+        defer_indexes: bool | None = False,
+        analyze: bool | None = True,
+    ) -> int:
+        """
+        Bulk load entities, existing statements are updated the same way as the
+        default writer does.
+
+        - postgresql: The statements are streamed via `COPY ... FROM STDIN`
+          into a temporary staging table and then merged into the statement
+          table.
+        - sqlite: The statements are inserted within one transaction with
+          `synchronous = OFF` and a larger page cache. The database is switched
+          to the `WAL` journal mode (persistent), so that readers are not
+          blocked by later writes.
+        - Other backends use the default writer.
+
+        Args:
+            proxies: The entities to load
+            defer_indexes: Drop the secondary indexes of the statement table
+                before loading and re-create them afterwards
+            analyze: Update the planner statistics after loading
+
+        Returns:
+            Number of loaded entities
+        """
+        dialect = self.engine.dialect.name
+        if dialect not in ("postgresql", "sqlite"):
+            ix = 0
+            with self.writer() as bulk:
+                for ix, proxy in enumerate(proxies, 1):
+                    bulk.add_entity(proxy)
+            return ix
+
+        indexes = self._drop_indexes() if defer_indexes else []
+        if dialect == "postgresql":
+            ix = self._load_postgresql(proxies)
+        else:
+            ix = self._load_sqlite(proxies)
+        with self.engine.connect() as conn:
+            for index in indexes:
+                log.info("Creating index `%s` ..." % index.name)
+                index.create(conn)
+            if self.sort_keys is not None:
+                self._refresh_sort_keys(conn)
+            if self.entity_table is not None:
+                self._refresh_entities(conn)
+            conn.commit()
+            if analyze:
+                self._analyze(conn)
+        return ix
+
+    def _get_rows(self, proxy: CE) -> Generator[dict[str, Any], None, None]:
+        for stmt in proxy.statements:
+            if stmt.entity_id is None:
+                continue
+            stmt.canonical_id = self.linker.get_canonical(stmt.entity_id)
+            row = stmt.to_db_row()
+            if self.typed_table is not None:
+                row.update(get_typed_values(stmt.prop_type, stmt.value))
+            yield row
+
+    def _drop_indexes(self) -> list[Index]:
+        # the default and query indexes, not the primary key needed for upserts
+        inspector = inspect(self.engine)
+        existing = {i["name"] for i in inspector.get_indexes(self.table.name)}
+        indexes = [*self.table.indexes, *self.get_indexes()]
+        indexes = sorted(
+            [i for i in indexes if i.name in existing], key=lambda i: i.name
+        )
+        with self.engine.connect() as conn:
+            for index in indexes:
+                log.info("Dropping index `%s` ..." % index.name)
+                index.drop(conn)
+            conn.commit()
+        return indexes
+
+    def _load_postgresql(self, proxies: Iterable[CE]) -> int:
+        table = self.table.name
+        staging = f"ftmq_load_{uuid4().hex}"
+        columns = [c.name for c in self.get_statement_table().columns]
+        names = ", ".join(columns)
+        copy = f"COPY {staging} ({names}) FROM STDIN"
+        ix = 0
+        conn = self.engine.raw_connection()
+        try:
+            cursor = conn.cursor()
+            cursor.execute(
+                f"CREATE TEMPORARY TABLE {staging} (LIKE {table} INCLUDING DEFAULTS)"
+            )
+            buffer = io.StringIO()
+            rows = 0
+            for ix, proxy in enumerate(proxies, 1):
+                for row in self._get_rows(proxy):
+                    values = (to_copy_value(row.get(c)) for c in columns)
+                    buffer.write("\t".join(values) + "\n")
+                    rows += 1
+                if rows >= SQL_COPY_BATCH_SIZE:
+                    self._copy(cursor, copy, buffer)
+                    buffer, rows = io.StringIO(), 0
+                if ix % 10_000 == 0:
+                    log.info("Loading proxy %d ..." % ix)
+            if rows:
+                self._copy(cursor, copy, buffer)
+            updates = ", ".join(f"{c} = EXCLUDED.{c}" for c in UPSERT_COLUMNS)
+            cursor.execute(
+                f"INSERT INTO {table} ({names}) "
+                f"SELECT DISTINCT ON (id) {names} FROM {staging} ORDER BY id "
+                f"ON CONFLICT (id) DO UPDATE SET {updates}"
+            )
+            cursor.execute(f"DROP TABLE {staging}")
+            conn.commit()
+        finally:
+            conn.close()
+        return ix
+
+    def _load_sqlite(self, proxies: Iterable[CE]) -> int:
+        insert = sqlite_insert(self.get_statement_table())
+        upsert = insert.on_conflict_do_update(
+            index_elements=["id"],
+            set_={c: insert.excluded[c] for c in UPSERT_COLUMNS},
+        )
+        ix = 0
+        with self.engine.connect() as conn:
+            synchronous = conn.exec_driver_sql("PRAGMA synchronous").scalar()
+            conn.exec_driver_sql("PRAGMA journal_mode = WAL")
+            conn.exec_driver_sql("PRAGMA synchronous = OFF")
+            conn.exec_driver_sql(f"PRAGMA cache_size = -{SQLITE_LOAD_CACHE_SIZE}")
+            try:
+                rows: list[dict[str, Any]] = []
+                for ix, proxy in enumerate(proxies, 1):
+                    rows.extend(self._get_rows(proxy))
+                    if len(rows) >= SQL_COPY_BATCH_SIZE:
+                        conn.execute(upsert, rows)
+                        rows = []
+                    if ix % 10_000 == 0:
+                        log.info("Loading proxy %d ..." % ix)
+                if rows:
+                    conn.execute(upsert, rows)
+                conn.commit()
+            finally:
+                conn.exec_driver_sql(f"PRAGMA synchronous = {synchronous}")
+                set_sqlite_pragmas(conn.connection.dbapi_connection)
+        return ix
+
+    def _copy(self, cursor: Any, copy: str, buffer: io.StringIO) -> None:
+        buffer.seek(0)
+        if hasattr(cursor, "copy_expert"):  # psycopg2
+            cursor.copy_expert(copy, buffer)
+        else:  # psycopg 3
+            with cursor.copy(copy) as c:
+                while data := buffer.read(1 << 20):
+                    c.write(data)
+
+    def get_indexes(self) -> list[Index]:
+        """
+        Indexes matching the query shapes generated by [`Sql`][ftmq.sql.Sql]
+        (in addition to the default indexes of the statement table):
+
+        - property filters, sorting and aggregations: `prop`, `value`
+        - property type lookups (e.g. countries): `prop_type`, `value`
+        - `canonical_id IN (...)` lookups of a property: `canonical_id`, `prop`
+        - dataset and schema scopes: `dataset`, `schema`
+        - stats (partial index for dates and countries): `prop_type`, `value`
+
+        Each of them has `canonical_id` as its last column, so that the
+        matching ids can be read from the index only.
+        """
+        # don't register the indexes in the (shared) metadata of the table
+        table = self.get_statement_table()
+        c = table.c
+        shapes = {
+            "prop_value": (c.prop, c.value, c.canonical_id),
+            "prop_type_value": (c.prop_type, c.value, c.canonical_id),
+            "canonical_id_prop": (c.canonical_id, c.prop, c.value),
+            "dataset_schema": (c.dataset, c.schema, c.canonical_id),
+        }
+        if self.typed_table is not None:
+            shapes["prop_value_num"] = (c.prop, c.value_num, c.canonical_id)
+            shapes["prop_value_date"] = (c.prop, c.value_date, c.canonical_id)
+        indexes = [
+            Index(f"ix_{table.name}_ftmq_{name}", *columns)
+            for name, columns in shapes.items()
+        ]
+        partial = c.prop_type.in_(("date", "country"))
+        indexes.append(
+            Index(
+                f"ix_{table.name}_ftmq_dates_countries",
+                c.prop_type,
+                c.value,
+                c.canonical_id,
+                postgresql_where=partial,
+                sqlite_where=partial,
+            )
+        )
+        return indexes
+
+    def optimize(
+        self,
+        drop: bool | None = False,
+        analyze: bool | None = True,
+        sort_keys: bool | None = False,
+        typed_values: bool | None = False,
+        entities: bool | None = False,
+    ) -> list[str]:
+        """
+        Create the [query indexes][ftmq.store.sql.SQLStore.get_indexes] (if
+        they don't exist yet) and update the planner statistics (`ANALYZE`)
+
+        Args:
+            drop: Drop the query indexes (and the sort key table) instead
+            analyze: Run `ANALYZE` for the statement (and sort key) table
+            sort_keys: Create (and fill) the [sort key
+                table][ftmq.store.sql.SQLStore.get_sort_key_table] as well
+            typed_values: Add (and fill) the [typed value
+                columns][ftmq.sql.make_typed_columns] of the statement table
+                and their indexes as well
+            entities: Create (and fill) the [entity
+                table][ftmq.store.sql.SQLStore.get_entity_table] as well
+
+        Returns:
+            The names of the created (or dropped) indexes
+        """
+        with self.engine.connect() as conn:
+            if typed_values and not drop:
+                self._add_typed_values(conn)
+            indexes = self.get_indexes()
+            names = [index.name for index in indexes]
+            for index in indexes:
+                if drop:
+                    log.info("Dropping index `%s` ..." % index.name)
+                    index.drop(conn, checkfirst=True)
+                else:
+                    log.info("Creating index `%s` ..." % index.name)
+                    index.create(conn, checkfirst=True)
+            if typed_values and drop:
+                self._drop_typed_values(conn)
+            if sort_keys:
+                table = self.get_sort_key_table()
+                names.extend(index.name for index in table.indexes)
+                if drop:
+                    log.info("Dropping table `%s` ..." % table.name)
+                    table.drop(conn, checkfirst=True)
+                    self.sort_keys = None
+                else:
+                    log.info("Creating table `%s` ..." % table.name)
+                    table.create(conn, checkfirst=True)
+                    self.sort_keys = table
+                    self._refresh_sort_keys(conn)
+            if entities:
+                table = self.get_entity_table()
+                if drop:
+                    log.info("Dropping table `%s` ..." % table.name)
+                    table.drop(conn, checkfirst=True)
+                    self.entity_table = None
+                else:
+                    log.info("Creating table `%s` ..." % table.name)
+                    table.create(conn, checkfirst=True)
+                    self.entity_table = table
+                    self._refresh_entities(conn)
+            conn.commit()
+            if analyze:
+                self._analyze(conn)
+        return names
+
+    def _analyze(self, conn: Connection) -> None:
+        tables = [self.table]
+        if self.sort_keys is not None:
+            tables.append(self.sort_keys)
+        if self.entity_table is not None:
+            tables.append(self.entity_table)
+        for table in tables:
+            log.info("Analyzing table `%s` ..." % table.name)
+            conn.execute(text(f"ANALYZE {table.name}"))
+        conn.commit()
+
+    @contextmanager
+    def connection(self) -> Generator[Connection, None, None]:
+        """
+        Pin all reads of this store to one database connection within this
+        context (needed for temporary tables, see
+        [`SQLQueryView.materialize`][ftmq.store.sql.SQLQueryView.materialize]).
+        The connection is only used by the current thread (or asyncio task),
+        other threads keep using their own connections from the pool.
+        """
+        conn = SQL_CONNECTIONS.get().get(id(self))
+        if conn is not None:
+            yield conn
+            return
+        with self.engine.connect() as conn:
+            token = SQL_CONNECTIONS.set({**SQL_CONNECTIONS.get(), id(self): conn})
+            try:
+                yield conn
+            finally:
+                SQL_CONNECTIONS.reset(token)
+
+    def _execute(self, q: Select, stream: bool = True) -> Generator[Any, None, None]:
+        # execute any read query against sql backend, reuse a pinned connection
+        conn = SQL_CONNECTIONS.get().get(id(self))
+        if conn is not None:
+            yield from self._fetch(conn, q, stream)
+            return
+        with self.engine.connect() as conn:
+            yield from self._fetch(conn, q, stream)
+
+    def _fetch(
+        self, conn: Connection, q: Select, stream: bool = True
+    ) -> Generator[Any, None, None]:
+        if not stream:
+            yield from conn.execute(q).fetchall()
+            return
+        # server side cursor (e.g. postgresql named cursor) that buffers at most
+        # `fetch_size` rows at once
+        options = {"yield_per": self.fetch_size}
+        for rows in conn.execute(q, execution_options=options).partitions():
+            yield from rows
+
     def get_catalog(self) -> Catalog:
         q = select(self.table.c.dataset).distinct()
         names: set[str] = set()
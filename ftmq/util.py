@@ -1,7 +1,11 @@
+import base64
+import math
 import re
+from datetime import date, timedelta
 from functools import cache, lru_cache
 from typing import Any, Generator
 
+import orjson
 import pycountry
 from banal import ensure_list, is_listish
 from followthemoney.proxy import E, EntityProxy
@@ -199,10 +203,12 @@ NUMERIC_US = re.compile(r"^-?\d+(?:,\d{3})*(?:\.\d+)?$")
 NUMERIC_DE = re.compile(r"^-?\d+(?:\.\d{3})*(?:,\d+)?$")
 
 
+@lru_cache(100_000)
 def to_numeric(value: str) -> float | int | None:
     """
     Convert a string value into a primitive numeric dtype (`int` or `float`)
-    taking US and DE formatting into account via regex
+    taking US and DE formatting into account via regex. Results are cached for
+    repeated values (e.g. amounts in large payment datasets).
 
     Examples:
         >>> to_numeric("1")
@@ -217,24 +223,30 @@ def to_numeric(value: str) -> float | int | None:
         1000.1
         >>> to_numeric("foo")
         None
+        >>> to_numeric("inf")
+        None
 
     Args:
         value: The input
 
     Returns:
-        The converted number or `None` if conversion fails
+        The converted number or `None` if conversion fails or the number is not
+            finite (`nan`, `inf`, overflowing exponents)
     """
     value = str(value).strip()
     try:
-        value = float(value)
-        if int(value) == value:
-            return int(value)
-        return value
+        number = float(value)
     except ValueError:
         if re.match(NUMERIC_US, value):
             return to_numeric(value.replace(",", ""))
         if re.match(NUMERIC_DE, value):
             return to_numeric(value.replace(".", "").replace(",", "."))
+        return None
+    if not math.isfinite(number):
+        return None
+    if number.is_integer():
+        return int(number)
+    return number
 
 
 def join_slug(
@@ -319,6 +331,77 @@ def get_year_from_iso(value: Any) -> int | None:
         return
 
 
+ISO_DATE = re.compile(r"^(\d{4})(?:-(\d{2})(?:-(\d{2}))?)?")
+
+
+@lru_cache(100_000)
+def to_date(value: Any) -> date | None:
+    """
+    Convert a (partial) iso date string into the first day of its period, so
+    that the comparison of the dates is the same as of the iso strings.
+
+    Examples:
+        >>> to_date("2023")
+        datetime.date(2023, 1, 1)
+        >>> to_date("2023-05")
+        datetime.date(2023, 5, 1)
+        >>> to_date("2023-05-17T10:00:00")
+        datetime.date(2023, 5, 17)
+        >>> to_date("foo")
+        None
+
+    Args:
+        value: The input
+
+    Returns:
+        The date or `None` if conversion fails
+    """
+    m = ISO_DATE.match(str(value).strip())
+    if m is None:
+        return
+    year, month, day = m.groups()
+    try:
+        return date(int(year), int(month or 1), int(day or 1))
+    except ValueError:
+        return
+
+
+def get_date_after(value: Any) -> date | None:
+    """
+    Get the first day after the period of a (partial) iso date string, e.g.
+    for prefix comparisons: `"2023-05-17" > "2023"` is false for iso dates
+    (same year), but `to_date("2023-05-17") >= get_date_after("2023")` is true.
+
+    Examples:
+        >>> get_date_after("2023")
+        datetime.date(2024, 1, 1)
+        >>> get_date_after("2023-12")
+        datetime.date(2024, 1, 1)
+        >>> get_date_after("2023-05-17")
+        datetime.date(2023, 5, 18)
+
+    Args:
+        value: The input
+
+    Returns:
+        The date or `None` if conversion fails
+    """
+    start = to_date(value)
+    if start is None:
+        return
+    m = ISO_DATE.match(str(value).strip())
+    try:
+        if m.group(3):
+            return start + timedelta(days=1)
+        if m.group(2):
+            if start.month == 12:
+                return date(start.year + 1, 1, 1)
+            return date(start.year, start.month + 1, 1)
+        return date(start.year + 1, 1, 1)
+    except (ValueError, OverflowError):
+        return
+
+
 @lru_cache(1024)
 def clean_string(value: Any) -> str | None:
     """
@@ -506,3 +589,30 @@ def must_str(value: Any) -> str:
     if not value:
         raise ValueError(f"Value invalid: `{value}`")
     return value
+
+
+def encode_cursor(data: dict[str, Any]) -> str:
+    """
+    Encode a pagination position into an opaque (url safe) cursor string
+
+    Example:
+        >>> encode_cursor({"id": "a"})
+        "eyJpZCI6ImEifQ=="
+    """
+    return base64.urlsafe_b64encode(orjson.dumps(data)).decode()
+
+
+def decode_cursor(cursor: str) -> dict[str, Any]:
+    """
+    Decode a cursor string created by `encode_cursor`
+
+    Raises:
+        ValidationError: If the cursor is invalid
+    """
+    try:
+        data = orjson.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except ValueError:
+        raise ValidationError(f"Invalid cursor: `{cursor}`")
+    if not isinstance(data, dict) or "id" not in data:
+        raise ValidationError(f"Invalid cursor: `{cursor}`")
+    return data
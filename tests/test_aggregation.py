@@ -1,4 +1,9 @@
+import orjson
+import pytest
+from followthemoney.types import registry
+
 from ftmq.aggregations import Aggregation, Aggregator
+from ftmq.exceptions import ValidationError
 
 
 def test_agg(donations):
@@ -107,3 +112,133 @@ def test_agg_groupby_meta(donations):
         },
         "count": {"id": 474},
     }
+
+
+def test_agg_streaming(donations):
+    # group accumulators yield the same values as aggregating per group
+    for func in ("sum", "min", "max", "avg", "count"):
+        with Aggregation(prop="amountEur", func=func, group_props=["year"]) as agg:
+            for proxy in donations:
+                agg.collect(proxy)
+        years = {}
+        for proxy in donations:
+            for year in [d[:4] for d in proxy.get_type_values(registry.date)]:
+                years.setdefault(year, []).append(proxy)
+        for year, proxies in years.items():
+            with Aggregation(prop="amountEur", func=func) as expected:
+                for proxy in proxies:
+                    expected.collect(proxy)
+            assert agg.groups["year"][year] == pytest.approx(expected.value)
+        # only `count` keeps (distinct) values
+        if func != "count":
+            assert not agg.state.distinct
+
+    # no values
+    for func in ("min", "max", "avg"):
+        with Aggregation(prop="amountEur", func=func) as agg:
+            pass
+        assert agg.value is None
+    with Aggregation(prop="amountEur", func="sum") as agg:
+        pass
+    assert agg.value == 0
+
+
+def test_agg_fused(donations):
+    data = {
+        "sum": ["amountEur"],
+        "avg": ["amountEur"],
+        "min": ["amountEur", "date"],
+        "max": ["amountEur", "date"],
+        "count": ["id", "name"],
+        "groups": ["year", "schema"],
+    }
+    agg = Aggregator.from_dict(dict(data))
+    _ = [x for x in agg.apply(donations)]
+    # same result as collecting each aggregation on its own
+    for aggregation in Aggregator.from_dict(dict(data)).aggregations:
+        with aggregation:
+            for proxy in donations:
+                aggregation.collect(proxy)
+        func, prop = str(aggregation.func), str(aggregation.prop)
+        assert agg.result[func][prop] == aggregation.value
+        for group in ("year", "schema"):
+            assert (
+                agg.result["groups"][group][func].get(prop, {})
+                == aggregation.groups[group]
+            )
+    schemata = {"Payment", "Address", "Organization", "Company", "Person"}
+    assert set(agg._plans) == schemata
+
+
+def test_agg_merge(donations):
+    data = {
+        "sum": ["amountEur"],
+        "avg": ["amountEur"],
+        "min": ["amountEur", "date"],
+        "max": ["amountEur", "date"],
+        "count": ["id", "name"],
+        "groups": ["year", "country"],
+    }
+    agg = Aggregator.from_dict(dict(data))
+    _ = [x for x in agg.apply(donations)]
+    expected = agg.result
+
+    for shards in (2, 3, 7):
+        states = []
+        for ix in range(shards):
+            worker = Aggregator.from_dict(dict(data))
+            _ = [x for x in worker.apply(donations[ix::shards])]
+            # states are json serializable
+            states.append(orjson.loads(orjson.dumps(worker.get_state())))
+        coordinator = Aggregator.from_state(states[0])
+        for state in reversed(states[1:]):
+            coordinator.merge(state)
+        assert coordinator.result == expected
+
+    # merge aggregator instances
+    a = Aggregator.from_dict({"avg": ["amountEur"]})
+    _ = [x for x in a.apply(donations[:100])]
+    b = Aggregator.from_dict({"avg": ["amountEur"], "count": ["name"]})
+    _ = [x for x in b.apply(donations[100:])]
+    assert a.merge(b).result["avg"] == expected["avg"]
+    assert len(a.aggregations) == 2
+
+    with pytest.raises(ValidationError):
+        Aggregation(prop="amountEur", func="sum").merge(
+            Aggregation(prop="amountEur", func="avg")
+        )
+
+
+def test_agg_sketches(donations):
+    data = {
+        "approx_count": ["id", "name"],
+        "quantile": ["amountEur"],
+        "top": ["country"],
+        "groups": ["schema"],
+    }
+    agg = Aggregator.from_dict(dict(data))
+    _ = [x for x in agg.apply(donations)]
+    assert abs(agg.result["approx_count"]["id"] - 474) < 474 * 0.05
+    assert abs(agg.result["approx_count"]["name"] - 95) < 95 * 0.05
+    quantiles = agg.result["quantile"]["amountEur"]
+    assert list(quantiles) == ["0.25", "0.5", "0.75", "0.9", "0.99"]
+    assert quantiles["0.5"] == 100000
+    top = [("de", 163), ("gb", 3), ("cy", 2), ("lu", 2)]
+    assert [tuple(x) for x in agg.result["top"]["country"]] == top
+    groups = agg.result["groups"]["schema"]
+    assert groups["quantile"]["amountEur"] == {"Payment": quantiles}
+    assert groups["approx_count"]["id"]["Person"] == 22
+
+    # mergeable
+    states = []
+    for ix in range(3):
+        worker = Aggregator.from_dict(dict(data))
+        _ = [x for x in worker.apply(donations[ix::3])]
+        states.append(orjson.loads(orjson.dumps(worker.get_state())))
+    coordinator = Aggregator.from_state(states[0])
+    for state in states[1:]:
+        coordinator.merge(state)
+    result = coordinator.result
+    assert abs(result["approx_count"]["id"] - 474) < 474 * 0.05
+    assert result["quantile"]["amountEur"]["0.5"] == 100000
+    assert [tuple(x) for x in result["top"]["country"]] == top
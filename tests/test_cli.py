@@ -164,6 +164,73 @@ def test_cli_coverage(fixtures_path: Path):
     }
 
 
+def test_cli_sort(fixtures_path: Path):
+    in_uri = str(fixtures_path / "donations.ijson")
+    args = ["-i", in_uri, "-s", "Payment", "--sort", "amountEur", "--sort-descending"]
+    result = runner.invoke(cli, args)
+    assert result.exit_code == 0
+    lines = _get_lines(result.output)
+    assert len(lines) == 290
+    result = runner.invoke(cli, args + ["--sort-buffer-size", "50"])
+    assert result.exit_code == 0
+    assert [orjson.loads(li)["id"] for li in _get_lines(result.output)] == [
+        orjson.loads(li)["id"] for li in lines
+    ]
+    proxy = make_proxy(orjson.loads(lines[0]))
+    assert proxy.get("amountEur") == ["2334526"]
+
+
+def test_cli_explain(fixtures_path: Path, tmp_path: Path):
+    in_uri = str(fixtures_path / "donations.ijson")
+    explain_uri = tmp_path / "explain.json"
+    args = ["-i", in_uri, "-s", "Payment", "--sort", "amountEur"]
+    args += ["--explain-uri", str(explain_uri)]
+    result = runner.invoke(cli, args)
+    assert result.exit_code == 0
+    assert len(_get_lines(result.output)) == 290
+    explain = orjson.loads(explain_uri.read_text())
+    assert explain["plan"]["sort"]["strategy"] == "memory"
+    assert list(explain["timings"]) == ["read", "parse", "filter", "sort"]
+    assert explain["timings"]["parse"]["items"] == 474
+    assert explain["timings"]["sort"]["items"] == 290
+
+
+def test_cli_explain_store(fixtures_path: Path, tmp_path: Path):
+    in_uri = str(fixtures_path / "donations.ijson")
+    store_uri = f"sqlite:///{tmp_path}/explain.db"
+    result = runner.invoke(cli, ["-i", in_uri, "-o", store_uri])
+    assert result.exit_code == 0
+    explain_uri = tmp_path / "explain.json"
+    args = ["-i", store_uri, "-s", "Payment", "--sort", "amountEur"]
+    args += ["--explain-uri", str(explain_uri), "--store-dataset", "donations"]
+    result = runner.invoke(cli, args)
+    assert result.exit_code == 0
+    assert len(_get_lines(result.output)) == 290
+    explain = orjson.loads(explain_uri.read_text())
+    assert explain["dialect"] == "sqlite"
+    assert "ORDER BY" in explain["sql"]["statements"]
+    assert explain["plan"]["statements"]
+    assert list(explain["timings"]) == ["store"]
+
+
+def test_cli_partition(fixtures_path: Path, tmp_path: Path):
+    in_uri = str(fixtures_path / "donations.ijson")
+    out_uri = str(tmp_path / "{schema}.json")
+    result = runner.invoke(
+        cli, ["partition", "-i", in_uri, "-o", out_uri, "--by", "schema"]
+    )
+    assert result.exit_code == 0
+    assert len((tmp_path / "Payment.json").read_text().splitlines()) == 290
+    assert len((tmp_path / "Person.json").read_text().splitlines()) == 22
+
+    out_uri = str(tmp_path / "{dataset}.json")
+    result = runner.invoke(
+        cli, ["partition", "-i", in_uri, "-o", out_uri, "-s", "Person"]
+    )
+    assert result.exit_code == 0
+    assert len((tmp_path / "donations.json").read_text().splitlines()) == 22
+
+
 def test_cli_aggregation(fixtures_path: Path):
     in_uri = str(fixtures_path / "donations.ijson")
     result = runner.invoke(
@@ -217,6 +284,18 @@ def test_cli_aggregation(fixtures_path: Path):
     }
 
 
+def test_cli_aggregation_sketches(fixtures_path: Path):
+    in_uri = str(fixtures_path / "donations.ijson")
+    args = ["-i", in_uri, "-o", "/dev/null", "--aggregation-uri", "-"]
+    args += ["--approx-count", "id", "--quantile", "amountEur", "--top", "country"]
+    result = runner.invoke(cli, args)
+    assert result.exit_code == 0
+    result = orjson.loads(result.output)
+    assert abs(result["approx_count"]["id"] - 474) < 474 * 0.05
+    assert result["quantile"]["amountEur"]["0.5"] == 100000
+    assert result["top"]["country"][0] == ["de", 163]
+
+
 def test_cli_generate(fixtures_path: Path):
     # dataset
     uri = str(fixtures_path / "dataset.yml")
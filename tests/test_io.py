@@ -7,10 +7,13 @@ from nomenklatura.stream import StreamEntity
 from ftmq.io import (
     apply_datasets,
     make_proxy,
+    smart_partition_proxies,
     smart_read_proxies,
+    smart_route_proxies,
     smart_stream_proxies,
     smart_write_proxies,
 )
+from ftmq.query import Query
 from ftmq.store import get_store
 
 
@@ -125,3 +128,38 @@ def test_io_store(tmp_path, eu_authorities, fixtures_path):
     assert res == 151
     res = [p for p in smart_read_proxies(uri, dataset="eu_authorities")]
     assert len(res) == 151
+
+
+def test_io_route(tmp_path: Path, fixtures_path: Path):
+    uri = fixtures_path / "donations.ijson"
+    persons = str(tmp_path / "persons.json")
+    payments = str(tmp_path / "payments.json")
+    store = f"sqlite:///{tmp_path}/routed.db"
+    res = smart_route_proxies(
+        uri,
+        {
+            persons: Query().where(schema="Person"),
+            payments: Query().where(schema="Payment", date__gte=2010),
+            store: Query().where(schema="Payment"),
+        },
+    )
+    assert res == {persons: 22, payments: 49, store: 290}
+    assert len([p for p in smart_read_proxies(persons)]) == 22
+    assert len([p for p in smart_read_proxies(payments)]) == 49
+    assert len([p for p in smart_read_proxies(store, dataset="donations")]) == 290
+
+
+def test_io_partition(tmp_path: Path, proxies: list[CE]):
+    uri = str(tmp_path / "{dataset}.json")
+    res = smart_partition_proxies(uri, proxies, "dataset")
+    assert res == {
+        str(tmp_path / "eu_authorities.json"): 151,
+        str(tmp_path / "donations.json"): 474,
+    }
+    uri = str(tmp_path / "{schema}.json")
+    res = smart_partition_proxies(uri, proxies, "schema")
+    assert res[str(tmp_path / "Payment.json")] == 290
+    assert res[str(tmp_path / "PublicBody.json")] == 151
+    proxies = [p for p in smart_read_proxies(tmp_path / "Person.json")]
+    assert len(proxies) == 22
+    assert all(p.schema.name == "Person" for p in proxies)
@@ -97,11 +97,17 @@ def test_proxy_filter_property(proxies):
     result = list(filter(q.apply, proxies))
     assert len(result) == 49
 
+    # dates are compared by iso prefix
     q = Query().where(prop="date", value="2010", comparator="gt")
     result = list(filter(q.apply, proxies))
-    assert len(result) == 49
+    assert len(result) == 21
+
+    q = Query().where(prop="date", value="2010", comparator="lte")
+    result = list(filter(q.apply, proxies))
+    assert len(result) == 290 - 21
 
     # chained same props as AND
+    q = Query().where(prop="date", value="2010", comparator="gte")
     q = q.where(prop="date", value="2011", comparator="lt")
     result = list(filter(q.apply, proxies))
     assert len(result) == 28
@@ -110,6 +116,17 @@ def test_proxy_filter_property(proxies):
     result = list(filter(q.apply, proxies))
     assert len(result) == 21
 
+    # numeric values are compared as numbers
+    q = Query().where(prop="amountEur", value=100000, comparator="gt")
+    result = list(filter(q.apply, proxies))
+    assert len(result) == 110
+    assert [p.id for p in q.apply_iter(proxies)] == [p.id for p in result]
+    q = Query().where(amountEur__lte="100,000")
+    result = list(filter(q.apply, proxies))
+    assert len(result) == 290 - 110
+    with pytest.raises(ValidationError):
+        Query().where(amountEur__gt="foo")
+
     q = Query().where(prop="date", value=True, comparator="null")
     result = list(filter(q.apply, proxies))
     assert len(result) == 290
@@ -1,7 +1,9 @@
 import pytest
 
 from ftmq.exceptions import ValidationError
+from ftmq.profile import Profiler
 from ftmq.query import Query
+from ftmq.util import make_proxy
 
 
 def test_query():
@@ -200,3 +202,221 @@ def test_query_shorthands():
     assert q.schemata_names == {"Company", "Person"}
     assert q.dataset_names == {"foo", "bar"}
     assert q.countries == {"de", "fr"}
+
+
+def test_query_compile(proxies):
+    queries = [
+        Query(),
+        Query().where(dataset="donations"),
+        Query().where(dataset__startswith="eu_"),
+        Query().where(schema="Payment", date__gte=2010, amountEur__gt="5"),
+        Query().where(schema__in=["Person", "Organization"], country="de"),
+        Query().where(schema="LegalEntity", include_descendants=True),
+        Query().where(name__ilike="Ag"),
+        Query().where(name__like="Ag", country__not_in=["de", "fr"]),
+        Query().where(entity_id__startswith="eu-authorities-"),
+        Query().where(reverse="783d918df9f9178400d6b3386439ab3b3679979c"),
+    ]
+    for q in queries:
+        test = q.compile()
+        assert [p.id for p in proxies if test(p)] == [
+            p.id for p in proxies if q.apply(p)
+        ]
+        assert [p.id for p in q.apply_iter(proxies)] == [
+            p.id for p in proxies if q.apply(p)
+        ]
+
+    q = Query().where(name__not_in=["a", "b"])
+    assert q.to_dict() == {"name__not_in": {"a", "b"}}
+
+
+def test_query_apply_batches(proxies, monkeypatch):
+    queries = [
+        Query(),
+        Query().where(dataset="donations"),
+        Query().where(dataset__in=["donations", "foo"]),
+        Query().where(schema="Payment", date__gte=2010, amountEur__gt="5"),
+        Query().where(schema="Payment", date__gt=2010, amountEur__lte=100000),
+        Query().where(date__lt="2008-05", amountEur__gte=50000),
+        Query().where(schema__in=["Person", "Organization"], country="de"),
+        Query().where(schema="LegalEntity", include_descendants=True),
+        Query().where(name__ilike="Ag", country__not_in=["de", "fr"]),
+        Query().where(entity_id__startswith="eu-authorities-"),
+        Query().where(reverse="783d918df9f9178400d6b3386439ab3b3679979c"),
+    ]
+    for q in queries:
+        expected = [p.id for p in proxies if q.apply(p)]
+        for batch_size in (1, 100, 10_000):
+            assert [p.id for p in q.apply_batches(proxies, batch_size)] == expected
+        assert [p.id for p in q.apply_iter(proxies, batch_size=100)] == expected
+
+    # without numpy
+    monkeypatch.setattr("ftmq.batch.np", None)
+    for q in queries:
+        expected = [p.id for p in proxies if q.apply(p)]
+        assert [p.id for p in q.apply_batches(proxies, 100)] == expected
+
+
+def test_query_filter_numeric():
+    proxies = [
+        make_proxy(
+            {"id": f"p-{i}", "schema": "Payment", "properties": {"amount": [amount]}}
+        )
+        for i, amount in enumerate(("nan", "inf", "-inf", "1e400", "5", "1,000"))
+    ]
+    q = Query().where(amount__gt=1)
+    expected = ["p-4", "p-5"]
+    assert [p.id for p in proxies if q.apply(p)] == expected
+    test = q.compile()
+    assert [p.id for p in proxies if test(p)] == expected
+    assert [p.id for p in q.apply_batches(proxies, 2)] == expected
+
+
+def test_query_filter_order(donations):
+    q = Query().where(
+        reverse="783d918df9f9178400d6b3386439ab3b3679979c",
+        name__ilike="foo",
+        schema="Payment",
+        dataset="donations",
+    )
+    test = q.compile()
+    assert [f["filter"] for f in test.explain()] == [
+        {"schema": "Payment"},
+        {"dataset": "donations"},
+        {"name__ilike": "foo"},
+        {"reverse": "783d918df9f9178400d6b3386439ab3b3679979c"},
+    ]
+
+    q = Query().where(schema="Payment", dataset="donations", date__gte=2010)
+    test = q.compile(sample_size=0)
+    assert [f["filter"] for f in test.explain()] == [
+        {"schema": "Payment"},
+        {"dataset": "donations"},
+        {"date__gte": "2010"},
+    ]
+    expected = [p.id for p in donations if q.apply(p)]
+    assert [p.id for p in donations if test(p)] == expected
+    assert all(f["tested"] == 0 for f in test.explain())
+
+    test = q.compile(sample_size=100)
+    assert [p.id for p in donations if test(p)] == expected
+    plan = test.explain()
+    assert all(f["tested"] == 100 for f in plan)
+    # the dataset filter doesn't reject anything, so it is evaluated last
+    assert [f["filter"] for f in plan] == [
+        {"schema": "Payment"},
+        {"date__gte": "2010"},
+        {"dataset": "donations"},
+    ]
+
+
+def test_query_sort_topk(donations):
+    for ascending in (True, False):
+        for values in (("amountEur",), ("date",), ("country", "name")):
+            q = Query().order_by(*values, ascending=ascending)
+            full = [p.id for p in q.apply_iter(donations)]
+            for s in (slice(None, 10), slice(5, 25), slice(0, 1000)):
+                assert [p.id for p in q[s].apply_iter(donations)] == full[s]
+
+
+def test_query_sort_external(donations):
+    for ascending in (True, False):
+        q = Query().order_by("amountEur", "date", ascending=ascending)
+        expected = [p.id for p in q.apply_iter(donations)]
+        for buffer_size in (1, 50, 1000):
+            q = Query().order_by(
+                "amountEur", "date", ascending=ascending, buffer_size=buffer_size
+            )
+            assert [p.id for p in q.apply_iter(donations)] == expected
+
+
+def test_query_sort_external_big_numbers():
+    amounts = ("1e25", "5", "-1e30", "1e20", "7.5")
+    proxies = [
+        make_proxy(
+            {"id": f"p-{i}", "schema": "Payment", "properties": {"amount": [amount]}}
+        )
+        for i, amount in enumerate(amounts)
+    ]
+    expected = ["p-2", "p-1", "p-4", "p-3", "p-0"]
+    q = Query().order_by("amount")
+    assert [p.id for p in q.apply_iter(proxies)] == expected
+    q = Query().order_by("amount", buffer_size=2)
+    assert [p.id for p in q.apply_iter(proxies)] == expected
+
+
+def test_query_serialize():
+    q = Query().where(dataset="d1", date__gte=2023).where(date__gte=2024)
+    q = q.order_by("date", ascending=False)[:10]
+    assert q.serialize() == {
+        "filters": [
+            ["dataset", "eq", "d1"],
+            ["date", "gte", "2023"],
+            ["date", "gte", "2024"],
+        ],
+        "order_by": ["-date"],
+        "limit": 10,
+        "offset": None,
+    }
+    # stable across processes
+    assert q.cache_key == "46291b6ace7cb650d0565397d1db1a996670b63a"
+    assert hash(q) == int(q.cache_key[:16], 16)
+
+    queries = [
+        Query(),
+        q,
+        Query().where(dataset__in=["b", "a"], schema="Payment")[5:15],
+        Query().where(schema="LegalEntity", include_descendants=True),
+        Query().where(amountEur__gt=10, name__ilike="jane", reverse="id"),
+        Query().where(date__null=True, entity_id__startswith="x"),
+        Query()
+        .aggregate("sum", "amountEur", groups=["year", "country"])
+        .aggregate("count", "id"),
+    ]
+    for q in queries:
+        loaded = Query.from_dict(q.serialize())
+        assert loaded.serialize() == q.serialize()
+        assert loaded.cache_key == q.cache_key
+
+    # order independence
+    q1 = Query().where(dataset="a").where(schema="Person").where(name="x")
+    q2 = Query().where(name="x", schema="Person").where(dataset="a")
+    assert q1.cache_key == q2.cache_key
+    assert q1.cache_key != q1[:10].cache_key
+
+    # expanded schemata
+    q = Query().where(schema="LegalEntity", include_descendants=True)
+    loaded = Query.from_dict(q.serialize())
+    assert list(loaded.schemata)[0].schemata == list(q.schemata)[0].schemata
+
+    # load from `to_dict`
+    q = Query().where(dataset__in=["a", "b"], date__gte=2023).order_by("date")
+    assert Query.from_dict(q.to_dict()).cache_key == q.cache_key
+
+
+def test_query_explain(donations):
+    q = Query().where(schema="Payment", amountEur__gt=100000)
+    q = q.order_by("amountEur", ascending=False)[:10]
+    plan = q.explain()
+    assert [list(f["filter"]) for f in plan["filters"]] == [
+        ["schema"],
+        ["amountEur__gt"],
+    ]
+    assert plan["sort"] == {"values": ["-amountEur"], "strategy": "top-k", "k": 10}
+    assert plan["slice"] == {"offset": None, "limit": 10}
+    assert "aggregations" not in plan
+
+    plan = Query().order_by("date", buffer_size=100).explain()
+    assert plan["sort"]["strategy"] == "external"
+    assert Query().explain() == {}
+
+    profiler = Profiler()
+    proxies = profiler.wrap("read", donations)
+    res = [p for p in q.apply_iter(proxies, profiler)]
+    assert len(res) == 10
+    timings = profiler.timings
+    assert list(timings) == ["read", "filter", "sort"]
+    assert timings["read"]["items"] == 474
+    assert timings["filter"]["items"] == 110
+    assert timings["sort"]["items"] == 10
+    assert all(t["seconds"] >= 0 for t in timings.values())
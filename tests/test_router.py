@@ -0,0 +1,45 @@
+import pytest
+
+from ftmq.exceptions import ValidationError
+from ftmq.query import Query
+from ftmq.router import Router
+from ftmq.util import make_proxy
+
+
+def test_router(proxies):
+    queries = {
+        "payments": Query().where(schema="Payment"),
+        "payments_2010": Query().where(schema="Payment", date__gte=2010),
+        "eu": Query().where(dataset="eu_authorities"),
+        "de": Query().where(country="de")[5:10],
+        "all": Query(),
+    }
+    router = Router(queries)
+    # shared filters are evaluated once
+    assert len(router.tests) == 4
+
+    routed = {key: [] for key in queries}
+    for key, proxy in router.apply(proxies):
+        routed[key].append(proxy.id)
+    for key, q in queries.items():
+        assert routed[key] == [p.id for p in q.apply_iter(proxies)]
+    assert len(routed["de"]) == 5
+
+    q = Query().where(dataset="donations").aggregate("sum", "amountEur")
+    router = Router({"donations": q})
+    _ = [x for x in router.apply(proxies)]
+    assert q.aggregator.result == {"sum": {"amountEur": 40589689.15}}
+
+    # filters with the same value but different expanded schemata
+    queries = {
+        "exact": Query().where(schema="LegalEntity"),
+        "desc": Query().where(schema="LegalEntity", include_descendants=True),
+    }
+    for routes in (queries, dict(reversed(queries.items()))):
+        router = Router(routes)
+        assert len(router.tests) == 2
+        company = make_proxy({"id": "c", "schema": "Company"})
+        assert router.route(company) == ["desc"]
+
+    with pytest.raises(ValidationError):
+        Router({"sorted": Query().order_by("name")})
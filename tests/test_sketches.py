@@ -0,0 +1,90 @@
+import random
+import statistics
+
+import orjson
+
+from ftmq.sketches import HyperLogLog, SpaceSaving, TDigest
+
+
+def test_sketches_hll():
+    sketch = HyperLogLog()
+    for i in range(100_000):
+        sketch.add(i)
+    assert abs(sketch.count - 100_000) / 100_000 < 0.05
+    assert len(sketch.registers) == 2**12
+
+    # small cardinalities are (almost) exact
+    sketch = HyperLogLog()
+    for value in ["a", "b", "c", "a"] * 100:
+        sketch.add(value)
+    assert sketch.count == 3
+
+    # merge
+    a, b = HyperLogLog(), HyperLogLog()
+    for i in range(10_000):
+        a.add(i)
+        b.add(i + 5_000)
+    b = HyperLogLog.from_dict(orjson.loads(orjson.dumps(b.to_dict())))
+    assert abs(a.merge(b).count - 15_000) / 15_000 < 0.05
+
+
+def test_sketches_tdigest():
+    rand = random.Random(1)
+    values = [rand.lognormvariate(10, 1) for _ in range(50_000)]
+    sketch = TDigest()
+    for value in values:
+        sketch.add(value)
+    assert len(sketch.to_dict()["centroids"]) < 200
+    values.sort()
+    for q in (0.01, 0.25, 0.5, 0.75, 0.99):
+        estimate = sketch.quantile(q)
+        rank = sum(1 for v in values if v <= estimate) / len(values)
+        assert abs(rank - q) < 0.01
+    assert sketch.quantile(0) == values[0]
+    assert sketch.quantile(1) == values[-1]
+
+    # merge
+    shards = [TDigest() for _ in range(4)]
+    for ix, value in enumerate(values):
+        shards[ix % 4].add(value)
+    merged = TDigest.from_dict(orjson.loads(orjson.dumps(shards[0].to_dict())))
+    for shard in shards[1:]:
+        merged.merge(shard)
+    assert merged.count == len(values)
+    median = statistics.median(values)
+    assert abs(merged.quantile(0.5) - median) / median < 0.01
+
+    assert TDigest().quantile(0.5) is None
+
+
+def test_sketches_space_saving():
+    values = ["a"] * 100 + ["b"] * 50 + ["c"] * 20 + [str(i) for i in range(500)]
+    random.Random(1).shuffle(values)
+    sketch = SpaceSaving(capacity=50)
+    for value in values:
+        sketch.add(value)
+    top = sketch.top(3)
+    assert [v for v, _ in top] == ["a", "b", "c"]
+    for value, count in top:
+        assert count - sketch.errors[value] <= values.count(value) <= count
+
+    # exact if all values fit
+    sketch = SpaceSaving()
+    for value in "aaabbc":
+        sketch.add(value)
+    assert sketch.top() == [("a", 3), ("b", 2), ("c", 1)]
+    other = SpaceSaving.from_dict(orjson.loads(orjson.dumps(sketch.to_dict())))
+    assert sketch.merge(other).top(2) == [("a", 6), ("b", 4)]
+
+    # missing values get the floor of the other (full) summary as error
+    values = ["a"] * 30 + ["b"] * 20 + [str(i) for i in range(40)]
+    random.Random(2).shuffle(values)
+    shards = [SpaceSaving(capacity=10), SpaceSaving(capacity=10)]
+    for ix, value in enumerate(values):
+        shards[ix % 2].add(value)
+    left, right = shards
+    assert left.floor > 0 and right.floor > 0
+    merged = SpaceSaving.from_dict(left.to_dict()).merge(right)
+    assert [v for v, _ in merged.top(2)] == ["a", "b"]
+    for value, count in merged.top(None):
+        assert count - merged.errors[value] <= values.count(value) <= count
@@ -1,8 +1,10 @@
 import pytest
+from sqlalchemy import Column, MetaData, String, Table
 from sqlalchemy.sql.selectable import Select
 
 from ftmq.exceptions import ValidationError
 from ftmq.query import Query
+from ftmq.sql import Sql, make_entity_table, make_sort_key_table
 
 
 def _compare_str(s1, s2) -> bool:
@@ -202,12 +204,59 @@ def test_sql():
 
     # cast order by
     q = Query().order_by("amount")
-    assert "CAST(test_table.value AS NUMERIC)" in str(q.sql.statements)
+    assert "CAST(trim(test_table.value) AS NUMERIC)" in str(q.sql.statements)
+
+    # multi-value sort
+    q = Query().order_by("name", "date")
+    stmt = " ".join(str(q.sql.sort_values).split())
+    assert "min(CASE WHEN (test_table.prop = :prop_1) THEN test_table.value" in stmt
+    assert "test_table.prop IN (__[POSTCOMPILE_prop_3])" in stmt
+    assert stmt.endswith(
+        "HAVING min(CASE WHEN (test_table.prop = :prop_1) "
+        "THEN test_table.value END) IS NOT NULL"
+    )
+    stmt = " ".join(str(q.sql.statements).split())
+    assert stmt.endswith(
+        "ORDER BY anon_1.sortable_value, anon_1.sortable_value_1 ASC NULLS FIRST, "
+        "test_table.canonical_id"
+    )
 
-    # no multi-value sort
-    q = Query().order_by("name", "title")
-    with pytest.raises(ValidationError):
-        q.sql.statements
+    # materialized sort keys
+    sort_keys = make_sort_key_table(MetaData(), "test_table_sort_keys")
+    q = Query().order_by("date", "amountEur", ascending=False)
+    sql = Sql(q, sort_keys=sort_keys)
+    assert sql.use_sort_keys
+    stmt = " ".join(str(sql.sort_values).split())
+    assert stmt.startswith(
+        "SELECT sort_keys_0.canonical_id, sort_keys_0.value_max AS sortable_value, "
+        "sort_keys_1.number_max AS sortable_value_1 FROM test_table_sort_keys AS "
+        "sort_keys_0 LEFT OUTER JOIN test_table_sort_keys AS sort_keys_1"
+    )
+    assert "GROUP BY" not in stmt
+    assert "EXISTS (SELECT * FROM test_table WHERE test_table.canonical_id" in stmt
+    stmt = " ".join(str(sql.get_page(10, {"id": "a", "values": ["2020", 1]})).split())
+    assert "WHERE sort_keys_0.prop = :prop_2" in stmt
+    assert "HAVING" not in stmt
+    assert stmt.endswith(
+        "ORDER BY sortable_value DESC, sortable_value_1 DESC NULLS LAST, "
+        "sort_keys_0.canonical_id LIMIT :param_1"
+    )
+    assert not Sql(Query().order_by("name"), sort_keys=sort_keys).use_sort_keys
+
+    # typed value columns
+    q = Query().where(amountEur__gt=100, date__gt="2010").order_by("amountEur")
+    q = q.aggregate("sum", "amountEur").aggregate("max", "amountEur")
+    sql = Sql(q, typed=True)
+    stmt = " ".join(str(sql.statements).split())
+    assert "test_table.value_num > :value_num_1" in stmt
+    assert "test_table.value_date >= :value_date_1" in stmt
+    assert "min(test_table.value_num) AS sortable_value" in stmt
+    assert "CAST" not in stmt
+    stmt = str(sql.aggregations)
+    assert "sum(test_table.value_num)" in stmt
+    assert "max(test_table.value_num)" in stmt
+    assert "AS NUMERIC" not in stmt
+    assert "AS NUMERIC" in str(q.sql.aggregations)
 
     # slice
     q = (
@@ -251,16 +300,17 @@ def test_sql():
     q = q.aggregate("sum", "amount").aggregate("max", "date")
     q = str(q.sql.aggregations)
     assert len(q.split("UNION")) == 2
-    assert "SELECT 'date', 'max', max(test_table.value) AS max" in q
-    assert "SELECT 'amount', 'sum', sum(CAST(test_table.value AS NUMERIC)) AS sum" in q
+    # all results as text for the union (numbers are converted back later)
+    assert "SELECT 'date', 'max', CAST(max(test_table.value) AS VARCHAR)" in q
+    assert "SELECT 'amount', 'sum', CAST(sum(CASE WHEN" in q
 
     q = Query().aggregate("avg", "amount")
     q = str(q.sql.aggregations)
-    assert "SELECT 'amount', 'avg', avg(CAST(test_table.value AS NUMERIC)) AS avg" in q
+    assert "SELECT 'amount', 'avg', CAST(avg(CASE WHEN" in q
 
     q = Query().aggregate("count", "location")
     q = str(q.sql.aggregations)
-    assert "SELECT 'location', 'count', count(DISTINCT test_table.value) AS count" in q
+    assert "SELECT 'location', 'count', CAST(count(DISTINCT test_table.value)" in q
 
     q = Query().where(date=2023)
     q = q.sql.get_group_counts("country")
@@ -282,42 +332,45 @@ def test_sql():
         .aggregate("max", "amountEur", groups="country")
     )
     assert q.sql.group_props == {"country"}
-    res = q.sql.get_group_aggregations("country", "de").compile(
+    res = q.sql.get_group_aggregations("country").compile(
         compile_kwargs={"literal_binds": True}
     )
-    assert _compare_str(
-        res,
-        """
-        SELECT 'amountEur', 'max', max(test_table.value) AS max_1
-        FROM test_table
-        WHERE test_table.prop = 'amountEur' AND test_table.canonical_id IN (SELECT DISTINCT test_table.canonical_id
-        FROM test_table
-        WHERE test_table.canonical_id IN (SELECT DISTINCT test_table.canonical_id
-        FROM test_table
-        WHERE test_table.dataset = 'test' AND test_table.schema = 'Project') AND test_table.prop = 'country' AND test_table.value = 'de')
-        """,
+    res = " ".join(str(res).split())
+    # one statement, grouped in sql
+    assert res.startswith("WITH groups_country AS (SELECT DISTINCT")
+    assert "test_table.value AS grouper" in res
+    assert "test_table.prop = 'country'" in res
+    assert "JOIN test_table AS agg_values ON" in res
+    assert "max(agg_values.value)" in res
+    assert "WHERE agg_values.prop = 'amountEur' GROUP BY groups_country.grouper" in res
+    assert "LIMIT" not in res
+
+    res = q.sql.get_group_aggregations("country", limit=10).compile(
+        compile_kwargs={"literal_binds": True}
     )
+    assert "LIMIT 10" in str(res)
+
     q = (
         Query()
         .where(dataset="test", schema="Project")
         .aggregate("max", "amountEur", groups=["country", "year", "dataset"])
+        .aggregate("count", "id", groups="year")
     )
     assert q.sql.group_props == {"country", "year", "dataset"}
-    res = q.sql.get_group_aggregations("year", 2023).compile(
+    res = q.sql.get_group_aggregations("year", limit=10).compile(
         compile_kwargs={"literal_binds": True}
     )
-    assert _compare_str(
-        res,
-        """
-        SELECT 'amountEur', 'max', max(test_table.value) AS max_1
-        FROM test_table
-        WHERE test_table.prop = 'amountEur' AND test_table.canonical_id IN (SELECT DISTINCT test_table.canonical_id
-        FROM test_table
-        WHERE test_table.canonical_id IN (SELECT DISTINCT test_table.canonical_id
-        FROM test_table
-        WHERE test_table.dataset = 'test' AND test_table.schema = 'Project') AND test_table.prop_type = 'date' AND substring(test_table.value, 1, 4) = '2023')
-        """,
+    res = " ".join(str(res).split())
+    assert "substring(test_table.value, 1, 4) AS grouper" in res
+    assert "test_table.prop_type = 'date'" in res
+    assert "LIMIT" not in res
+    assert "UNION ALL" in res
+    assert "count(DISTINCT agg_values.canonical_id)" in res
+    res = q.sql.get_group_aggregations("dataset").compile(
+        compile_kwargs={"literal_binds": True}
     )
+    assert "test_table.dataset AS grouper" in str(res)
+    assert q.sql.get_group_aggregations("schema") is None
 
     # reversed
     q = Query().where(reverse="my_id").where(date=2023, schema="Event")
@@ -389,3 +442,82 @@ def test_sql_ids():
     #     """,
     #     str(q.sql.canonical_ids),
     # )
+
+
+def test_sql_typed():
+    q = Query().where(amountEur__gt=1000)
+    # formatted numbers are parsed, other values are not cast (NULL)
+    clause = str(q.sql.clause)
+    assert "CASE WHEN (trim(test_table.value) <regexp>" in clause
+    assert "ELSE NULL END > :param_1" in clause
+    q = Query().where(date__lte=2023)
+    assert "substring(test_table.value," in str(q.sql.clause)
+    q = Query().where(date__gte=2023)
+    assert "test_table.value >= :value_1" in str(q.sql.clause)
+
+
+def test_sql_materialized():
+    ids = Table("ids", MetaData(), Column("canonical_id", String(255)))
+    q = Query().where(dataset="test", amountEur__gt=1000)
+    sql = Sql(q, ids=ids)
+    # filters are not evaluated again
+    assert "CAST" not in str(sql.statements)
+    assert "FROM ids" in str(sql.statements)
+    assert _compare_str(sql.count, "SELECT count(*) AS count_1 FROM ids")
+    assert "FROM ids" in str(sql.things)
+    assert "CAST" not in str(sql.things)
+    assert "FROM ids" in str(Sql(q.aggregate("sum", "amountEur"), ids).aggregations)
+    # pagination over the materialized ids
+    assert " ".join(str(Sql(q[10:20], ids).canonical_ids).split()).endswith(
+        "ORDER BY ids.canonical_id LIMIT :param_1 OFFSET :param_2"
+    )
+    # scope without properties filters
+    q = Query().where(dataset="test")
+    assert "test_table.dataset = :dataset_1" in str(Sql(q, ids).statements)
+
+
+def test_sql_stats():
+    q = Query().where(dataset="test", schema="Payment")
+    stmt = str(q.sql.get_stats())
+    assert stmt.startswith("WITH stats_values AS")
+    assert stmt.count("UNION ALL") == 2
+    assert stmt.count("FROM stats_values") == 3
+    stmt = str(q.sql.get_stats(grouping_sets=True))
+    assert "GROUPING SETS" in stmt
+    assert "UNION ALL" not in stmt
+    assert stmt.count("FROM stats_values") == 1
+
+
+def test_sql_page():
+    q = Query().where(dataset="test")
+    stmt = " ".join(str(q.sql.get_page(10, {"id": "a"})).split())
+    assert "test_table.canonical_id > :canonical_id_1" in stmt
+    assert stmt.endswith("ORDER BY test_table.canonical_id LIMIT :param_1")
+    assert "OFFSET" not in stmt
+    q = q.order_by("amountEur", ascending=False)
+    stmt = " ".join(str(q.sql.get_page(10, {"id": "a", "values": [10]})).split())
+    assert "HAVING max(CASE WHEN" in stmt
+    assert "ELSE NULL END) < :max_1" in stmt
+    assert stmt.endswith(
+        "ORDER BY sortable_value DESC, test_table.canonical_id LIMIT :param_1"
+    )
+    assert "OFFSET" not in stmt
+
+
+def test_sql_entities():
+    entities = make_entity_table(MetaData(), "test_table_entities")
+    q = Query().where(dataset="test", schema="Payment")
+    stmt = " ".join(str(q.sql.get_entities(entities)).split())
+    assert stmt.startswith(
+        "SELECT test_table_entities.data FROM test_table_entities "
+        "WHERE test_table_entities.canonical_id IN"
+    )
+    assert stmt.endswith("ORDER BY test_table_entities.canonical_id")
+    assert q.sql.scoped_statements
+    q = q.order_by("amountEur", ascending=False)[:10]
+    assert not q.sql.scoped_statements
+    stmt = " ".join(str(q.sql.get_entities(entities)).split())
+    assert "JOIN (SELECT test_table.canonical_id AS canonical_id" in stmt
+    assert stmt.endswith(
+        "ORDER BY anon_1.sortable_value DESC, test_table_entities.canonical_id"
+    )
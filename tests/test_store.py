@@ -1,10 +1,15 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
 from nomenklatura.entity import CompositeEntity
+from sqlalchemy import func, inspect, select
 
+from ftmq.exceptions import ValidationError
 from ftmq.model import Catalog, Dataset
 from ftmq.query import Query
 from ftmq.store import AlephStore, MemoryStore, SQLStore, Store, get_store
 from ftmq.store.level import LevelDBStore
-from ftmq.util import make_dataset
+from ftmq.util import decode_cursor, encode_cursor, make_dataset, make_proxy, to_numeric
 
 # from ftmq.store.redis import RedisStore
 
@@ -76,6 +81,12 @@ def _run_store_test(cls: Store, proxies, **kwargs):
     res = [e for e in view.entities(q)]
     assert all(r.schema.name == "Payment" for r in res)
     assert len(res) == 21
+    q = Query().where(schema="Payment", amountEur__gt=100000)
+    res = [e for e in view.entities(q)]
+    assert len(res) == 110
+    q = Query().where(schema="Payment", date__gt=2010)
+    res = [e for e in view.entities(q)]
+    assert len(res) == 21
 
     # stats
     q = Query().where(dataset="eu_authorities")
@@ -112,6 +123,15 @@ def _run_store_test(cls: Store, proxies, **kwargs):
     assert len(res) == 10
     assert res[0].get("payer") == ["efccc434cdf141c7ba6f6e539bb6b42ecd97c368"]
 
+    # multi-key ordering
+    q = Query().where(schema="Payment", date__gte=2011)
+    for ascending in (True, False):
+        sorted_q = q.order_by("date", "amountEur", ascending=ascending)
+        res = [e for e in view.entities(sorted_q)]
+        keys = [(e.first("date"), to_numeric(e.first("amountEur"))) for e in res]
+        assert len(keys) == 21
+        assert keys == sorted(keys, reverse=not ascending)
+
     q = Query().where(schema="Person").order_by("name")[0]
     res = [e for e in view.entities(q)]
     assert len(res) == 1
@@ -188,6 +208,51 @@ def _run_store_test(cls: Store, proxies, **kwargs):
     res = view.aggregations(q)
     assert res == {"avg": {"amountEur": 139964.44534482757}}
 
+    # sketches
+    q = Query().where(dataset="donations").aggregate("approx_count", "id")
+    q = q.aggregate("quantile", "amountEur").aggregate("top", "country")
+    res = view.aggregations(q)
+    assert abs(res["approx_count"]["id"] - 474) < 474 * 0.05
+    assert res["quantile"]["amountEur"]["0.5"] == 100000
+    assert tuple(res["top"]["country"][0]) == ("de", 163)
+
+    # cursor pagination
+    q = Query().where(schema="Payment", date__gt=2010)
+    for q in (
+        q,
+        q.order_by("amountEur"),
+        q.order_by("date", ascending=False),
+        q.order_by("date", "amountEur", ascending=False),
+    ):
+        expected = [e.id for e in view.entities(q)]
+        if not q.sort:
+            expected = sorted(expected)
+        res, cursor = [], None
+        for _ in range(3):
+            page, cursor = view.page(q, cursor, limit=10)
+            res.extend([e.id for e in page])
+            if cursor is None:
+                break
+        assert len(page) == 1
+        assert cursor is None
+        assert res == expected
+    page, cursor = view.page(q, limit=21)
+    assert len(page) == 21
+    assert cursor is None
+    with pytest.raises(ValidationError):
+        view.page(q[:10])
+    with pytest.raises(ValidationError):
+        view.page(q, "invalid")
+    # keyset pagination of unsorted queries, a cursor of a sorted query needs
+    # to point to an entity of the results
+    q = Query().where(schema="Payment", date__gt=2010)
+    expected = sorted(e.id for e in view.entities(q))
+    page, cursor = view.page(q, encode_cursor({"id": "0"}), limit=3)
+    assert [e.id for e in page] == expected[:3]
+    if not isinstance(store, SQLStore):
+        with pytest.raises(ValidationError):
+            view.page(q.order_by("date"), encode_cursor({"id": "unknown"}))
+
     # reversed
     entity_id = "783d918df9f9178400d6b3386439ab3b3679979c"
     q = Query().where(reverse=entity_id)
@@ -198,6 +263,17 @@ def _run_store_test(cls: Store, proxies, **kwargs):
         assert entity_id in proxy.get("beneficiary")
         tested = True
     assert tested
+    q = Query().where(reverse=entity_id, schema="Payment", date__gte=2007)
+    assert len([p for p in view.entities(q)]) == 37
+    q = Query().where(reverse__in=[entity_id, "eu-authorities-chafea"])
+    assert len([p for p in view.entities(q)]) == 53
+
+    # adjacents
+    adjacents = {p.id for p in view.get_adjacents(res)}
+    assert entity_id in adjacents
+    entity = view.get_entity(entity_id)
+    adjacents = {p.id for p in view.get_adjacents([entity], inverted=True)}
+    assert {p.id for p in res} <= adjacents
 
     q = Query().where(reverse=entity_id, schema="Payment")
     q = q.where(prop="date", value=2007, comparator="gte")
@@ -227,6 +303,43 @@ def _run_store_test(cls: Store, proxies, **kwargs):
     res = [p for p in view.entities(q)]
     assert len(res) == 151
 
+    # explain
+    q = Query().where(dataset="donations", schema="Payment", date__gt=2010)
+    data = view.explain(q)
+    assert data["query"] == q.serialize()
+    assert "count" not in data
+    data = view.explain(q, analyze=True)
+    assert data["count"] == 21
+    assert data["timings"]
+    if isinstance(store, SQLStore):
+        assert "SELECT" in data["sql"]["statements"]
+        assert data["plan"]["statements"]
+
+        # materialized id set
+        q = Query().where(dataset="donations", schema="Payment", date__gt=2010)
+        agg = q.aggregate("sum", "amountEur", groups="beneficiary")
+        stats = view.stats(q).model_dump()
+        aggs = view.aggregations(agg)
+        page = [e.id for e in view.entities(q.order_by("amountEur")[:10])]
+        view = store.query()
+        with view.materialize(q) as mq:
+            assert "ftmq_ids_" in view.explain(mq)["sql"]["count"]
+            assert view.stats(mq).model_dump() == stats
+            assert view.aggregations(agg) == aggs
+            res = [e.id for e in view.entities(mq.order_by("amountEur")[:10])]
+            assert res == page
+            res = [e.id for e in view.entities(mq[:10])]
+            res.extend([e.id for e in view.entities(mq[10:20])])
+            assert len(set(res)) == 20
+            # other threads use their own connections without the temp tables
+            with ThreadPoolExecutor(1) as pool:
+                sorted_q = q.order_by("amountEur")[:10]
+                res = pool.submit(lambda: [e.id for e in view.entities(sorted_q)])
+                assert res.result() == page
+                sql = pool.submit(lambda: view.explain(q)["sql"]["count"]).result()
+                assert "ftmq_ids_" not in sql
+        assert not view.get_materialized()
+
     return True
 
 
@@ -235,6 +348,26 @@ def test_store_memory(proxies):
     assert _run_store_test(MemoryStore, proxies)
 
 
+def test_store_memory_reverse_scope():
+    store = MemoryStore()
+    with store.writer() as bulk:
+        for dataset, id_ in (("a", "o1"), ("b", "o2")):
+            proxy = {"id": id_, "schema": "Ownership", "properties": {"owner": ["p1"]}}
+            bulk.add_entity(make_proxy(proxy, dataset))
+        proxy = {"id": "p1", "schema": "Person", "properties": {"name": ["Jane"]}}
+        bulk.add_entity(make_proxy(proxy, "a"))
+    q = Query().where(reverse="p1")
+    view = store.query(make_dataset("a"))
+    assert [e.id for e in view.entities(q)] == ["o1"]
+    assert view.explain(q)["plan"]["index"] == "inverted"
+    person = view.get_entity("p1")
+    assert [e.id for e in view.get_adjacents([person], inverted=True)] == ["o1"]
+    view = store.query(make_dataset("b"))
+    assert [e.id for e in view.entities(q)] == ["o2"]
+    view = store.query(store.get_catalog().get_scope())
+    assert [e.id for e in view.entities(q)] == ["o1", "o2"]
+
+
 def test_store_leveldb(tmp_path, proxies):
     path = tmp_path / "level.db"
     assert _run_store_test_implicit(MemoryStore, proxies)
@@ -246,10 +379,278 @@ def test_store_sql_sqlite(tmp_path, proxies):
     uri = f"sqlite:///{tmp_path}/test.db"
     assert _run_store_test_implicit(SQLStore, proxies, uri=uri)
 
-    from nomenklatura.db import get_metadata
+    assert _run_store_test(SQLStore, proxies, uri=uri)
 
-    get_metadata.cache_clear()
+    # query indexes
+    store = SQLStore(uri=uri, fetch_size=7)
+    assert len([e for e in store.iterate()]) == 474 + 151
+    names = store.optimize()
+    assert len(names) == 5
+    indexes = {i["name"] for i in inspect(store.engine).get_indexes(store.table.name)}
+    assert set(names) <= indexes
+    q = Query().where(schema="Payment", date__gt=2010)
+    assert len([e for e in store.query().entities(q)]) == 21
+    assert store.optimize() == names  # idempotent
+    store.optimize(drop=True)
+    indexes = {i["name"] for i in inspect(store.engine).get_indexes(store.table.name)}
+    assert not set(names) & indexes
+
+    # sort keys
+    assert store.sort_keys is None
+    names = store.optimize(sort_keys=True)
+    assert len(names) == 9
+    assert store.sort_keys is not None
+    q = Query().where(schema="Payment").order_by("amountEur", ascending=False)
+    assert store.query().get_sql(q).use_sort_keys
+    assert not store.query().get_sql(q.order_by("amountEur", "name")).use_sort_keys
+    # the sort keys are used by new store instances and kept up to date on write
+    assert _run_store_test(SQLStore, proxies, uri=uri)
+    with store.writer() as bulk:
+        bulk.add_entity(
+            make_proxy(
+                {
+                    "id": "payment-sort-keys",
+                    "schema": "Payment",
+                    "properties": {"amountEur": ["1,000,000"], "date": ["2012"]},
+                },
+                "donations",
+            )
+        )
+    q = Query().where(schema="Payment", amountEur__lt=1_030_000)
+    q = q.order_by("amountEur", ascending=False)
+    assert store.query().get_sql(q).use_sort_keys
+    assert [e.id for e in store.query().entities(q[:1])] == ["payment-sort-keys"]
+    store.optimize(drop=True, sort_keys=True)
+    assert store.sort_keys is None
+    assert not inspect(store.engine).has_table(f"{store.table.name}_sort_keys")
+
+    # typed value columns
+    assert store.typed_table is None
+    names = store.optimize(typed_values=True)
+    assert len(names) == 7
+    assert store.typed_table is not None
+    columns = {c["name"] for c in inspect(store.engine).get_columns("test_table")}
+    assert {"value_num", "value_date"} <= columns
+    q = Query().where(amountEur__gte=1_000_000)
+    assert store.query().get_sql(q).typed
+    # the formatted amount is parsed on write, the cast in sql would stop at ","
+    res = {e.id for e in store.query().entities(q)}
+    assert len(res) == 4
+    assert "payment-sort-keys" in res
+    # numbers instead of strings ("980000")
+    q = Query().where(dataset="donations").aggregate("max", "amountEur")
+    assert store.query().aggregations(q) == {"max": {"amountEur": 2334526}}
+    # numbers and dates combined in one union
+    q = q.aggregate("min", "amountEur").aggregate("max", "date")
+    q = q.aggregate("sum", "amountEur")
+    res = store.query().aggregations(q)
+    assert res["max"] == {"amountEur": 2334526, "date": "2012"}
+    assert res["min"] == {"amountEur": 50000}
+    assert isinstance(res["sum"]["amountEur"], float)
+    with store.writer() as bulk:
+        bulk.pop("payment-sort-keys")
+        bulk.add_entity(
+            make_proxy(
+                {
+                    "id": "payment-typed",
+                    "schema": "Payment",
+                    "properties": {"amountEur": ["3.000.000,5"], "date": ["2013-05"]},
+                },
+                "donations",
+            )
+        )
+    q = Query().where(amountEur__gt=2_400_000, date__gt="2013-04")
+    assert [e.id for e in store.query().entities(q)] == ["payment-typed"]
+    with store.writer() as bulk:
+        bulk.pop("payment-typed")
+    # non-finite numbers are valid values but have no typed number
+    with store.writer() as bulk:
+        bulk.add_entity(
+            make_proxy(
+                {
+                    "id": "payment-nan",
+                    "schema": "Payment",
+                    "properties": {"amountEur": ["nan", "inf"]},
+                },
+                "donations",
+            )
+        )
+    with store.engine.connect() as conn:
+        table = store.typed_table
+        rows = conn.execute(
+            select(table.c.value, table.c.value_num).where(
+                table.c.entity_id == "payment-nan", table.c.prop == "amountEur"
+            )
+        ).all()
+    assert sorted(rows) == [("inf", None), ("nan", None)]
+    assert store.query().get_entity("payment-nan") is not None
+    with store.writer() as bulk:
+        bulk.pop("payment-nan")
+    # the typed values are used by new store instances and kept up to date
     assert _run_store_test(SQLStore, proxies, uri=uri)
+    store.optimize(drop=True, typed_values=True)
+    assert store.typed_table is None
+    columns = {c["name"] for c in inspect(store.engine).get_columns("test_table")}
+    assert not {"value_num", "value_date"} & columns
+
+    # pre-assembled entities
+    def _dump(entities):
+        # the order of multiple values of a property is not defined
+        return [
+            (
+                e.id,
+                e.schema.name,
+                e.datasets,
+                e.referents,
+                {k: set(v) for k, v in e.properties.items()},
+            )
+            for e in entities
+        ]
+
+    view = store.query()
+    q = Query().where(dataset="donations", schema="Payment").order_by("amountEur")
+    scoped = Query().where(dataset="donations").where(schema="Person")
+    expected = [_dump(view.entities(q)), _dump(view.entities(scoped))]
+    assert store.entity_table is None
+    store.optimize(entities=True)
+    assert store.entity_table is not None
+    with store.engine.connect() as conn:
+        table = store.entity_table
+        assert conn.execute(select(func.count()).select_from(table)).scalar() == 625
+    view = store.query()
+    assert [_dump(view.entities(q)), _dump(view.entities(scoped))] == expected
+    assert _dump(view.entities(q[:5])) == expected[0][:5]
+    # the entities are used by new store instances and kept up to date on write
+    assert _run_store_test(SQLStore, proxies, uri=uri)
+    with store.writer() as bulk:
+        bulk.add_entity(
+            make_proxy(
+                {
+                    "id": "payment-entities",
+                    "schema": "Payment",
+                    "properties": {"amountEur": ["1"], "date": ["2012"]},
+                },
+                "donations",
+            )
+        )
+    assert store.query().get_entity("payment-entities").get("date") == ["2012"]
+    with store.writer() as bulk:
+        bulk.pop("payment-entities")
+    assert store.query().get_entity("payment-entities") is None
+    store.optimize(drop=True, entities=True)
+    assert store.entity_table is None
+    assert not inspect(store.engine).has_table(f"{store.table.name}_entities")
+
+
+def test_store_sql_numeric_formats(tmp_path):
+    amounts = ("5", "1,000", "1.000,50", "2.5", "n/a", "1e3", "nan")
+    proxies = [
+        make_proxy(
+            {"id": f"p-{i}", "schema": "Payment", "properties": {"amount": [amount]}},
+            "test",
+        )
+        for i, amount in enumerate(amounts)
+    ]
+    memory = MemoryStore(dataset=make_dataset("test"))
+    sql = SQLStore(uri=f"sqlite:///{tmp_path}/test.db", dataset=make_dataset("test"))
+    for store in (memory, sql):
+        with store.writer() as bulk:
+            for proxy in proxies:
+                bulk.add_entity(proxy)
+    queries = (
+        Query().where(amount__gt=3),
+        Query().where(amount__lte=1000),
+        Query().where(amount__gte=1000.5),
+    )
+    for q in queries:
+        expected = sorted(e.id for e in memory.query().entities(q))
+        assert sorted(e.id for e in sql.query().entities(q)) == expected
+    assert expected == ["p-2"]
+    # values that are not numbers are sorted like missing values
+    q = Query().where(dataset="test").order_by("amount")
+    res = [e.id for e in sql.query().entities(q)]
+    assert [i for i in res if i not in ("p-4", "p-6")] == [
+        "p-3",
+        "p-0",
+        "p-1",
+        "p-5",
+        "p-2",
+    ]
+
+
+def test_store_sql_page_scope(tmp_path):
+    store = SQLStore(uri=f"sqlite:///{tmp_path}/page.db")
+    with store.writer() as bulk:
+        for dataset, name in (("a", "Alice"), ("b", "Bob")):
+            proxy = {"id": "x", "schema": "Person", "properties": {"name": [name]}}
+            bulk.add_entity(make_proxy(proxy, dataset))
+    view = store.query(store.get_catalog().get_scope())
+    q = Query().where(dataset="a")
+    for entities in (False, True):
+        if entities:
+            store.optimize(entities=True)
+        assert [e.get("name") for e in view.entities(q)] == [["Alice"]]
+        page, _ = view.page(q)
+        assert [e.get("name") for e in page] == [["Alice"]]
+        page, _ = view.page(Query())
+        assert sorted(page[0].get("name")) == ["Alice", "Bob"]
+
+
+def test_store_sql_page_decimal(tmp_path):
+    store = SQLStore(uri=f"sqlite:///{tmp_path}/page.db", dataset="test")
+    amounts = ("12345678901234567.5", "12345678901234567.5", "0.1", "0.30", "3")
+    with store.writer() as bulk:
+        for ix, amount in enumerate(amounts):
+            proxy = {"id": f"p-{ix}", "schema": "Payment"}
+            proxy["properties"] = {"amount": [amount]}
+            bulk.add_entity(make_proxy(proxy, "test"))
+    view = store.query()
+    q = Query().order_by("amount", ascending=False)
+    expected = [e.id for e in view.entities(q)]
+    res, cursor = [], None
+    while True:
+        page, cursor = view.page(q, cursor, limit=1)
+        res.extend(e.id for e in page)
+        if cursor is None:
+            break
+        # numeric sort values are not converted to (lossy) floats
+        value = decode_cursor(cursor)["values"][0]
+        assert set(value) == {"decimal"}
+    assert res == expected
+    assert len(res) == 5
+    with pytest.raises(ValidationError):
+        view.page(q, encode_cursor({"id": "p-0", "values": [{"decimal": "a"}]}))
+
+
+def test_store_sql_load(tmp_path, proxies):
+    from ftmq.store.sql import to_copy_value
+
+    store = SQLStore(uri=f"sqlite:///{tmp_path}/load.db")
+    assert store.is_empty()
+    with store.engine.connect() as conn:
+        # opening a store doesn't change the database file
+        assert conn.exec_driver_sql("PRAGMA journal_mode").scalar() == "delete"
+        assert conn.exec_driver_sql("PRAGMA temp_store").scalar() == 2
+        synchronous = conn.exec_driver_sql("PRAGMA synchronous").scalar()
+    assert not (tmp_path / "load.db-wal").exists()
+    indexes = {i["name"] for i in inspect(store.engine).get_indexes("test_table")}
+    assert store.load(proxies, defer_indexes=True) == 474 + 151
+    assert not store.is_empty()
+    assert len([e for e in store.iterate()]) == 474 + 151
+    assert {i["name"] for i in inspect(store.engine).get_indexes("test_table")} == (
+        indexes
+    )
+    with store.engine.connect() as conn:
+        # read profile is restored after loading
+        assert conn.exec_driver_sql("PRAGMA synchronous").scalar() == synchronous
+        assert conn.exec_driver_sql("PRAGMA journal_mode").scalar() == "wal"
+    # loading again updates the existing statements
+    assert store.load(proxies) == 474 + 151
+    assert len([e for e in store.iterate()]) == 474 + 151
+
+    assert to_copy_value(None) == "\\N"
+    assert to_copy_value(True) == "t"
+    assert to_copy_value("a\tb\nc\\N") == "a\\tb\\nc\\\\N"
 
 
 def test_store_init(tmp_path):
@@ -262,6 +663,9 @@ def test_store_init(tmp_path):
     assert isinstance(store, LevelDBStore)
     store = get_store("sqlite:///:memory:")
     assert isinstance(store, SQLStore)
+    assert store.fetch_size == 10_000
+    store = get_store("sqlite:///:memory:", fetch_size=100)
+    assert store.fetch_size == 100
     store = get_store(dataset="test_dataset")
     assert store.dataset.name == "test_dataset"
     store = get_store("http+aleph://test_dataset@aleph.example.org")
@@ -1,5 +1,5 @@
 import sys
-from datetime import datetime
+from datetime import date, datetime
 
 import cloudpickle
 import pytest
@@ -64,6 +64,23 @@ def test_util_numeric():
     assert util.to_numeric("1,101,000") == 1_101_000
     assert util.to_numeric("1.000,1") == 1000.1
     assert util.to_numeric("foo") is None
+    # not finite
+    assert util.to_numeric("nan") is None
+    assert util.to_numeric("inf") is None
+    assert util.to_numeric("-Infinity") is None
+    assert util.to_numeric("1e400") is None
+
+
+def test_util_date():
+    assert util.to_date("2023") == date(2023, 1, 1)
+    assert util.to_date("2023-05") == date(2023, 5, 1)
+    assert util.to_date("2023-05-17T10:00:00") == date(2023, 5, 17)
+    assert util.to_date("2023-13") is None
+    assert util.to_date("foo") is None
+    assert util.get_date_after("2023") == date(2024, 1, 1)
+    assert util.get_date_after("2023-12") == date(2024, 1, 1)
+    assert util.get_date_after("2023-02-28") == date(2023, 3, 1)
+    assert util.get_date_after("foo") is None
 
 
 def test_util_parse_lookup_key():